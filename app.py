@@ -1,12 +1,15 @@
-import json
+import numpy as np
 from app_factory import AppFactory
-from flask import render_template, request, redirect, jsonify, session, flash
+from flask import render_template, request, redirect, jsonify, session, flash, Response
 from util import Util
 
 # Create the Flask app
 factory = AppFactory()
 app = factory.get_app()
 
+# Largest number of tracks whose album images can be requested at once (Spotify's limit for getting tracks)
+artwork_batch_size = 50
+
 
 # Route for home page
 @app.route('/')
@@ -123,7 +126,11 @@ def recommendations():
     energy = session.get('energy')  # User's energy (0-100)
     goal = session.get('goal')  # User's goal (lift_me_up, chill_me_out, etc.)
     preferences = session.get('preferences')  # User's preferences (artists, genres, popularity, instrumental)
-    recommended_ids = session.get('recommended_ids', [])  # List of recommended track IDs
+    recommended_positions = session.get('recommended_positions', [])  # Sorted row positions of recommended tracks
+
+    # Row positions are only valid for the dataset they were recorded against
+    if session.get('recommended_version') != app.track_data.checksum:
+        recommended_positions = []
 
     # Validate session variables
     if not valence or not energy:
@@ -136,11 +143,13 @@ def recommendations():
     try:
         # Get recommendations and render page
         recommendations = []
-        recommendations = app.recommender.get_recommendations(valence, energy, goal, preferences, recommended_ids)
+        recommendations = app.recommender.get_recommendations(valence, energy, goal, preferences,
+                                                              recommended_positions=recommended_positions)
 
-        # Store recommended track IDs in the session
-        new_ids = [track['track_id'] for track in recommendations]
-        session['recommended_ids'] = recommended_ids + new_ids
+        # Store the row positions of the recommended tracks in the session
+        new_positions = [track['position'] for track in recommendations]
+        session['recommended_positions'] = np.union1d(recommended_positions, new_positions).astype(int).tolist()
+        session['recommended_version'] = app.track_data.checksum
     except Exception as e:
         flash(str(e), "error")
 
@@ -189,10 +198,89 @@ def logout():
     return render_template('logout.html')
 
 
-# Get list of artists
+# Get list of artists.
+# The response is encoded once per dataset version and served with an ETag,
+# so clients revalidate their copy and get a 304 response while the list is unchanged.
+# Responses may carry the user's refreshed session cookie, so only the browser may cache them, not shared caches.
 @app.route('/api/artists')
 def artists():
-    return json.dumps(app.track_data.get_all_artists(), separators=(',', ':'))
+    payload = app.track_data.get_artists_json()
+
+    # Send the pre-compressed body if the client accepts gzip.
+    # Each encoding is a different representation, so it gets its own strong ETag.
+    if request.accept_encodings['gzip']:
+        response = Response(payload['gzip'], mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(f"{payload['etag']}-gzip")
+    else:
+        response = Response(payload['body'], mimetype='application/json')
+        response.set_etag(payload['etag'])
+
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
+
+
+# Search for artists by name.
+# Matches artists whose name starts with the query, ignoring case and accents.
+# Results are paginated: page is 1-based and limit is capped at 100.
+@app.route('/api/artists/search')
+def search_artists():
+    query = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+
+    artists, total = app.track_data.search_artists(query, offset=(page - 1) * limit, limit=limit)
+    return jsonify({
+        "artists": artists,
+        "page": page,
+        "total": total,
+        "has_more": page * limit < total
+    })
+
+
+# Get album images for recommended tracks.
+# Expects a comma-separated list of Spotify track IDs in the ids parameter, at most one Spotify batch.
+# The recommendations page loads these after rendering, so it does not wait for the Spotify API.
+@app.route('/api/artwork')
+def artwork():
+    if not session.get('logged_in'):
+        return jsonify({"error": "You are not logged in."}), 401
+
+    track_ids = list(dict.fromkeys(track_id for track_id in request.args.get('ids', '').split(',') if track_id))
+    if not track_ids:
+        return jsonify({"error": "No track IDs provided."}), 400
+    if len(track_ids) > artwork_batch_size:
+        return jsonify({"error": f"At most {artwork_batch_size} track IDs can be requested at once."}), 400
+
+    try:
+        images = app.spotify_service.get_album_images(track_ids)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 502
+
+    response = jsonify({"images": images})
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
+# Get the album image cache statistics: the number of images stored for all workers, and the lookups of this worker
+# process, including the share of images found without calling Spotify
+@app.route('/api/artwork/stats')
+def artwork_stats():
+    if not session.get('logged_in'):
+        return jsonify({"error": "You are not logged in."}), 401
+
+    return jsonify(app.spotify_service.artwork_store.stats())
+
+
+# Get the state of the Spotify call budget shared by all workers, and the counters of calls to Spotify made by this
+# worker process, including calls that were throttled and retried
+@app.route('/api/spotify/stats')
+def spotify_stats():
+    if not session.get('logged_in'):
+        return jsonify({"error": "You are not logged in."}), 401
+
+    return jsonify(app.spotify_service.rate_limiter.stats())
 
 
 # Add tracks to queue.
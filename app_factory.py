@@ -5,12 +5,14 @@ import secrets
 import sqlite3 as sql
 import time
 
+from artwork_store import ArtworkStore
 from datetime import timedelta
 from flask import Flask, g
 from flask_session import Session
 from flask_talisman import Talisman
 from flask_wtf import CSRFProtect
 from logging.handlers import RotatingFileHandler
+from rate_limit import RateLimiter
 from recommend import RecommendationEngine
 from spotify_service import SpotifyService
 from track_data import TrackData
@@ -92,13 +94,24 @@ class AppFactory:
             redirect_uri=sp_redirect_uri
         )
 
-        # Load and prepare track data
+        # Load and prepare track data.
+        # A binary snapshot in the instance folder lets later starts skip parsing the CSV file.
         track_data = TrackData()
-        track_data.load_csv(os.path.join(self.app.project_dir, 'datasets/track_data.csv'))
+        track_data.load_csv(os.path.join(self.app.project_dir, 'datasets/track_data.csv'),
+                            snapshot_path=os.path.join(self.app.instance_path, 'track_data.snapshot'))
+
+        # Optionally load precomputed mood tables for the slider positions, built on first use.
+        # They take some time to build and memory to hold, but speed up ranking tracks by mood.
+        if os.environ.get('MOOD_TABLES') == '1':
+            track_data.load_mood_tables(os.path.join(self.app.instance_path, 'mood_tables.snapshot'))
 
         # Initialise recommender
         recommender = RecommendationEngine(track_data, spotify_service)
 
+        # Optionally score large candidate sets in shards on several threads
+        if os.environ.get('SCORING_WORKERS'):
+            recommender.scoring_workers = int(os.environ['SCORING_WORKERS'])
+
         # Create instance of user store
         user_store = UserStore(self.app)
 
@@ -107,6 +120,13 @@ class AppFactory:
         self.app.db_schema_path = os.path.join(self.app.project_dir, 'sql/schema.sql')
         self._initialise_db()
 
+        # Keep album image URLs in the database, so each track's image is only fetched from Spotify once
+        spotify_service.artwork_store = ArtworkStore(self.app.db_path)
+
+        # Budget calls to Spotify across all workers, putting playback commands ahead of fetching album images.
+        # The budget is taken on every call, so it is kept in its own database to not hold up other writes.
+        spotify_service.rate_limiter = RateLimiter(os.path.join(self.app.instance_path, 'rate_limit.db'))
+
         # Attach services to the app
         self.app.spotify_service = spotify_service
         self.app.track_data = track_data
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from cache import LRUCache
+from connections import ThreadConnections
+
+
+# Persistent store of album image URLs by Spotify track ID.
+# Image URLs are kept in the artwork table of an SQLite database, shared by all app workers, with an in-process
+# LRU cache in front of it. Entries older than ttl seconds are treated as missing, so they are fetched again.
+# A track can be stored without an image URL, so tracks that Spotify has no image for are not fetched every time.
+# Counts lookups answered from memory, from the database and not at all in this process. Safe to use from several
+# threads.
+class ArtworkStore:
+    # Largest number of track IDs looked up in one query, within SQLite's limit on query parameters
+    query_batch_size = 500
+
+    def __init__(self, db_path: str, ttl: float = 30 * 24 * 3600, max_entries: int = 100_000):
+        self.db_path = db_path
+        self.ttl = ttl
+
+        # Most recently used entries: track ID -> (image URL or None, time fetched)
+        self.memory_cache = LRUCache(max_entries=max_entries)
+
+        # Database connections, one per thread
+        self._connections = ThreadConnections(db_path)
+
+        # Counters
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+        # Create the artwork table if it doesn't exist
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql/artwork.sql')) as f:
+            self._connections.get().executescript(f.read())
+
+    # Get the stored image URLs of tracks, as a dictionary of track ID to image URL, or None for tracks without one.
+    # Tracks that are not stored or have expired are left out, so they can be fetched and added with put_many.
+    def get_many(self, track_ids: list[str]) -> dict[str, str | None]:
+        fetched_after = time.time() - self.ttl
+        images = {}
+        missing = []
+        for track_id in dict.fromkeys(track_ids):
+            entry = self.memory_cache.get(track_id)
+            if entry is not None and entry[1] > fetched_after:
+                images[track_id] = entry[0]
+            else:
+                missing.append(track_id)
+        memory_hits = len(images)
+
+        # Look up the rest in the database, and keep them in memory for next time
+        conn = self._connections.get()
+        for start in range(0, len(missing), self.query_batch_size):
+            batch = missing[start:start + self.query_batch_size]
+            rows = conn.execute(
+                f"SELECT track_id, image_url, fetched_at FROM artwork "
+                f"WHERE fetched_at > ? AND track_id IN ({', '.join('?' * len(batch))})",
+                (fetched_after, *batch)
+            ).fetchall()
+            for track_id, image_url, fetched_at in rows:
+                images[track_id] = image_url
+                self.memory_cache.put(track_id, (image_url, fetched_at))
+
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.store_hits += len(images) - memory_hits
+            self.misses += len(missing) - (len(images) - memory_hits)
+        return images
+
+    # Add or replace the image URLs of tracks, given as a dictionary of track ID to image URL, or None for tracks
+    # without one
+    def put_many(self, images: dict[str, str | None]) -> None:
+        fetched_at = time.time()
+        conn = self._connections.get()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO artwork (track_id, image_url, fetched_at) VALUES (?, ?, ?)",
+                [(track_id, image_url, fetched_at) for track_id, image_url in images.items()]
+            )
+        for track_id, image_url in images.items():
+            self.memory_cache.put(track_id, (image_url, fetched_at))
+
+    # Get the number of unexpired tracks in the database, shared by all app workers, and the number of tracks in
+    # memory, the counters and the share of lookups answered without Spotify in this process
+    def stats(self) -> dict[str, int | dict[str, int | float]]:
+        stored = self._connections.get().execute("SELECT COUNT(*) FROM artwork WHERE fetched_at > ?",
+                                            (time.time() - self.ttl,)).fetchone()[0]
+        with self._lock:
+            lookups = self.memory_hits + self.store_hits + self.misses
+            return {
+                "stored": stored,
+                "process": {
+                    "entries": len(self.memory_cache),
+                    "memory_hits": self.memory_hits,
+                    "store_hits": self.store_hits,
+                    "misses": self.misses,
+                    "hit_ratio": (self.memory_hits + self.store_hits) / lookups if lookups else 0.0
+                }
+            }
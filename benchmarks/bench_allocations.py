@@ -0,0 +1,82 @@
+"""
+Memory allocation benchmark for the scoring path of the recommendation engine.
+
+Runs RecommendationEngine.get_recommendations for random users on a synthetic
+catalog, with scoring arrays allocated for every block and request and with
+per-thread scratch arrays reused across requests. Uses tracemalloc to measure
+the peak memory allocated while serving each request, on top of what was
+allocated before it. Taste similarity scores are cached by a first pass over
+the users, so only the scoring itself is measured.
+Reports the mean and largest peak per request, the time per request (with
+tracemalloc running) and whether both return the same tracks.
+
+Usage:
+    python -m benchmarks.bench_allocations --rows 1000000 --users 50 [--indexed]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from benchmarks.bench_batch import make_users
+from benchmarks.catalog import write_catalog_csv
+from recommend import RecommendationEngine
+from track_data import TrackData
+
+
+# Serve all users, returning the peak memory allocated per request, the mean time per request and the results
+def run(engine: RecommendationEngine, users: list[tuple]) -> tuple[list[int], float, list]:
+    np.random.seed(0)
+    for user in users:
+        engine.get_recommendations(*user)
+
+    np.random.seed(0)
+    peaks = []
+    results = []
+    elapsed = 0
+    tracemalloc.start()
+    for user in users:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        results.append(engine.get_recommendations(*user))
+        elapsed += time.perf_counter() - start
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return peaks, elapsed / len(users), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='number of tracks in the synthetic catalog')
+    parser.add_argument('--users', type=int, default=50, help='number of users to recommend for')
+    parser.add_argument('--indexed', action='store_true', help='rank large candidate sets through the mood index')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'track_data.csv')
+        write_catalog_csv(csv_path, args.rows)
+        track_data = TrackData()
+        track_data.load_csv(csv_path)
+    users = make_users(track_data, args.users)
+
+    print(f"{args.rows:,} tracks, {args.users} users ({'indexed' if args.indexed else 'full'} scoring)")
+    base_results = None
+    for name, scratch_buffers in (('allocated', False), ('scratch', True)):
+        # No Spotify service: recommendations do not call the Spotify API.
+        # The result cache is disabled, so every request scores its candidates.
+        engine = RecommendationEngine(track_data, None)
+        engine.result_cache.max_entries = 0
+        engine.scratch_buffers = scratch_buffers
+        if not args.indexed:
+            engine.mood_search_min_tracks = np.inf
+
+        peaks, request_time, results = run(engine, users)
+        base_results = base_results or results
+        print(f"{name:<10}{np.mean(peaks) / 2 ** 20:>8.2f} MiB mean peak  {max(peaks) / 2 ** 20:>8.2f} MiB max peak  "
+              f"{request_time * 1000:>8.1f} ms/request  identical results: {results == base_results}")
+
+
+if __name__ == '__main__':
+    main()
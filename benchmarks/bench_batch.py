@@ -0,0 +1,79 @@
+"""
+Throughput benchmark for batch recommendations.
+
+Generates random users (mood, goal and preferences) and compares calling
+RecommendationEngine.get_recommendations once per user with a single
+get_recommendations_batch call for all of them, on a synthetic catalog.
+Reports throughput in users per second and whether both return the same tracks.
+
+Usage:
+    python -m benchmarks.bench_batch --rows 1000000 --users 200
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from benchmarks.catalog import GENRES, write_catalog_csv
+from recommend import RecommendationEngine
+from track_data import TrackData
+
+
+# Generate random recommendation requests: (valence, energy, goal, preferences)
+def make_users(track_data: TrackData, count: int, seed: int = 0) -> list[tuple]:
+    rng = np.random.default_rng(seed)
+    goals = ["lift_me_up", "chill_me_out", "fire_me_up", "keep_me_here", "surprise_me"]
+
+    # Users pick from a handful of popular genre combinations, so they share candidate tracks
+    genre_choices = [[], ["Pop"], ["Rock"], ["Pop", "Rock"], ["Electronic", "Hip-Hop"], list(GENRES[:4])]
+    users = []
+    for _ in range(count):
+        preferences = {
+            "genres": genre_choices[rng.integers(len(genre_choices))],
+            "artists": list(rng.choice(track_data.artists, size=rng.integers(0, 4))),
+            "popularity": int(rng.integers(0, 101)),
+            "instrumentalness": round(float(rng.uniform(0, 1)), 2),
+        }
+        users.append((round(float(rng.uniform(0, 1)), 2), round(float(rng.uniform(0, 1)), 2),
+                      str(rng.choice(goals)), preferences))
+    return users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='number of tracks in the synthetic catalog')
+    parser.add_argument('--users', type=int, default=200, help='number of users to recommend for')
+    args = parser.parse_args()
+
+    # Load the catalog through a snapshot, as the app does
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'track_data.csv')
+        write_catalog_csv(csv_path, args.rows)
+        track_data = TrackData()
+        track_data.load_csv(csv_path, snapshot_path=os.path.join(tmp_dir, 'track_data.snapshot'))
+
+    # No Spotify service: recommendations do not call the Spotify API.
+    # The result cache is disabled, so every single call scores the tracks like the batch does.
+    engine = RecommendationEngine(track_data, None)
+    engine.result_cache.max_entries = 0
+    users = make_users(track_data, args.users)
+
+    np.random.seed(0)
+    start = time.perf_counter()
+    single_results = [engine.get_recommendations(*user) for user in users]
+    single_time = time.perf_counter() - start
+
+    np.random.seed(0)
+    start = time.perf_counter()
+    batch_results = engine.get_recommendations_batch(users)
+    batch_time = time.perf_counter() - start
+
+    same = sum(single == batch for single, batch in zip(single_results, batch_results))
+    print(f"{args.rows:,} tracks, {args.users} users")
+    print(f"{'single':<10}{args.users / single_time:>10.1f} users/s")
+    print(f"{'batch':<10}{args.users / batch_time:>10.1f} users/s  ({single_time / batch_time:.1f}x)")
+    print(f"same recommendations: {same}/{args.users} users")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Per-worker memory benchmark for the track catalog.
+
+Starts several worker processes that each load the catalog, either by parsing the CSV file
+(every worker holds a private copy) or from the memory-mapped snapshot (workers share one copy),
+touches the numeric columns used for scoring, and reports the worker's memory use.
+
+Linux only: memory use is read from /proc/self/smaps_rollup.
+
+Usage:
+    python -m benchmarks.bench_memory --rows 1000000 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from benchmarks.catalog import write_catalog_csv
+from track_data import TrackData
+
+
+
+# Read resident, proportional and private memory of the current process, in MiB
+def memory_usage() -> dict:
+    usage = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                usage[parts[0][:-1]] = int(parts[1]) / 1024
+    return {
+        'rss': usage['Rss'],
+        'pss': usage['Pss'],
+        'private': usage['Private_Clean'] + usage['Private_Dirty'],
+    }
+
+
+# Worker process: load the catalog, touch the scoring columns, then report memory use
+def worker(csv_path: str, snapshot_path: str | None, ready, results) -> None:
+    baseline = memory_usage()
+
+    start = time.perf_counter()
+    track_data = TrackData()
+    track_data.load_csv(csv_path, snapshot_path=snapshot_path)
+    load_time = time.perf_counter() - start
+
+    # Touch every page of the numeric columns, as scoring a request without a genre filter would
+    total = 0.0
+    for column in ['valence', 'energy'] + track_data.taste_features:
+        total += float(track_data.df[column].to_numpy().sum())
+    total += int(track_data.genre_codes.sum()) + int(track_data.artist_codes.sum())
+
+    # Wait for all workers to load, so shared pages are counted across all of them
+    ready.wait()
+    usage = memory_usage()
+    results.put({
+        'load_time': load_time,
+        'rss': usage['rss'] - baseline['rss'],
+        'pss': usage['pss'] - baseline['pss'],
+        'private': usage['private'] - baseline['private'],
+    })
+    ready.wait()
+
+
+# Run all workers for one loading mode and return their results
+def run_workers(csv_path: str, snapshot_path: str | None, workers: int) -> list[dict]:
+    context = multiprocessing.get_context('spawn')
+    ready = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(csv_path, snapshot_path, ready, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    stats = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='number of tracks in the synthetic catalog')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker processes')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'track_data.csv')
+        snapshot_path = os.path.join(tmp_dir, 'track_data.snapshot')
+        write_catalog_csv(csv_path, args.rows)
+
+        # Build the snapshot once, as the first worker to start would
+        TrackData().load_csv(csv_path, snapshot_path=snapshot_path)
+
+        print(f"{args.rows:,} tracks, {args.workers} workers (per-worker averages, MiB)")
+        print(f"{'mode':<10}{'load s':>10}{'RSS':>10}{'PSS':>10}{'private':>10}")
+        for mode, path in (('csv', None), ('snapshot', snapshot_path)):
+            stats = run_workers(csv_path, path, args.workers)
+            avg = {key: sum(s[key] for s in stats) / len(stats) for key in stats[0]}
+            print(f"{mode:<10}{avg['load_time']:>10.2f}{avg['rss']:>10.1f}{avg['pss']:>10.1f}{avg['private']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
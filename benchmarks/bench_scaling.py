@@ -0,0 +1,72 @@
+"""
+Scaling benchmark for sharded scoring on several threads.
+
+Times RecommendationEngine.get_recommendations for random users on a synthetic
+catalog with 1 to N scoring workers, where N defaults to the number of CPUs.
+Each worker scores a shard of the candidates: taste similarity, then either
+the passes over all candidates of the mood index search (weighting, finding
+the seeds and the cold tier bound) or, with --full, the combined scores of
+every step. The cells searched through the mood index are scored in the
+request thread. The shards' results are then merged. Caches are disabled, so
+every request scores its candidates. Reports the time per request, the
+speedup over one worker and whether the recommendations are identical.
+
+Usage:
+    python -m benchmarks.bench_scaling --rows 2000000 --users 20 [--max-workers 8] [--full]
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from benchmarks.bench_batch import make_users
+from benchmarks.catalog import write_catalog_csv
+from recommend import RecommendationEngine
+from track_data import TrackData
+
+
+# Time an engine over all users, returning the mean time per request and the results
+def run(engine: RecommendationEngine, users: list[tuple]) -> tuple[float, list]:
+    np.random.seed(0)
+    start = time.perf_counter()
+    results = [engine.get_recommendations(*user) for user in users]
+    return (time.perf_counter() - start) / len(users), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2_000_000, help='number of tracks in the synthetic catalog')
+    parser.add_argument('--users', type=int, default=20, help='number of users to recommend for')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help='largest number of workers to time')
+    parser.add_argument('--full', action='store_true', help='score every candidate instead of searching the mood index')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'track_data.csv')
+        write_catalog_csv(csv_path, args.rows)
+        track_data = TrackData()
+        track_data.load_csv(csv_path)
+
+    # No Spotify service: recommendations do not call the Spotify API
+    engine = RecommendationEngine(track_data, None)
+    engine.result_cache.max_entries = 0
+    engine.similarity_cache.max_entries = 0
+    if args.full:
+        engine.mood_search_min_tracks = np.inf
+    users = make_users(track_data, args.users)
+
+    worker_counts = sorted({1, *(2 ** i for i in range(args.max_workers.bit_length())), args.max_workers})
+    print(f"{args.rows:,} tracks, {args.users} users, {os.cpu_count()} CPUs")
+    base_time = base_results = None
+    for workers in worker_counts:
+        engine.scoring_workers = workers
+        run(engine, users[:1])  # Warm up the thread pool
+        request_time, results = run(engine, users)
+        if base_time is None:
+            base_time, base_results = request_time, results
+        print(f"{workers:>3} workers{request_time * 1000:>10.1f} ms/request  ({base_time / request_time:.2f}x)  "
+              f"identical results: {results == base_results}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark for the mood-trajectory selection step of the recommendation engine.
+
+Compares RecommendationEngine._recommend_songs with the original implementation, which
+recomputed the distance to every candidate at every step and selected the best track with
+argmax, on a synthetic catalog. The engine is timed both scoring every candidate in blocks
+and searching the mood index, and optionally with precomputed mood tables as well.
+All must select exactly the same tracks.
+
+Usage:
+    python -m benchmarks.bench_selection --rows 1000000 --requests 20 [--mood-tables]
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.catalog import GENRES, write_catalog_csv
+from recommend import RecommendationEngine
+from track_data import TrackData
+
+
+# The original selection loop, kept as a reference for results and timings, with the row position of each track
+# added to its results
+class LegacyRecommendationEngine(RecommendationEngine):
+    def _recommend_songs(self, positions, similarity_scores, start_valence, start_energy, target_mood,
+                         recommended_ids=None, top_n=10, genres=None):
+        recommended_tracks = []
+        recommended_rows = []
+        used_indices = set()
+
+        if recommended_ids is not None:
+            mask = ~self.df['track_id'].isin(recommended_ids).to_numpy()
+            if positions is None:
+                positions = np.flatnonzero(mask)
+            else:
+                mask = mask[positions]
+                positions = positions[mask]
+            similarity_scores = np.asarray(similarity_scores)[mask]
+
+        track_vectors = np.column_stack([self._gather('valence', positions), self._gather('energy', positions)])
+        val_adj = (target_mood['target_valence'] - start_valence) / top_n
+        nrg_adj = (target_mood['target_energy'] - start_energy) / top_n
+        sqrt2 = np.sqrt(2)
+
+        for step in range(top_n):
+            step_valence = start_valence + val_adj * step
+            step_energy = start_energy + nrg_adj * step
+            step_vector = np.array([step_valence, step_energy])
+            distances = np.linalg.norm(track_vectors - step_vector, axis=1)
+            closeness = np.clip(1 - (distances / sqrt2), 0, 1)
+            combined_scores = closeness * self.weights['mood'] + similarity_scores * self.weights['non_mood']
+            if used_indices:
+                combined_scores[list(used_indices)] = -np.inf
+            if np.all(combined_scores == -np.inf):
+                break
+            best_index = int(np.argmax(combined_scores))
+            used_indices.add(best_index)
+            row = best_index if positions is None else positions[best_index]
+            recommended_tracks.append(self.df.iloc[row][["track_name", "artist", "track_id", "valence", "energy"]])
+            recommended_rows.append(int(row))
+
+        # The row positions are added as the engine returns them, so results can be compared as they are
+        return pd.DataFrame(recommended_tracks).assign(position=recommended_rows)
+
+
+# Generate random selection inputs: candidate positions, similarity scores and mood targets
+def make_requests(engine: RecommendationEngine, count: int, seed: int = 0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    goals = ["lift_me_up", "chill_me_out", "fire_me_up", "keep_me_here", "surprise_me"]
+    requests = []
+    for i in range(count):
+        # Half of the requests filter by genre
+        genres = list(rng.choice(GENRES, size=rng.integers(1, 4), replace=False)) if i % 2 else []
+        positions = engine.track_data.get_genre_positions(genres) if genres else None
+        num_tracks = len(engine.df) if positions is None else len(positions)
+
+        # Quantized similarity scores, so that ties between tracks are common
+        similarity_scores = np.round(rng.uniform(-1, 1, size=num_tracks), 2)
+
+        valence, energy = rng.uniform(0, 1, size=2).round(2)
+        requests.append({
+            'positions': positions,
+            'genres': genres or None,
+            'similarity_scores': similarity_scores,
+            'start_valence': float(valence),
+            'start_energy': float(energy),
+            'target_mood': engine._get_target_mood(str(rng.choice(goals)), float(valence), float(energy)),
+        })
+    return requests
+
+
+# Time an engine over all requests, returning the mean time per request and the results
+def run(engine: RecommendationEngine, requests: list[dict]) -> tuple[float, list]:
+    results = []
+    start = time.perf_counter()
+    for request in requests:
+        results.append(engine._recommend_songs(request['positions'], request['similarity_scores'].copy(),
+                                               request['start_valence'], request['start_energy'],
+                                               request['target_mood'], [], top_n=10, genres=request['genres']))
+    return (time.perf_counter() - start) / len(requests), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='number of tracks in the synthetic catalog')
+    parser.add_argument('--requests', type=int, default=20, help='number of requests to time')
+    parser.add_argument('--mood-tables', action='store_true', help='also time ranking with mood tables')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'track_data.csv')
+        write_catalog_csv(csv_path, args.rows)
+        track_data = TrackData()
+        track_data.load_csv(csv_path)
+        if args.mood_tables:
+            start = time.perf_counter()
+            track_data.load_mood_tables(os.path.join(tmp_dir, 'mood_tables.snapshot'))
+            print(f"mood tables built in {time.perf_counter() - start:.1f} s")
+            tables = (track_data.mood_table_rows, track_data.mood_table_radii)
+            track_data.mood_table_rows = track_data.mood_table_radii = None
+
+    engine = RecommendationEngine(track_data, None)
+    blocked_engine = RecommendationEngine(track_data, None)
+    blocked_engine.mood_search_min_tracks = np.inf
+    legacy_engine = LegacyRecommendationEngine(track_data, None)
+    requests = make_requests(engine, args.requests)
+
+    legacy_time, legacy_results = run(legacy_engine, requests)
+    legacy_results = [legacy.to_dict(orient='records') for legacy in legacy_results]
+    print(f"{args.rows:,} tracks, {args.requests} requests (top 10, half filtered by genre)")
+    print(f"{'legacy':<10}{legacy_time * 1000:>10.1f} ms/request")
+    runs = [('blocked', blocked_engine), ('indexed', engine)] + ([('tables', engine)] if args.mood_tables else [])
+    for name, new_engine in runs:
+        if name == 'tables':
+            track_data.mood_table_rows, track_data.mood_table_radii = tables
+        new_time, new_results = run(new_engine, requests)
+        identical = new_results == legacy_results
+        print(f"{name:<10}{new_time * 1000:>10.1f} ms/request  ({legacy_time / new_time:.1f}x)  "
+              f"identical results: {identical}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Latency benchmark for reusing Spotify clients and their HTTP connections.
+
+Serves a stand-in for the Spotify tracks endpoint on a local port, with
+HTTP/1.1 keep-alive, and times SpotifyService.get_tracks calls made with a
+new Spotify client (and so a new connection) for every call, as before, and
+with the client for the access token reused from SpotifyService's pool, which
+shares one HTTP session. The stand-in is plain HTTP on the same machine, so
+the saving per call is only a TCP handshake; against Spotify each new
+connection also costs a TLS handshake and a round trip to its servers.
+Reports the mean and 95th percentile time per call.
+
+Usage:
+    python -m benchmarks.bench_spotify_clients --calls 500
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+import numpy as np
+from flask import Flask, session
+from spotipy import Spotify
+from spotify_service import SpotifyService
+
+
+# Stand-in for the Spotify tracks endpoint, keeping connections alive between requests.
+# Responses are buffered and sent in one write, as a delayed acknowledgement of the headers would stall the body.
+class SpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    body = json.dumps({"tracks": [{"id": "track1", "album": {"images": [{"url": "image1.jpg"}]}}]}).encode()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+# Time get_tracks calls, returning the time of each call
+def run(spotify_service: SpotifyService, calls: int) -> np.ndarray:
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        spotify_service.get_tracks(["track1"])
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=500, help='number of calls to time')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SpotifyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # A logged in user whose token has not expired
+    app = Flask(__name__)
+    app.secret_key = 'benchmark'
+    token_info = {"access_token": "token", "refresh_token": "refresh", "expires_at": int(time.time()) + 3600,
+                  "scope": "user-read-playback-state user-modify-playback-state user-top-read"}
+    spotify_service = SpotifyService('client_id', 'client_secret', 'http://127.0.0.1/callback')
+
+    # Create a client that calls the stand-in
+    def new_client() -> Spotify:
+        spotify = Spotify(auth=token_info['access_token'])
+        spotify.prefix = prefix
+        return spotify
+
+    prefix = f'http://127.0.0.1:{server.server_port}/v1/'
+    print(f"{args.calls} calls to a local stand-in for Spotify")
+    with app.test_request_context():
+        session['token_info'] = token_info
+
+        # A new client for every call, each with its own HTTP session
+        with patch.object(spotify_service, 'get_client', new_client):
+            new_times = run(spotify_service, args.calls)
+
+        # The pooled client for the token, reused by every call
+        spotify_service.get_client().prefix = prefix
+        run(spotify_service, 1)  # Open the pooled connection
+        pooled_times = run(spotify_service, args.calls)
+
+    for name, times in (('new', new_times), ('pooled', pooled_times)):
+        print(f"{name:<8}{times.mean() * 1000:>8.3f} ms mean  {np.percentile(times, 95) * 1000:>8.3f} ms p95  "
+              f"({new_times.mean() / times.mean():.2f}x)")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark for scoring candidates by popularity tier.
+
+Times RecommendationEngine.get_recommendations for random users on a synthetic
+catalog with the default routing, with and without popularity tiers. Candidate
+sets (the tracks of the user's genres) smaller than the engine's
+mood_search_min_tracks are scored in full: with tiers, the hot tier (tracks
+more popular than average) is scored first, and the cold tier only when its
+score bound says one of its tracks could still be recommended. Larger ones are
+searched through the mood index: with tiers, the cold tracks of a mood cell
+are only scored when their own bound reaches the rankings. Caches are
+disabled, so every request scores its candidates. Reports the time and the
+number of tracks scored per request, and whether both return the same tracks.
+
+Usage:
+    python -m benchmarks.bench_tiers --rows 200000 --users 100
+"""
+import argparse
+import os
+import tempfile
+import time
+from unittest.mock import patch
+import numpy as np
+from benchmarks.bench_batch import make_users
+from benchmarks.catalog import write_catalog_csv
+from recommend import RecommendationEngine
+from track_data import TrackData
+
+
+# Time an engine over all users, returning the mean time per request, the mean number of tracks scored per request
+# and the results. The mood values of every track scored are gathered, whether scored in full or through the index.
+def run(engine: RecommendationEngine, users: list[tuple]) -> tuple[float, float, list]:
+    scored = 0
+    gather = engine._gather
+
+    def count_gathered(column: str, positions: np.ndarray | None, scratch: bool = False) -> np.ndarray:
+        nonlocal scored
+        values = gather(column, positions, scratch)
+        scored += len(values) if column == 'valence' else 0
+        return values
+
+    np.random.seed(0)
+    with patch.object(engine, '_gather', count_gathered):
+        start = time.perf_counter()
+        results = [engine.get_recommendations(*user) for user in users]
+        elapsed = time.perf_counter() - start
+    return elapsed / len(users), scored / len(users), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200_000, help='number of tracks in the synthetic catalog')
+    parser.add_argument('--users', type=int, default=100, help='number of users to recommend for')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'track_data.csv')
+        write_catalog_csv(csv_path, args.rows)
+        track_data = TrackData()
+        track_data.load_csv(csv_path)
+    users = make_users(track_data, args.users)
+
+    # No Spotify service: recommendations do not call the Spotify API
+    engines = {}
+    for name, tiered_scoring in (('untiered', False), ('tiered', True)):
+        engine = RecommendationEngine(track_data, None)
+        engine.result_cache.max_entries = 0
+        engine.similarity_cache.max_entries = 0
+        engine.tiered_scoring = tiered_scoring
+        engines[name] = engine
+
+    # The first run warms up the scratch buffers and is not timed
+    print(f"{args.rows:,} tracks, {args.users} users, {track_data.hot_tier.mean():.0%} of tracks in the hot tier")
+    run(engines['untiered'], users)
+    timings = {name: run(engine, users) for name, engine in engines.items()}
+    base_time, _, base_results = timings['untiered']
+    for name, (mean_time, mean_scored, results) in timings.items():
+        print(f"{name:<10}{mean_time * 1000:>10.1f} ms/request  ({base_time / mean_time:.2f}x)  "
+              f"{mean_scored:>10,.0f} tracks scored/request  identical results: {results == base_results}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+# Genres offered on the preferences page
+GENRES = ["Classical", "Country", "Electronic", "Folk", "Gospel", "Groove",
+          "Hip-Hop", "Jazz", "Metal", "Pop", "Rock", "World"]
+
+
+# Generate a synthetic track catalog with the same columns as datasets/track_data.csv
+def make_catalog(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+
+    # Spotify-style 22 character base62 track IDs
+    alphabet = np.frombuffer(b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz", dtype=np.uint8)
+    id_bytes = alphabet[rng.integers(0, len(alphabet), size=(rows, 22))]
+    track_ids = id_bytes.view("S22").ravel().astype(str)
+
+    # Roughly ten tracks per artist
+    num_artists = max(1, rows // 10)
+    artist_ids = rng.integers(0, num_artists, size=rows)
+
+    return pd.DataFrame({
+        "track_id": track_ids,
+        "track_name": [f"Track {i}" for i in range(rows)],
+        "artist_name": [f"Artist {i}" for i in artist_ids],
+        "new_genre": rng.choice(GENRES, size=rows, p=_genre_weights()),
+        "valence": rng.beta(2, 2, size=rows).round(3),
+        "energy": rng.beta(2.5, 2, size=rows).round(3),
+        "popularity": np.clip(rng.gamma(2.0, 12.0, size=rows), 0, 100).astype(int),
+        "instrumentalness": np.where(rng.random(rows) < 0.7, 0.0, rng.random(rows)).round(4),
+    })
+
+
+# Write a synthetic track catalog to a CSV file
+def write_catalog_csv(path: str, rows: int, seed: int = 0) -> None:
+    make_catalog(rows, seed).to_csv(path, index=False)
+
+
+# Relative genre sizes, loosely based on the real dataset
+def _genre_weights() -> np.ndarray:
+    weights = np.array([3, 5, 12, 6, 1, 4, 10, 5, 7, 20, 18, 9], dtype=float)
+    return weights / weights.sum()
@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+# Least recently used cache, with an optional time to live for entries.
+# Holds at most max_entries entries, and optionally at most max_bytes bytes of values, using the sizes given when
+# adding them: adding an entry to a full cache evicts the least recently used entries until it fits.
+# Entries older than ttl seconds are treated as missing, and removed when they are next looked up.
+# Counts hits, misses, evictions and expirations. Safe to use from several threads.
+class LRUCache:
+    def __init__(self, max_entries: int = 1024, ttl: float | None = None, max_bytes: int | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        # Entries in order of use, least recently used first: key -> (value, time added, size in bytes)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # Get the value for a key, or the default if the key is missing or has expired
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # Add or replace the value for a key, evicting the least recently used entries if the cache is full.
+    # Size is the size of the value in bytes; a value larger than the whole cache is not added.
+    def put(self, key: Hashable, value: Any, size: int = 0) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, time.monotonic(), size)
+            self.size += size
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    # Remove the entry for a key, if there is one
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    # Remove all entries; the counters are kept
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    # Get the number of entries, their total size and the counters
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # Remove an entry and its size from the cache
+    def _remove(self, key: Hashable) -> None:
+        _, _, size = self._entries.pop(key)
+        self.size -= size
@@ -0,0 +1,24 @@
+import sqlite3 as sql
+import threading
+
+
+# Connections to an SQLite database shared by several app workers and jobs, one per thread, opened on first use.
+# The database uses write-ahead logging, so reads don't wait for a write in another worker, and a connection waits
+# up to timeout seconds for another worker's write to finish rather than failing at once.
+# Connections are in the sqlite3 module's default transaction mode, unless another isolation level is given
+# (None leaves transactions to be started explicitly).
+class ThreadConnections:
+    def __init__(self, db_path: str, timeout: float = 5.0, isolation_level: str | None = ''):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.isolation_level = isolation_level
+        self._local = threading.local()
+
+    # Get the connection of the current thread, connecting on first use
+    def get(self) -> sql.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sql.connect(self.db_path, timeout=self.timeout, isolation_level=self.isolation_level)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
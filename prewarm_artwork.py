@@ -0,0 +1,159 @@
+"""
+Fetches the album image URL of every track in the catalog into the artwork store.
+
+Walks the track IDs of the track data in order, in batches of the most tracks
+Spotify returns at once, and fetches several batches at a time. Tracks that
+are already in the store and have not expired are skipped. After each batch
+is stored, the number of tracks done is saved to a checkpoint file, so a run
+that stops early (or is stopped) continues from there when started again. The
+checkpoint is removed once the whole catalog is done, and ignored if the
+track data has changed since it was written.
+
+Uses the app's Spotify credentials (SPOTIFY_CLIENT_ID and
+SPOTIFY_CLIENT_SECRET) with the client credentials flow, so no user login is
+needed. Calls to Spotify share the app's budget, leaving room for users'
+playback commands.
+
+Usage:
+    python -m prewarm_artwork [--workers 4] [--limit N]
+"""
+import argparse
+import json
+import math
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+from spotipy import Spotify
+from spotipy.oauth2 import SpotifyClientCredentials
+from artwork_store import ArtworkStore
+from rate_limit import RateLimiter
+from spotify_service import SpotifyService
+from track_data import TrackData
+
+# Most tracks Spotify returns in one request
+batch_size = 50
+
+
+# Load the checkpoint, returning the number of tracks done, or 0 if there is no checkpoint for this catalog
+def load_checkpoint(checkpoint_path: str, checksum: str | None) -> int:
+    try:
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    return checkpoint['done'] if checkpoint.get('checksum') == checksum else 0
+
+
+# Save the number of tracks done, replacing the checkpoint file in one step so it is never left half written
+def save_checkpoint(checkpoint_path: str, checksum: str | None, done: int) -> None:
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({"checksum": checksum, "done": done}, f)
+    os.replace(temp_path, checkpoint_path)
+
+
+# Fetch the album image URLs of a batch of tracks, or None for tracks without one or not found.
+# With a rate limiter, the request is a background call within its budget, waiting as long as it takes.
+def fetch_album_images(spotify: Spotify, track_ids: list[str],
+                       rate_limiter: RateLimiter | None = None) -> dict[str, str | None]:
+    if rate_limiter:
+        response = rate_limiter.call(RateLimiter.background, spotify.tracks, track_ids, timeout=math.inf)
+    else:
+        response = spotify.tracks(track_ids)
+
+    images = dict.fromkeys(track_ids)
+    for track in response['tracks']:
+        if track:
+            images[track['id']] = SpotifyService.album_image_url(track)
+    return images
+
+
+# Fetch the album image URLs of the given tracks into the store, starting after the tracks done at the checkpoint.
+# Each worker thread gets its own Spotify client from make_client. At most twice as many batches as workers are
+# fetched ahead of the one being stored, and batches are stored in order, so the checkpoint always covers a prefix of
+# the tracks. Calls progress with the number of tracks done after each batch.
+# Returns the number of tracks fetched from Spotify.
+def prewarm(track_ids: list[str], store: ArtworkStore, make_client: Callable[[], Spotify], checkpoint_path: str,
+            checksum: str | None = None, workers: int = 4, rate_limiter: RateLimiter | None = None,
+            progress: Callable[[int], None] | None = None) -> int:
+    local = threading.local()
+
+    # Fetch the tracks of a batch that are not in the store yet
+    def fetch(batch: list[str]) -> dict[str, str | None]:
+        stored = store.get_many(batch)
+        missing = [track_id for track_id in batch if track_id not in stored]
+        if not missing:
+            return {}
+        if not hasattr(local, 'spotify'):
+            local.spotify = make_client()
+        return fetch_album_images(local.spotify, missing, rate_limiter)
+
+    # Store the oldest batch fetched, and save the checkpoint after it
+    def store_oldest() -> None:
+        nonlocal fetched
+        done, future = pending.popleft()
+        images = future.result()
+        store.put_many(images)
+        fetched += len(images)
+        save_checkpoint(checkpoint_path, checksum, done)
+        if progress:
+            progress(done)
+
+    fetched = 0
+    pending: deque[tuple[int, Future]] = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(load_checkpoint(checkpoint_path, checksum), len(track_ids), batch_size):
+            end = min(start + batch_size, len(track_ids))
+            pending.append((end, executor.submit(fetch, track_ids[start:end])))
+            if len(pending) > 2 * workers:
+                store_oldest()
+        while pending:
+            store_oldest()
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return fetched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    instance_dir = os.path.join(project_dir, 'instance')
+    parser.add_argument('--csv', default=os.path.join(project_dir, 'datasets/track_data.csv'),
+                        help='track data CSV file')
+    parser.add_argument('--db', default=os.path.join(instance_dir, 'moodtunes.db'),
+                        help='database holding the artwork store')
+    parser.add_argument('--rate-limit-db', default=os.path.join(instance_dir, 'rate_limit.db'),
+                        help="database holding the app's Spotify call budget")
+    parser.add_argument('--checkpoint', default=os.path.join(instance_dir, 'prewarm_artwork.json'),
+                        help='checkpoint file for resuming')
+    parser.add_argument('--workers', type=int, default=4, help='number of batches fetched at a time')
+    parser.add_argument('--limit', type=int, default=None, help='only walk the first LIMIT tracks')
+    args = parser.parse_args()
+
+    client_id = os.environ.get('SPOTIFY_CLIENT_ID')
+    client_secret = os.environ.get('SPOTIFY_CLIENT_SECRET')
+    if not all([client_id, client_secret]):
+        raise RuntimeError("Missing Spotify credentials.")
+
+    track_data = TrackData()
+    track_data.load_csv(args.csv, snapshot_path=os.path.join(instance_dir, 'track_data.snapshot'))
+
+    # Tracks without an ID can't be fetched, and tracks listed more than once only need fetching once
+    track_ids = track_data.df['track_id'].dropna().drop_duplicates().tolist()[:args.limit]
+
+    # Calls to Spotify share the app's budget, as background calls
+    auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
+    store = ArtworkStore(args.db)
+    rate_limiter = RateLimiter(args.rate_limit_db)
+    fetched = prewarm(track_ids, store,
+                      lambda: Spotify(auth_manager=auth_manager, status_forcelist=rate_limiter.retry_statuses),
+                      args.checkpoint, checksum=track_data.checksum, workers=args.workers, rate_limiter=rate_limiter,
+                      progress=lambda done: print(f"\r{done:,}/{len(track_ids):,} tracks", end='', flush=True))
+    print(f"\nFetched {fetched:,} album images from Spotify")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import math
+import os
+import sqlite3 as sql
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+from spotipy import SpotifyException
+from connections import ThreadConnections
+
+
+# Budget for calls to the Spotify API, shared by all app workers and jobs using the same database.
+# A token bucket in the rate_limit table of an SQLite database allows rate calls per second on average, in bursts of
+# up to capacity calls. Background calls (such as fetching album images) leave reserve tokens in the bucket for
+# interactive calls (such as playback commands), so users are not kept waiting by background work.
+# When Spotify responds with 429 Too Many Requests, no calls are made until its Retry-After time has passed, and
+# the call is retried. Counts calls, waits, throttled and retried calls in this process. Safe to use from several
+# threads.
+class RateLimiter:
+    # Call priorities
+    interactive = 0
+    background = 1
+
+    # Statuses that spotipy retries itself; Too Many Requests (429) is left to the rate limiter
+    retry_statuses = (500, 502, 503, 504)
+
+    def __init__(self, db_path: str, rate: float = 5.0, capacity: float = 30.0, reserve: float = 10.0,
+                 name: str = 'spotify'):
+        self.db_path = db_path
+        self.rate = rate
+        self.capacity = capacity
+        self.reserve = reserve
+        self.name = name
+
+        # Longest time to wait for the budget, by priority, before giving up on a call
+        self.max_wait = {self.interactive: 10.0, self.background: 2.0}
+
+        # Most times a call is retried after Spotify responds with Too Many Requests, and the time to wait if it
+        # doesn't say how long
+        self.max_retries = 3
+        self.default_retry_after = 1.0
+
+        # Database connections, one per thread. Transactions are started explicitly, rather than by the sqlite3 module.
+        self._connections = ThreadConnections(db_path, isolation_level=None)
+
+        # Counters
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.waits = 0
+        self.throttled = 0
+        self.retried = 0
+        self.rejected = 0
+
+        # Create the rate limit table if it doesn't exist
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql/rate_limit.sql')) as f:
+            self._connections.get().executescript(f.read())
+
+    # Call a Spotify client method within the budget, retrying it if Spotify responds with Too Many Requests.
+    # Waits at most timeout seconds for the budget each time, or the longest wait for the priority if not given;
+    # raises a SpotifyException with status 429 if the budget doesn't allow the call in time.
+    def call(self, priority: int, method: Callable, *args, timeout: float | None = None, **kwargs) -> Any:
+        timeout = self.max_wait[priority] if timeout is None else timeout
+        for attempt in range(self.max_retries + 1):
+            if not self.acquire(priority, timeout):
+                with self._lock:
+                    self.rejected += 1
+                raise SpotifyException(429, -1, "Too many requests to Spotify, please try again later.")
+
+            try:
+                return method(*args, **kwargs)
+            except SpotifyException as e:
+                if e.http_status != 429:
+                    raise
+                with self._lock:
+                    self.throttled += 1
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retried += 1
+                self.pause(self._retry_after(e))
+
+    # Take a token from the bucket, waiting at most timeout seconds for one.
+    # Returns whether a token was taken; none is taken if it would take longer than the timeout.
+    def acquire(self, priority: int = interactive, timeout: float = math.inf) -> bool:
+        # Background calls leave the reserve for interactive calls
+        needed = 1 + (self.reserve if priority == self.background else 0)
+        deadline = time.time() + timeout
+        waited = False
+        while True:
+            with self._transaction() as conn:
+                now = time.time()
+                tokens, blocked_until = self._refill(conn, now)
+                if now >= blocked_until and tokens >= needed:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = max(blocked_until - now, (needed - tokens) / self.rate)
+                conn.execute("UPDATE rate_limit SET tokens = ?, updated_at = ? WHERE name = ?",
+                             (tokens, now, self.name))
+
+            if wait == 0:
+                with self._lock:
+                    self.calls += 1
+                    self.waits += int(waited)
+                return True
+            if now + wait > deadline:
+                return False
+            waited = True
+            time.sleep(wait)
+
+    # Make no calls for the given number of seconds, in all workers
+    def pause(self, seconds: float) -> None:
+        with self._transaction() as conn:
+            now = time.time()
+            tokens, _ = self._refill(conn, now)
+            conn.execute("UPDATE rate_limit SET tokens = ?, updated_at = ?, blocked_until = MAX(blocked_until, ?) "
+                         "WHERE name = ?", (tokens, now, now + seconds, self.name))
+
+    # Get the tokens left in the bucket shared by all workers and the seconds until calls may be made again, and the
+    # counters of calls made in this process
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        now = time.time()
+        tokens, blocked_until = self._refill(self._connections.get(), now, create=False)
+        with self._lock:
+            return {
+                "bucket": {
+                    "tokens": tokens,
+                    "blocked_for": max(0.0, blocked_until - now)
+                },
+                "process": {
+                    "calls": self.calls,
+                    "waits": self.waits,
+                    "throttled": self.throttled,
+                    "retried": self.retried,
+                    "rejected": self.rejected
+                }
+            }
+
+    # Get the number of tokens in the bucket now, after adding those earned since it was last counted, and the time
+    # until which no calls are made. Creates a full bucket if there is none yet, unless create is False.
+    def _refill(self, conn: sql.Connection, now: float, create: bool = True) -> tuple[float, float]:
+        row = conn.execute("SELECT tokens, updated_at, blocked_until FROM rate_limit WHERE name = ?",
+                           (self.name,)).fetchone()
+        if row is None:
+            if not create:
+                return self.capacity, 0.0
+            conn.execute("INSERT INTO rate_limit (name, tokens, updated_at, blocked_until) VALUES (?, ?, ?, 0)",
+                         (self.name, self.capacity, now))
+            return self.capacity, 0.0
+
+        tokens, updated_at, blocked_until = row
+        return min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate), blocked_until
+
+    # Get the number of seconds Spotify asked to wait before retrying, from its Retry-After header
+    def _retry_after(self, e: SpotifyException) -> float:
+        try:
+            return max(0.0, float(e.headers.get('Retry-After', self.default_retry_after)))
+        except (TypeError, ValueError):
+            return self.default_retry_after
+
+    # Run statements in a transaction that locks the database for writing from the start, so that no other worker can
+    # take tokens from the bucket between reading and updating it
+    @contextmanager
+    def _transaction(self) -> Iterator[sql.Connection]:
+        conn = self._connections.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
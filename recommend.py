@@ -1,13 +1,21 @@
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
+from cache import LRUCache
 from spotify_service import SpotifyService
 from track_data import TrackData
 
 
 # Recommendation engine class
 class RecommendationEngine:
+    # Goals whose target mood does not depend on the user's current mood
+    fixed_mood_goals = ("lift_me_up", "chill_me_out", "fire_me_up", "surprise_me")
+
     def __init__(self, track_data: TrackData, spotify_service: SpotifyService):
+        self.track_data = track_data
         self.df = track_data.df
         self.spotify_service = spotify_service
         self.scaler = track_data.scaler
@@ -16,6 +24,62 @@ class RecommendationEngine:
         # Boost factor for preferred artists
         self.artist_boost_factor = 1.2
 
+        # Number of tracks scored at a time when ranking tracks for each recommendation step
+        self.selection_block_size = 16384
+
+        # Number of threads scoring large candidate sets in shards (1 scores them in the request thread),
+        # and the candidate count from which scoring is split into shards.
+        # NumPy releases the GIL in its kernels, so shards are scored in parallel on a shared thread pool.
+        # Taste similarity and the passes over all candidates are sharded; when searching the mood index, the few
+        # cells searched are scored in the request thread, so shards speed up full scoring the most.
+        self.scoring_workers = 1
+        self.scoring_shard_min_tracks = 100000
+        self._scoring_pool = None
+        self._scoring_pool_workers = 0
+        self._scoring_pool_lock = threading.Lock()
+
+        # Whether scoring reuses per-thread scratch arrays rather than allocating new ones for every block and request
+        self.scratch_buffers = True
+        self._scratch_local = threading.local()
+
+        # Whether candidates are scored by popularity tier, the hot tier first, skipping cold tracks when none of them
+        # can enter the rankings: all of them when scoring in full, or those of the mood cells searched for their hot
+        # tracks only when searching the mood index
+        self.tiered_scoring = True
+
+        # Candidate counts from which tracks are ranked through the mood index rather than scored in full,
+        # the number of most similar tracks scored in full to seed the rankings,
+        # and the number of best cells of each step searched before any others
+        self.mood_search_min_tracks = 50000
+        self.mood_search_seed_size = 1024
+        self.mood_search_first_cells = 4
+
+        # Cache of the ranked tracks of recent requests, keyed on the request inputs and the dataset version.
+        # Pools are cached deeper than needed, so the same entry serves users who have already seen some tracks.
+        # Users who have seen more tracks than the margin are served by masking those tracks out, without the cache.
+        self.result_cache = LRUCache(max_entries=1024, ttl=600, max_bytes=64 * 1024 * 1024)
+        self.result_cache_margin = 100
+
+        # Cache of taste similarity scores, keyed on the user's unit taste vector, the genres and the dataset version.
+        # Users with the same taste preferences share the same scores, so these are computed once.
+        self.similarity_cache = LRUCache(max_entries=1024, max_bytes=128 * 1024 * 1024)
+
+        # Precompute sqrt(2) - example of common sub-expression elimination
+        self.sqrt2 = np.sqrt(2)
+
+        # Shortlist the tracks nearest to the targets of the last step towards the fixed target moods of the goals,
+        # for each genre, when the tracks are loaded. The last of the 10 steps recommended is 90% of the way from the
+        # user's mood to the goal mood, so for these goals it falls in a small area the shortlists cover.
+        goal_moods = [self._get_target_mood(goal, 0, 0) for goal in self.fixed_mood_goals]
+        track_data.set_goal_moods([(mood['target_valence'], mood['target_energy']) for mood in goal_moods],
+                                  fraction=(10 - 1) / 10)
+
+        # Image shown for each recommended track until its album image is loaded
+        self.placeholder_image_url = '/static/img/default_album.png'
+
+        # Columns returned for each recommended track
+        self.output_columns = ["track_name", "artist", "track_id", "valence", "energy"]
+
         # Weights for mood and non-mood features
         self.weights = {
             "mood": 0.5,
@@ -28,74 +92,136 @@ class RecommendationEngine:
                             energy: float,
                             goal: str,
                             preferences: dict,
-                            recommended_ids: list[str] | None = None) -> list[dict]:
+                            recommended_ids: list[str] | None = None,
+                            recommended_positions: np.ndarray | list[int] | None = None) -> list[dict]:
 
         # Ensure the track database has been loaded
         if self.df is None:
             raise ValueError("Track database not loaded.")
 
-        # Filter dataset by genre
+        # Filter dataset by genre.
+        # Looks up the row positions of the selected genres in the genre index; None means all tracks.
         if preferences['genres']:
-            filtered_df = self.df[self.df['genre'].isin(preferences['genres'])].copy()
+            positions = self.track_data.get_genre_positions(preferences['genres'])
+            num_tracks = len(positions)
         else:
-            filtered_df = self.df
+            positions = None
+            num_tracks = len(self.df)
 
         # If no tracks match the genre filter, return an empty list
-        if filtered_df.empty:
+        if num_tracks == 0:
             return []
 
-        # Extract taste features (e.g. popularity, instrumentalness) from tracks for similarity comparison.
-        # Mood features (valence, energy, goal) are processed separately.
-        track_vectors = filtered_df[self.taste_features].values
-
-        # Build and scale the user's taste vector
-        user_vector = [preferences[f] for f in self.taste_features]
-        user_vector_scaled = self.scaler.transform([user_vector])[0]
-
-        # Compute cosine similarity between the user's taste vector and all track vectors
-        similarity_matrix = cosine_similarity(track_vectors, [user_vector_scaled])
-        similarity_scores = similarity_matrix.flatten()
-
-        # Boost similarity scores for preferred artists.
-        # Apply a small boost to tracks that match user's preferred artists.
-        similarity_scores = self._apply_artist_boost(filtered_df, similarity_scores, preferences["artists"])
-
-        # Adjust recommendations towards user's target mood.
-        # Determine mood adjustments based on user's goal (e.g., lift me up, chill me out).
-        target_mood = self._get_target_mood(goal, valence, energy)
-
-        # Recommend songs by combining similarity and mood progression
-        rec_df = self._recommend_songs(filtered_df, similarity_scores, valence,
-                                       energy, target_mood, recommended_ids, top_n=10)
+        # Reuse the ranked tracks of an identical earlier request, if its pools are deep enough to skip
+        # the tracks already recommended
+        cache_key = self._result_cache_key(valence, energy, goal, preferences, top_n=10)
+        excluded_rows = self._excluded_rows(recommended_ids, recommended_positions)
+        cached = self.result_cache.get(cache_key) if len(excluded_rows) <= self.result_cache_margin else None
+        if cached is not None:
+            if cached['complete'] or cached['depth'] >= 10 + len(excluded_rows):
+                recommended_rows = self._select_tracks(cached['rows'], set(excluded_rows.tolist()))
+                recommendations = self._gather_tracks(np.array(recommended_rows, dtype=np.int64))
+            else:
+                cached = None
+
+        if cached is None:
+            # Build and scale the user's taste vector (e.g. popularity, instrumentalness).
+            # Mood features (valence, energy, goal) are processed separately.
+            user_vector_scaled = self._scale_taste_vector(preferences)
+
+            # Compute cosine similarity between the user's taste vector and all track vectors,
+            # or reuse the scores of an earlier user with the same taste
+            similarity_scores = self._cached_taste_similarity(positions, preferences['genres'], user_vector_scaled)
+
+            # Boost similarity scores for preferred artists.
+            # Apply a small boost to tracks that match user's preferred artists.
+            # The boosted scores are only used by this request, so they are written to a scratch array.
+            similarity_scores = self._apply_artist_boost(positions, similarity_scores, preferences["artists"],
+                                                         out=self._scratch('boosted', len(similarity_scores),
+                                                                           similarity_scores.dtype))
+
+            # Adjust recommendations towards user's target mood.
+            # Determine mood adjustments based on user's goal (e.g., lift me up, chill me out).
+            target_mood = self._get_target_mood(goal, valence, energy)
+
+            # Recommend songs by combining similarity and mood progression, caching the ranked tracks
+            recommendations = self._recommend_songs(positions, similarity_scores, valence,
+                                                    energy, target_mood, recommended_ids, top_n=10,
+                                                    genres=preferences['genres'] or None, cache_key=cache_key,
+                                                    recommended_positions=recommended_positions)
 
         # Check if we have any recommendations
-        if rec_df.empty:
+        if not recommendations:
             # No tracks available after filtering, return empty list
             return []
 
-        # Format output for Spotify playback
-        # Convert track IDs to Spotify URIs
-        rec_df['uri'] = 'spotify:track:' + rec_df['track_id']
+        # Add Spotify URIs and album images
+        self._add_track_details(recommendations)
 
-        # Get track information
-        try:
-            tracks = self.spotify_service.get_tracks(rec_df['track_id'].tolist())
+        # Return the final list of recommendations
+        return recommendations
 
-            # Map track ID to image URL
-            track_to_image = {
-                track['id']: track['album']['images'][1]['url']
-                for track in tracks if track['album']['images']
-            }
-
-            # Map image URLs back to the DataFrame by track ID
-            rec_df['album_image_url'] = rec_df['track_id'].map(track_to_image)
-        except Exception:
-            # If tracks can't be retrieved, use a default image URL
-            default_image_url = '/static/img/default_album.png'
-            rec_df['album_image_url'] = default_image_url
+    # Get recommendations for many users at once.
+    # Each request is a (valence, energy, goal, preferences) tuple, optionally followed by a list of
+    # already recommended track IDs to exclude. Returns the recommendations for each request, in order.
+    # Users with the same genre filter are scored together: taste similarity for all of them is one
+    # matrix-matrix product per block of tracks, and mood closeness is computed for all their trajectory
+    # steps at once. Random artist boosts are drawn in request order, as in repeated get_recommendations calls.
+    def get_recommendations_batch(self, requests: list[tuple], top_n: int = 10) -> list[list[dict]]:
+        # Ensure the track database has been loaded
+        if self.df is None:
+            raise ValueError("Track database not loaded.")
 
-        # Return the final list of recommendations as a list of dictionaries
-        return rec_df.to_dict(orient='records')
+        # Prepare each request and group the requests by their candidate tracks
+        results = [[] for _ in requests]
+        positions_by_genres = {}
+        groups = {}
+        for i, request in enumerate(requests):
+            valence, energy, goal, preferences = request[:4]
+            recommended_ids = request[4] if len(request) > 4 else None
+
+            # Filter dataset by genre; None means all tracks
+            genres = frozenset(preferences['genres'])
+            if genres not in positions_by_genres:
+                positions_by_genres[genres] = self.track_data.get_genre_positions(list(genres)) if genres else None
+            positions = positions_by_genres[genres]
+            if positions is not None and len(positions) == 0:
+                continue
+
+            # Draw random boost factors for the candidates by preferred artists
+            boosted = np.zeros(0, dtype=np.int64)
+            boosts = np.zeros(0)
+            if preferences['artists']:
+                artist_positions = self.track_data.get_artist_positions(preferences['artists'])
+                boosted = self._candidate_indices(positions, artist_positions)
+                boosts = np.random.uniform(1, self.artist_boost_factor, len(boosted))
+
+            # Find the candidates already recommended
+            excluded = np.zeros(0, dtype=np.int64)
+            if recommended_ids:
+                excluded = self._candidate_indices(positions, self.track_data.get_track_positions(recommended_ids))
+
+            groups.setdefault(genres, []).append({
+                'index': i,
+                'user_vector': self._unit_vector(self._scale_taste_vector(preferences)),
+                'boosted': boosted,
+                'boosts': boosts,
+                'excluded': excluded,
+                'step_targets': self._step_targets(valence, energy, self._get_target_mood(goal, valence, energy), top_n)
+            })
+
+        # Rank and select tracks for each group of users
+        for genres, users in groups.items():
+            positions = positions_by_genres[genres]
+            pools = self._rank_step_pools_batch(positions, users, depth=top_n)
+            for user, (pool_indices, _) in zip(users, pools):
+                selected = self._select_tracks(pool_indices)
+                rows = np.array(selected, dtype=np.int64) if positions is None else positions[selected]
+                recommendations = self._gather_tracks(rows)
+                self._add_track_details(recommendations)
+                results[user['index']] = recommendations
+
+        return results
 
     # Get target mood based on goal
     def _get_target_mood(self, goal: str, start_valence: float, start_energy: float) -> dict:
@@ -116,89 +242,678 @@ class RecommendationEngine:
                 target_mood = {"target_valence": 0.8, "target_energy": 0.6}
         return target_mood
 
+    # Get the values of a column for the tracks at the given row positions (None means all tracks),
+    # optionally into a scratch array named after the column
+    def _gather(self, column: str, positions: np.ndarray | None, scratch: bool = False) -> np.ndarray:
+        values = self.df[column].to_numpy()
+        if positions is None:
+            return values
+        return np.take(values, positions, out=self._scratch(column, len(positions), values.dtype) if scratch else None)
+
+    # Get a scratch array of the given shape and type for the calling thread, named after its use.
+    # Each thread keeps one buffer per name and type, grown as needed, so scoring reuses the same memory across
+    # blocks and requests. The contents are overwritten by the next use of the name on the same thread.
+    def _scratch(self, name: str, shape: int | tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        shape = (shape,) if isinstance(shape, int) else shape
+        dtype = np.dtype(dtype)
+        if not self.scratch_buffers:
+            return np.empty(shape, dtype)
+
+        buffers = self._scratch_local.__dict__.setdefault('buffers', {})
+        size = math.prod(shape)
+        buffer = buffers.get((name, dtype))
+        if buffer is None or len(buffer) < size:
+            buffer = buffers[(name, dtype)] = np.empty(size, dtype)
+        return buffer[:size].reshape(shape)
+
+    # Build the user's taste vector from their preferences and scale it like the track taste features.
+    # Scaling is the same as the scaler's transform, without its input validation.
+    def _scale_taste_vector(self, preferences: dict) -> np.ndarray:
+        user_vector = np.array([preferences[f] for f in self.taste_features], dtype=np.float64)
+        return (user_vector - self.scaler.mean_) / self.scaler.scale_
+
+    # Normalize a scaled taste vector to unit length, in the precision of the track taste vectors.
+    # A zero vector has no direction, so it stays zero and is equally (not) similar to every track.
+    def _unit_vector(self, user_vector_scaled: np.ndarray) -> np.ndarray:
+        dtype = self.track_data.taste_vectors.dtype
+        norm = np.linalg.norm(user_vector_scaled)
+        if norm == 0:
+            return np.zeros(len(user_vector_scaled), dtype=dtype)
+        return (user_vector_scaled / norm).astype(dtype)
+
+    # Compute the cosine similarity between a scaled taste vector and the tracks at the given row positions.
+    # Track vectors are stored normalized to unit length, so this is a single matrix-vector product.
+    # Tracks are scored one block at a time, so large candidate sets can be scored in shards of whole blocks, and
+    # the scores do not depend on the number of shards.
+    def _taste_similarity(self, positions: np.ndarray | None, user_vector_scaled: np.ndarray) -> np.ndarray:
+        taste_vectors = self.track_data.taste_vectors
+        unit_vector = self._unit_vector(user_vector_scaled)
+        num_tracks = len(taste_vectors) if positions is None else len(positions)
+        similarity_scores = np.empty(num_tracks, dtype=np.result_type(taste_vectors, unit_vector))
+
+        def score_shard(shard_start: int, shard_end: int) -> None:
+            for start in range(shard_start, shard_end, self.selection_block_size):
+                end = min(start + self.selection_block_size, shard_end)
+                vectors = taste_vectors[start:end] if positions is None else taste_vectors[positions[start:end]]
+                np.matmul(vectors, unit_vector, out=similarity_scores[start:end])
+
+        self._map_shards(score_shard, num_tracks)
+        return similarity_scores
+
+    # Get the cosine similarity between a scaled taste vector and the tracks of the given genres (at the given row
+    # positions) from the similarity cache, computing and caching it if needed.
+    # The key is the unit taste vector, which is all the similarity depends on, so any preferences giving the same
+    # vector share an entry. Cached scores are read-only, as they are shared between requests.
+    def _cached_taste_similarity(self,
+                                 positions: np.ndarray | None,
+                                 genres: list[str],
+                                 user_vector_scaled: np.ndarray) -> np.ndarray:
+
+        key = (self.track_data.checksum, tuple(sorted(set(genres))), self._unit_vector(user_vector_scaled).tobytes())
+        similarity_scores = self.similarity_cache.get(key)
+        if similarity_scores is None:
+            similarity_scores = self._taste_similarity(positions, user_vector_scaled)
+            similarity_scores.flags.writeable = False
+            self.similarity_cache.put(key, similarity_scores, size=similarity_scores.nbytes)
+        return similarity_scores
+
     # Boost similarity scores if track artist matches user preference
     def _apply_artist_boost(self,
-                            df: pd.DataFrame,
+                            positions: np.ndarray | None,
                             similarity_scores: np.ndarray,
-                            preferred_artists: list[str]) -> np.ndarray:
+                            preferred_artists: list[str],
+                            out: np.ndarray | None = None) -> np.ndarray:
 
         if preferred_artists:
-            # Identify matching artists
-            artist_matches = df['artist'].isin(preferred_artists)
+            # Look up the row positions of the preferred artists' tracks in the artist index
+            artist_positions = self.track_data.get_artist_positions(preferred_artists)
 
-            # Count number of matches
-            count_matches = artist_matches.sum()
+            # Find the matching tracks among the candidates
+            matches = self._candidate_indices(positions, artist_positions)
 
             # Generate random boost factors for matching artists (from 1 to artist_boost_factor)
-            random_boosts = np.ones(len(df))
-            random_boosts[artist_matches.values] = np.random.uniform(1, self.artist_boost_factor, count_matches)
-
-            # Apply boost to matching scores
-            similarity_scores *= random_boosts
+            # and apply them to the matching scores only, in a copy as the scores may be shared.
+            # The copy is written to the given array, if any.
+            if out is None:
+                similarity_scores = similarity_scores.copy()
+            else:
+                np.copyto(out, similarity_scores)
+                similarity_scores = out
+            similarity_scores[matches] *= np.random.uniform(1, self.artist_boost_factor, len(matches))
 
         return similarity_scores
 
-    # Recommend songs by combining taste similarity and progressive mood adjustment
-    def _recommend_songs(self,
-                         df: pd.DataFrame,
-                         similarity_scores: np.ndarray,
-                         start_valence: float,
-                         start_energy: float,
-                         target_mood: dict,
-                         recommended_ids: list[str] | None = None,
-                         top_n: int = 10) -> list[dict]:
-
-        # Initialize variables
-        recommended_tracks = []
-        used_indices = set()
-
-        # Filter out tracks already recommended if provided
-        if recommended_ids is not None:
-            mask = ~df['track_id'].isin(recommended_ids)
-            df = df[mask].reset_index(drop=True)
-            similarity_scores = np.asarray(similarity_scores)[mask.to_numpy()]
-
-        # Extract valence and energy values from all tracks
-        track_vectors = df[["valence", "energy"]].values
+    # Get the indices among the candidate tracks of the given rows, ignoring rows that are not candidates.
+    # Both position arrays are sorted, so each row is located by binary search.
+    @staticmethod
+    def _candidate_indices(positions: np.ndarray | None, rows: np.ndarray) -> np.ndarray:
+        if positions is None:
+            return rows
+        indices = np.searchsorted(positions, rows)
+        found = indices < len(positions)
+        found[found] = positions[indices[found]] == rows[found]
+        return indices[found]
+
+    # Get the row positions of the tracks already recommended, given by track ID or by row position,
+    # in ascending order
+    def _excluded_rows(self,
+                       recommended_ids: list[str] | None,
+                       recommended_positions: np.ndarray | list[int] | None = None) -> np.ndarray:
+        rows = np.zeros(0, dtype=np.int64)
+        if recommended_ids:
+            rows = self.track_data.get_track_positions(recommended_ids)
+        if recommended_positions is not None and len(recommended_positions):
+            rows = np.union1d(rows, np.asarray(recommended_positions, dtype=np.int64))
+        return rows
+
+    # Get the result cache key of a request: its mood, goal and preferences, and the dataset version.
+    # Sliders give moods and preferences in fixed steps, so identical requests are common.
+    # Genres and artists are sorted, as their order does not change the result.
+    def _result_cache_key(self, valence: float, energy: float, goal: str, preferences: dict, top_n: int) -> tuple:
+        return (self.track_data.checksum, float(valence), float(energy), goal,
+                tuple(sorted(set(preferences['genres']))), tuple(sorted(set(preferences['artists']))),
+                float(preferences['popularity']), float(preferences['instrumentalness']), top_n)
+
+    # Gather the output columns of the tracks at the given row positions into one dictionary per track.
+    # Each column is gathered once for all tracks, as plain Python values.
+    # The row position of each track is included, so callers can exclude it later without looking it up by ID.
+    def _gather_tracks(self, rows: np.ndarray) -> list[dict]:
+        columns = {}
+        for column in self.output_columns:
+            if pd.api.types.is_numeric_dtype(self.df[column]):
+                columns[column] = self._gather(column, rows).tolist()
+            else:
+                columns[column] = self.df[column].array.take(rows).tolist()
+        columns['position'] = np.asarray(rows).tolist()
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    # Add the Spotify URI and album image URL to each recommended track
+    def _add_track_details(self, recommendations: list[dict]) -> None:
+        if not recommendations:
+            return
 
+        # Format output for Spotify playback
+        # Convert track IDs to Spotify URIs
+        # Album images come from the Spotify API, so the page fetches them separately once it has rendered
+        # and shows a placeholder until then
+        for track in recommendations:
+            track['uri'] = 'spotify:track:' + track['track_id']
+            track['album_image_url'] = self.placeholder_image_url
+
+    # Gradually adjust target mood at each recommendation step.
+    # Returns the targets for all steps, one (valence, energy) row per step.
+    @staticmethod
+    def _step_targets(start_valence: float, start_energy: float, target_mood: dict, top_n: int) -> np.ndarray:
         # Calculate per-step mood adjustments
         val_adj = (target_mood['target_valence'] - start_valence) / top_n
         nrg_adj = (target_mood['target_energy'] - start_energy) / top_n
-
-        # Precompute sqrt(2) - example of common sub-expression elimination
-        sqrt2 = np.sqrt(2)
-
-        # Generate top_n song recommendations
-        for step in range(top_n):
-            # Gradually adjust target mood at each recommendation step
-            step_valence = start_valence + val_adj * step
-            step_energy = start_energy + nrg_adj * step
-            step_vector = np.array([step_valence, step_energy])
-
-            # Calculate the Euclidean distance between the track mood and the current step's target mood
-            distances = np.linalg.norm(track_vectors - step_vector, axis=1)
-
-            # Normalize distances to compute mood closeness (1 = exact match, 0 = no closeness).
-            # Assumes valence and energy are both in [0, 1], so the maximum possible distance is sqrt(2).
-            closeness = np.clip(1 - (distances / sqrt2), 0, 1)
-
-            # Combine scores for mood and non-mood features
-            combined_scores = closeness * self.weights['mood'] + similarity_scores * self.weights['non_mood']
-
-            # Mask out tracks that have already been recommended
-            if used_indices:
-                combined_scores[list(used_indices)] = -np.inf
+        return np.array([[start_valence + val_adj * step, start_energy + nrg_adj * step]
+                         for step in range(top_n)]).reshape(top_n, 2)
+
+    # Select the best track for each step from the ranked pools, skipping tracks already selected by an earlier
+    # step and any excluded tracks. Returns the selected track indices, stopping when no tracks remain.
+    @staticmethod
+    def _select_tracks(pool_indices: np.ndarray, excluded: set[int] | None = None) -> list[int]:
+        selected = []
+        used_indices = set(excluded) if excluded else set()
+        for indices in pool_indices.tolist():
+            best_index = next((index for index in indices if index not in used_indices), None)
 
             # Exit if no valid tracks remain
-            if np.all(combined_scores == -np.inf):
+            if best_index is None:
                 break
-
-            # Select best track for this step
-            best_index = int(np.argmax(combined_scores))
             used_indices.add(best_index)
-
-            # Add the selected track to recommendations
-            recommended_tracks.append(df.iloc[best_index][["track_name", "artist", "track_id", "valence", "energy"]])
-
-        # Return recommendations as a DataFrame
-        return pd.DataFrame(recommended_tracks)
+            selected.append(best_index)
+        return selected
+
+    # Rank the best tracks for each step of each user's mood trajectory, for a group of users sharing the same
+    # candidate tracks. Returns the pool indices and scores of each user, as for _rank_step_pools.
+    # Taste similarity for all users is one matrix-matrix product per block of tracks. A track's combined score
+    # can be at most its weighted similarity plus the mood weight (a perfect mood match), so once a user's pools
+    # are full, only tracks whose bound reaches the lowest score in the pools can still enter them, and the mood
+    # closeness is computed for those tracks only. The pools are the same as without skipping tracks.
+    def _rank_step_pools_batch(self,
+                               positions: np.ndarray | None,
+                               users: list[dict],
+                               depth: int) -> list[tuple[np.ndarray, np.ndarray]]:
+
+        num_steps = len(users[0]['step_targets'])
+        valence = self._gather('valence', positions)
+        energy = self._gather('energy', positions)
+        taste_vectors = self.track_data.taste_vectors
+        if positions is not None:
+            taste_vectors = taste_vectors[positions]
+
+        # Stack the users' vectors, one column per user
+        user_vectors = np.stack([user['user_vector'] for user in users], axis=1)
+
+        # Flatten the artist boosts and exclusions of all users, ordered by track
+        boosted, boosted_users, boosts = self._flatten_by_track(users, 'boosted', 'boosts')
+        excluded, excluded_users, _ = self._flatten_by_track(users, 'excluded')
+
+        pools = [(np.zeros((num_steps, 0), dtype=np.int64), np.zeros((num_steps, 0))) for _ in users]
+        thresholds = np.full(len(users), -np.inf)
+        for start in range(0, len(valence), self.selection_block_size):
+            end = min(start + self.selection_block_size, len(valence))
+
+            # Compute cosine similarity between all users' taste vectors and the block's track vectors,
+            # then boost the scores of the users' preferred artists
+            similarity_scores = taste_vectors[start:end] @ user_vectors
+            low, high = np.searchsorted(boosted, [start, end])
+            similarity_scores[boosted[low:high] - start, boosted_users[low:high]] *= boosts[low:high]
+            weighted_similarity = similarity_scores * self.weights['non_mood']
+
+            # Find the tracks that can still enter each user's pools, leaving out excluded tracks
+            bounds = np.add(self.weights['mood'], weighted_similarity, dtype=np.float64)
+            candidates = bounds >= thresholds
+            low, high = np.searchsorted(excluded, [start, end])
+            candidates[excluded[low:high] - start, excluded_users[low:high]] = False
+
+            # Score the candidates for every step of each user's trajectory and merge them into the pools
+            for i, user in enumerate(users):
+                columns = np.flatnonzero(candidates[:, i])
+                if len(columns) == 0:
+                    continue
+                combined_scores = self._combine_scores(valence[start:end][columns], energy[start:end][columns],
+                                                       user['step_targets'][:, 0:1], user['step_targets'][:, 1:2],
+                                                       weighted_similarity[columns, i])
+                pools[i] = self._merge_pools(*pools[i], combined_scores, columns + start, depth)
+
+                # Once every pool is full, a track must score at least the lowest score in the pools to enter
+                if pools[i][1].shape[1] == depth:
+                    thresholds[i] = pools[i][1][:, -1].min()
+
+        return pools
+
+    # Flatten per-user track indices (and optional values) into single arrays ordered by track index,
+    # with the position of the user each entry belongs to
+    @staticmethod
+    def _flatten_by_track(users: list[dict],
+                          key: str,
+                          values_key: str | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray | None]:
+
+        indices = np.concatenate([user[key] for user in users])
+        user_ids = np.repeat(np.arange(len(users)), [len(user[key]) for user in users])
+        values = np.concatenate([user[values_key] for user in users]) if values_key else None
+        order = np.argsort(indices, kind='stable')
+        return indices[order], user_ids[order], None if values is None else values[order]
+
+    # Rank the best tracks for each step of the mood trajectory.
+    # Returns the indices and scores of each step's top `depth` tracks, best first, one row per step.
+    # Tracks are ranked by combined score, and tracks with equal scores by index, so the ranking is exact.
+    # Scores are computed for all steps at once, one block of tracks at a time, keeping only a running top-k.
+    # Large candidate sets are split into shards ranked separately; the best tracks overall are among the best of
+    # their shard, so merging the shards' pools gives the same ranking.
+    def _rank_step_pools(self,
+                         valence: np.ndarray,
+                         energy: np.ndarray,
+                         similarity_scores: np.ndarray,
+                         step_targets: np.ndarray,
+                         depth: int) -> tuple[np.ndarray, np.ndarray]:
+
+        num_steps = len(step_targets)
+
+        def rank_shard(shard_start: int, shard_end: int) -> tuple[np.ndarray, np.ndarray]:
+            pool_indices = np.zeros((num_steps, 0), dtype=np.int64)
+            pool_scores = np.zeros((num_steps, 0))
+
+            for start in range(shard_start, shard_end, self.selection_block_size):
+                end = min(start + self.selection_block_size, shard_end)
+
+                # Similarity part of the combined score, the same for every step.
+                # Both are computed in the thread's scratch arrays, as the pools keep copies of the best tracks.
+                block_similarity = similarity_scores[start:end]
+                weighted_similarity = np.multiply(block_similarity, self.weights['non_mood'],
+                                                  out=self._scratch('block_similarity', end - start,
+                                                                    np.result_type(block_similarity, 0.5)))
+                combined_scores = self._combine_scores(valence[start:end], energy[start:end],
+                                                       step_targets[:, 0:1], step_targets[:, 1:2],
+                                                       weighted_similarity,
+                                                       out=self._scratch('block_scores', (num_steps, end - start),
+                                                                         np.float64))
+                pool_indices, pool_scores = self._merge_pools(pool_indices, pool_scores, combined_scores,
+                                                              np.arange(start, end), depth)
+
+            return pool_indices, pool_scores
+
+        return self._concat_pools(self._map_shards(rank_shard, len(valence)), depth)
+
+    # Rank the best tracks for each step of the mood trajectory through the mood index.
+    # Returns the same pools as _rank_step_pools, for the candidates at the given row positions (None means all
+    # tracks), which must all be in the given genres (None means any genre).
+    # The most similar candidates are scored in full to seed each step's pool. Any other candidate scores at most
+    # the lowest weighted similarity of those seeds plus the mood weight times the closeness of its cell's bounding
+    # box, so only the cells whose bound reaches the lowest score in a step's pool need to be scored.
+    # The tracks nearest to each step are looked up in the goal shortlists and mood tables first, which is often
+    # enough to rule out every other track.
+    def _rank_step_pools_indexed(self,
+                                 positions: np.ndarray | None,
+                                 similarity_scores: np.ndarray,
+                                 step_targets: np.ndarray,
+                                 genres: list[str] | None,
+                                 depth: int) -> tuple[np.ndarray, np.ndarray]:
+
+        num_candidates = len(similarity_scores)
+        dtype = np.result_type(similarity_scores, 0.5)
+        weighted_similarity = self._scratch('weighted_similarity', num_candidates, dtype)
+        partitioned = self._scratch('partitioned', num_candidates, dtype)
+        seed_size = max(self.mood_search_seed_size, depth)
+
+        # Weight the similarity of a shard of candidates and find its seed_size highest, by partitioning a scratch
+        # copy in place. The highest overall are among the highest of their shard.
+        def weigh_shard(shard_start: int, shard_end: int) -> np.ndarray:
+            shard = partitioned[shard_start:shard_end]
+            np.multiply(similarity_scores[shard_start:shard_end], self.weights['non_mood'],
+                        out=weighted_similarity[shard_start:shard_end])
+            np.copyto(shard, weighted_similarity[shard_start:shard_end])
+            kth = max(len(shard) - seed_size, 0)
+            shard.partition(kth)
+            return shard[kth:]
+
+        # Find the candidates of a shard above the threshold, and those tied with it
+        def threshold_shard(shard_start: int, shard_end: int) -> tuple[np.ndarray, np.ndarray]:
+            shard = weighted_similarity[shard_start:shard_end]
+            return np.flatnonzero(shard > threshold) + shard_start, np.flatnonzero(shard == threshold) + shard_start
+
+        # Seed the pools with the most similar candidates: those above the seed_size-th highest similarity, then the
+        # lowest-index candidates tied with it. The passes over all candidates are run in shards.
+        highest = np.concatenate(self._map_shards(weigh_shard, num_candidates))
+        highest.partition(len(highest) - seed_size)
+        threshold = highest[len(highest) - seed_size]
+        above, ties = (np.concatenate(found) for found in zip(*self._map_shards(threshold_shard, num_candidates)))
+        seeds = np.sort(np.concatenate([above, ties[:seed_size - len(above)]]))
+        pools = (np.zeros((len(step_targets), 0), dtype=np.int64), np.zeros((len(step_targets), 0)))
+        scored = self._scratch('scored', num_candidates, bool)
+        scored.fill(False)
+        pools = self._score_rows(pools, seeds if positions is None else positions[seeds], positions, scored,
+                                 step_targets, weighted_similarity, depth)
+        max_similarity = weighted_similarity[seeds].min()
+
+        # Get the highest similarity of the cold tracks of a shard other than the seeds.
+        # Hot tracks and seeds are pushed far below any similarity, without branching on the tiers.
+        def cold_shard(shard_start: int, shard_end: int) -> float:
+            hot = self.track_data.hot_tier[shard_start:shard_end] if positions is None \
+                else self.track_data.hot_tier[positions[shard_start:shard_end]]
+            cold_similarity = np.multiply(hot, np.finfo(dtype).min,
+                                          out=self._scratch('cold_similarity', shard_end - shard_start, dtype))
+            np.add(cold_similarity, weighted_similarity[shard_start:shard_end], out=cold_similarity)
+            shard_seeds = seeds[np.searchsorted(seeds, shard_start):np.searchsorted(seeds, shard_end)]
+            cold_similarity[shard_seeds - shard_start] = -np.inf
+            return cold_similarity.max()
+
+        # With tiered scoring, the cold tracks other than the seeds are bounded by their own highest similarity,
+        # which is often lower, so the cells that only their hot tracks can rank from skip their cold tracks
+        cold_max_similarity = max_similarity
+        if self.tiered_scoring:
+            cold_max_similarity = min(max_similarity, *self._map_shards(cold_shard, num_candidates))
+
+        # Score the tracks listed near each step in the goal shortlists and in the mood tables, if loaded.
+        # Tracks not listed are at least a list's radius from its mood, so at least the radius minus the distance
+        # from that mood to the step's target mood away from the target, which bounds their scores for the step.
+        # Lists whose mood is too far from the step to bound it are skipped. The last step of the goals with a fixed
+        # target mood falls near an anchor of its goal shortlists, so they can bound it.
+        lookups = [self.track_data.get_goal_shortlist]
+        if self.track_data.mood_table_rows is not None:
+            lookups.append(self.track_data.get_mood_table)
+        listed_rows = []
+        list_closeness = np.full(len(step_targets), np.inf)
+        for step, (step_valence, step_energy) in enumerate(step_targets):
+            for lookup in lookups:
+                listed = lookup(genres, step_valence, step_energy)
+                if listed is None:
+                    continue
+                rows, radius, (point_valence, point_energy) = listed
+
+                # The small margin covers rounding errors in the distances
+                distance = radius - np.hypot(step_valence - point_valence, step_energy - point_energy) - 1e-9
+                if distance <= 0:
+                    continue
+                listed_rows.append(rows)
+                closeness = max(1 - distance / self.sqrt2, 0) if np.isfinite(distance) else -np.inf
+                list_closeness[step] = min(list_closeness[step], closeness)
+        if listed_rows:
+            pools = self._score_rows(pools, np.unique(np.concatenate(listed_rows)), positions, scored,
+                                     step_targets, weighted_similarity, depth)
+        list_mood = list_closeness * self.weights['mood']
+        list_bounds = list_mood + max_similarity
+
+        # Only the steps whose list bound reaches the lowest score in their pool can still gain other tracks
+        open_steps = list_bounds >= pools[1][:, -1]
+        if not np.any(open_steps):
+            return pools
+
+        # Bound the scores of the other candidates in each cell, using the closest point of its bounding box.
+        # The bound is computed like the scores themselves, so no track can score above it.
+        # Unlisted tracks are also bounded by the list bound of each step.
+        cells, boxes = self.track_data.get_mood_cells(genres)
+        closest_valence = np.clip(step_targets[:, 0:1], boxes[:, 0], boxes[:, 1])
+        closest_energy = np.clip(step_targets[:, 1:2], boxes[:, 2], boxes[:, 3])
+        cell_bounds = self._combine_scores(closest_valence, closest_energy, step_targets[:, 0:1], step_targets[:, 1:2],
+                                           max_similarity)
+        bounds = np.minimum(cell_bounds, list_bounds[:, None])
+        cold_bounds = np.minimum(self._combine_scores(closest_valence, closest_energy, step_targets[:, 0:1],
+                                                      step_targets[:, 1:2], cold_max_similarity),
+                                 (list_mood + cold_max_similarity)[:, None])
+
+        # Score the candidates in the cells that can still enter any step's pool, in two rounds.
+        # The first round scores the few best cells of each open step, which raises the lowest scores in the pools,
+        # so the second round scores only the remaining cells that can still beat them.
+        # Trajectory steps are close together, so the steps share most cells, and all steps are scored at once.
+        # The cold tracks of a cell are only scored if the cold bound of the cell reaches the pools too.
+        searched = np.zeros(len(cells), dtype=bool)
+        cold_searched = np.zeros(len(cells), dtype=bool)
+        first_round = min(self.mood_search_first_cells, len(cells))
+        search = np.zeros(len(cells), dtype=bool)
+        search[np.argpartition(-cell_bounds[open_steps], first_round - 1, axis=1)[:, :first_round]] = True
+        search_cold = search.copy()
+        for _ in range(2):
+            searched |= search
+            cold_searched |= search_cold
+            hot_rows = self.track_data.get_mood_cell_positions(cells[search & ~search_cold])
+            rows = np.concatenate([self.track_data.get_mood_cell_positions(cells[search_cold]),
+                                   hot_rows[self.track_data.hot_tier[hot_rows]]])
+            pools = self._score_rows(pools, np.sort(rows), positions, scored, step_targets, weighted_similarity,
+                                     depth)
+            pool_min = pools[1][:, -1:]
+            search_cold = np.any(cold_bounds >= pool_min, axis=0) & ~cold_searched
+            search = np.any(bounds >= pool_min, axis=0) & ~searched | search_cold
+
+        return pools
+
+    # Rank the best tracks for each step of the mood trajectory by popularity tier.
+    # Returns the same pools as _rank_step_pools, for the candidates at the given row positions (None means all
+    # tracks), which must all be in the given genres (None means any genre).
+    # The hot tier is scored first. No cold candidate scores above its highest weighted similarity plus the mood
+    # weight times the closeness of the closest mood cell of the genres, so if that bound is below the lowest score
+    # in every step's pool, the cold tier is skipped; otherwise it is scored too and the pools are merged.
+    def _rank_step_pools_tiered(self,
+                                positions: np.ndarray | None,
+                                similarity_scores: np.ndarray,
+                                step_targets: np.ndarray,
+                                genres: list[str] | None,
+                                depth: int) -> tuple[np.ndarray, np.ndarray]:
+
+        hot, cold = self.track_data.split_tiers(positions)
+        pools = []
+        for tier in (hot, cold):
+            tier_similarity = np.take(similarity_scores, tier,
+                                      out=self._scratch('tier_similarity', len(tier), similarity_scores.dtype))
+            if tier is cold and pools[0][1].shape[1] == depth:
+                if len(cold) == 0:
+                    break
+                cells, boxes = self.track_data.get_mood_cells(genres)
+                closest_valence = np.clip(step_targets[:, 0:1], boxes[:, 0], boxes[:, 1])
+                closest_energy = np.clip(step_targets[:, 1:2], boxes[:, 2], boxes[:, 3])
+                max_similarity = np.multiply(tier_similarity.max(), self.weights['non_mood'])
+                bounds = self._combine_scores(closest_valence, closest_energy, step_targets[:, 0:1],
+                                              step_targets[:, 1:2], max_similarity)
+                if len(cells) == 0 or np.all(bounds.max(axis=1) < pools[0][1][:, -1]):
+                    break
+
+            rows = tier if positions is None else positions[tier]
+            pool_indices, pool_scores = self._rank_step_pools(self._gather('valence', rows, scratch=True),
+                                                              self._gather('energy', rows, scratch=True),
+                                                              tier_similarity, step_targets, depth)
+            pools.append((tier[pool_indices], pool_scores))
+
+        return self._concat_pools(pools, depth)
+
+    # Score the candidates among the given rows (in ascending order) for all steps and merge them into the pools,
+    # skipping the candidates already scored. Scored is a mask over the candidates, updated in place.
+    def _score_rows(self,
+                    pools: tuple[np.ndarray, np.ndarray],
+                    rows: np.ndarray,
+                    positions: np.ndarray | None,
+                    scored: np.ndarray,
+                    step_targets: np.ndarray,
+                    weighted_similarity: np.ndarray,
+                    depth: int) -> tuple[np.ndarray, np.ndarray]:
+
+        indices = self._candidate_indices(positions, rows)
+        indices = indices[~scored[indices]]
+        if len(indices) == 0:
+            return pools
+        scored[indices] = True
+
+        rows = indices if positions is None else positions[indices]
+        combined_scores = self._combine_scores(self._gather('valence', rows), self._gather('energy', rows),
+                                               step_targets[:, 0:1], step_targets[:, 1:2], weighted_similarity[indices],
+                                               out=self._scratch('row_scores', (len(step_targets), len(rows)),
+                                                                 np.float64))
+        return self._merge_pools(*pools, combined_scores, indices, depth)
+
+    # Combine mood closeness and weighted similarity into one score per track and step.
+    # Step valence and energy have one row per step and are broadcast against the block of tracks.
+    # Operations are done in place on one array, to avoid full-size temporaries; it is the given output array, if any.
+    def _combine_scores(self,
+                        valence: np.ndarray,
+                        energy: np.ndarray,
+                        step_valence: np.ndarray,
+                        step_energy: np.ndarray,
+                        weighted_similarity: np.ndarray,
+                        out: np.ndarray | None = None) -> np.ndarray:
+
+        # Calculate the Euclidean distance between each track's mood and each step's target mood.
+        # Given an output array, the energy differences go to a scratch array of the same shape.
+        scores = np.subtract(valence, step_valence, out=out)
+        energy_diff = np.subtract(energy, step_energy,
+                                  out=None if out is None else self._scratch('energy_diff', out.shape, out.dtype))
+        np.multiply(scores, scores, out=scores)
+        np.multiply(energy_diff, energy_diff, out=energy_diff)
+        np.add(scores, energy_diff, out=scores)
+        np.sqrt(scores, out=scores)
+
+        # Normalize distances to compute mood closeness (1 = exact match, 0 = no closeness).
+        # Assumes valence and energy are both in [0, 1], so the maximum possible distance is sqrt(2).
+        np.divide(scores, self.sqrt2, out=scores)
+        np.subtract(1, scores, out=scores)
+        np.clip(scores, 0, 1, out=scores)
+
+        # Combine scores for mood and non-mood features
+        np.multiply(scores, self.weights['mood'], out=scores)
+        np.add(scores, weighted_similarity, out=scores)
+        return scores
+
+    # Merge the best tracks of a block into running pools of the top `depth` tracks, one pool per row of scores.
+    # Indices are the (ascending) track indices of the block's columns.
+    # Pools hold track indices and scores, best first, with tracks of equal score ordered by index.
+    @staticmethod
+    def _merge_pools(pool_indices: np.ndarray,
+                     pool_scores: np.ndarray,
+                     scores: np.ndarray,
+                     indices: np.ndarray,
+                     depth: int) -> tuple[np.ndarray, np.ndarray]:
+
+        # Select the top k tracks of each row in the block: every track scoring above the k-th best,
+        # then the lowest-index tracks tied with it
+        num_rows, width = scores.shape
+        k = min(depth, width)
+        threshold = np.partition(scores, width - k, axis=1)[:, width - k:width - k + 1]
+        selected = scores >= threshold
+        counts = selected.sum(axis=1)
+        for row in np.flatnonzero(counts > k):
+            ties = np.flatnonzero(scores[row] == threshold[row, 0])
+            selected[row, ties[len(ties) - (counts[row] - k):]] = False
+        columns = np.nonzero(selected)[1].reshape(num_rows, k)
+
+        # Merge them into the pools, ordered by score and then by index
+        merged_indices = np.concatenate([pool_indices, indices[columns]], axis=1)
+        merged_scores = np.concatenate([pool_scores, np.take_along_axis(scores, columns, axis=1)], axis=1)
+        order = np.lexsort((merged_indices, -merged_scores), axis=-1)[:, :depth]
+        return np.take_along_axis(merged_indices, order, axis=1), np.take_along_axis(merged_scores, order, axis=1)
+
+    # Merge pools ranked separately into one pool of the top `depth` tracks per row, ordered by score and then by index
+    @staticmethod
+    def _concat_pools(pools: list[tuple[np.ndarray, np.ndarray]], depth: int) -> tuple[np.ndarray, np.ndarray]:
+        if len(pools) == 1:
+            return pools[0]
+        merged_indices = np.concatenate([indices for indices, _ in pools], axis=1)
+        merged_scores = np.concatenate([scores for _, scores in pools], axis=1)
+        order = np.lexsort((merged_indices, -merged_scores), axis=-1)[:, :depth]
+        return np.take_along_axis(merged_indices, order, axis=1), np.take_along_axis(merged_scores, order, axis=1)
+
+    # Call a function on shards of `count` items, returning its results in shard order.
+    # The function takes the start and end of a shard. With several scoring workers and at least
+    # scoring_shard_min_tracks items, one shard per worker is run on the scoring thread pool;
+    # otherwise the function is called once for all items, in the calling thread.
+    # Shards hold whole selection blocks, so blocks are the same however the items are sharded.
+    def _map_shards(self, function: Callable[[int, int], object], count: int) -> list:
+        workers = self.scoring_workers
+        if workers <= 1 or count < self.scoring_shard_min_tracks:
+            return [function(0, count)]
+
+        with self._scoring_pool_lock:
+            if self._scoring_pool_workers != workers:
+                if self._scoring_pool is not None:
+                    self._scoring_pool.shutdown(wait=False)
+                self._scoring_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scoring')
+                self._scoring_pool_workers = workers
+            pool = self._scoring_pool
+
+        block_size = self.selection_block_size
+        shard_size = -(-count // (workers * block_size)) * block_size
+        futures = [pool.submit(function, start, min(start + shard_size, count))
+                   for start in range(0, count, shard_size)]
+        return [future.result() for future in futures]
+
+    # Rank the best `depth` tracks for each step of the mood trajectory, returning their indices among the candidates.
+    # Large candidate sets are searched through the mood index; others are scored in full.
+    # Excluded candidates, given by index, are masked out with a similarity of -inf, so they only fill pools
+    # that run out of other candidates.
+    def _rank_candidates(self,
+                         positions: np.ndarray | None,
+                         similarity_scores: np.ndarray,
+                         step_targets: np.ndarray,
+                         genres: list[str] | None,
+                         depth: int,
+                         excluded: np.ndarray | None = None) -> np.ndarray:
+
+        num_candidates = len(similarity_scores)
+        if excluded is not None and len(excluded):
+            masked = self._scratch('masked_similarity', num_candidates, np.result_type(similarity_scores, np.float32))
+            np.copyto(masked, similarity_scores)
+            masked[excluded] = -np.inf
+            similarity_scores = masked
+
+        if num_candidates >= max(self.mood_search_min_tracks, self.mood_search_seed_size, depth):
+            pool_indices, _ = self._rank_step_pools_indexed(positions, similarity_scores, step_targets, genres, depth)
+        elif self.tiered_scoring:
+            pool_indices, _ = self._rank_step_pools_tiered(positions, similarity_scores, step_targets, genres, depth)
+        else:
+            valence = self._gather('valence', positions, scratch=True)
+            energy = self._gather('energy', positions, scratch=True)
+            pool_indices, _ = self._rank_step_pools(valence, energy, similarity_scores, step_targets, depth)
+        return pool_indices
+
+    # Recommend songs by combining taste similarity and progressive mood adjustment.
+    # Positions are the row positions of the candidate tracks (None means all tracks),
+    # and similarity scores are given in the same order. Genres are the genres of the candidates, if known,
+    # which narrows down the mood index cells to search (None means any genre).
+    # Tracks already recommended, given by ID or by row position, are left out.
+    # If a cache key is given and no more tracks than the result cache margin have been recommended, the ranked tracks
+    # are added to the result cache under that key.
+    def _recommend_songs(self,
+                         positions: np.ndarray | None,
+                         similarity_scores: np.ndarray,
+                         start_valence: float,
+                         start_energy: float,
+                         target_mood: dict,
+                         recommended_ids: list[str] | None = None,
+                         top_n: int = 10,
+                         genres: list[str] | None = None,
+                         cache_key: tuple | None = None,
+                         recommended_positions: np.ndarray | list[int] | None = None) -> list[dict]:
+
+        # Compute the target mood of each step
+        step_targets = self._step_targets(start_valence, start_energy, target_mood, top_n)
+
+        # With a cache key, rank all the candidates and cache the ranked tracks for later identical requests.
+        # Pools are ranked deep enough to hold top_n tracks besides the tracks already recommended,
+        # which are then skipped when selecting, so the result is the same as filtering them out first.
+        # Ranking deeper than the margin would make requests slower the more tracks a user has seen, so those
+        # requests take the masked path below instead.
+        excluded_rows = self._excluded_rows(recommended_ids, recommended_positions)
+        if cache_key is not None and len(excluded_rows) <= self.result_cache_margin:
+            depth = top_n + self.result_cache_margin
+            pool_indices = self._rank_candidates(positions, np.asarray(similarity_scores), step_targets, genres, depth)
+            pool_rows = pool_indices if positions is None else positions[pool_indices]
+            self.result_cache.put(cache_key,
+                                  {'rows': pool_rows, 'depth': depth, 'complete': pool_rows.shape[1] < depth},
+                                  size=pool_rows.nbytes)
+            selected = self._select_tracks(pool_rows, set(excluded_rows.tolist()))
+            return self._gather_tracks(np.array(selected, dtype=np.int64))
+
+        # Mask out the candidates already recommended, so the cost does not grow with the candidates left
+        excluded = self._candidate_indices(positions, excluded_rows)
+
+        # Rank a small pool of the best tracks for each step.
+        # At most top_n - 1 tracks are used before any step, so a pool of top_n tracks always holds the best unused one.
+        pool_indices = self._rank_candidates(positions, np.asarray(similarity_scores), step_targets, genres,
+                                             depth=top_n, excluded=excluded)
+
+        # Select the best track for each step, skipping tracks already recommended by an earlier step or before
+        selected = self._select_tracks(pool_indices, set(excluded.tolist()))
+        recommended_rows = np.array(selected, dtype=np.int64) if positions is None else positions[selected]
+
+        # Return recommendations as a list of dictionaries
+        return self._gather_tracks(recommended_rows)
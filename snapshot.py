@@ -0,0 +1,87 @@
+import json
+import os
+import struct
+import numpy as np
+
+
+# Binary snapshot file class.
+# A snapshot is a single file holding named NumPy arrays plus a JSON metadata header:
+# - magic bytes identifying the file format
+# - header length (unsigned 64-bit little endian)
+# - JSON header describing each array (dtype, shape, offset) and the caller's metadata
+# - raw array data, each array aligned to a 64-byte boundary
+class Snapshot:
+    magic = b'MTSNAP01'
+    alignment = 64
+
+    # Write arrays and metadata to a snapshot file.
+    # The file is written to a temporary path first and then moved into place,
+    # so readers never see a partially written snapshot.
+    @staticmethod
+    def write(path: str, arrays: dict[str, np.ndarray], meta: dict) -> None:
+        # Lay out the arrays one after another, relative to the start of the data section
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            if array.dtype.hasobject:
+                raise ValueError(f"Array '{name}' has an object dtype and cannot be stored in a snapshot.")
+            offset = Snapshot._align(offset)
+            layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += array.nbytes
+
+        header = json.dumps({"meta": meta, "arrays": layout}, separators=(',', ':')).encode('utf-8')
+        data_start = Snapshot._align(len(Snapshot.magic) + 8 + len(header))
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(Snapshot.magic)
+                f.write(struct.pack('<Q', len(header)))
+                f.write(header)
+                for name, array in arrays.items():
+                    f.write(b'\0' * (data_start + layout[name]['offset'] - f.tell()))
+                    f.write(np.ascontiguousarray(array).data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # Read arrays and metadata from a snapshot file.
+    # The file is memory-mapped read-only and all arrays are views into the mapping, so nothing is
+    # copied and processes reading the same snapshot share its pages through the OS page cache.
+    @staticmethod
+    def read(path: str) -> tuple[dict, dict[str, np.ndarray]]:
+        if os.path.getsize(path) == 0:
+            raise ValueError(f"{path} is not a snapshot file.")
+        buffer = np.memmap(path, dtype=np.uint8, mode='r')
+
+        # Validate the file format
+        prefix = len(Snapshot.magic) + 8
+        if len(buffer) < prefix or buffer[:len(Snapshot.magic)].tobytes() != Snapshot.magic:
+            raise ValueError(f"{path} is not a snapshot file.")
+
+        # Parse the header
+        (header_len,) = struct.unpack('<Q', buffer[len(Snapshot.magic):prefix].tobytes())
+        if len(buffer) < prefix + header_len:
+            raise ValueError(f"Snapshot {path} is truncated.")
+        header = json.loads(buffer[prefix:prefix + header_len].tobytes())
+        data_start = Snapshot._align(prefix + header_len)
+
+        # Create a view for each array
+        arrays = {}
+        for name, info in header['arrays'].items():
+            dtype = np.dtype(info['dtype'])
+            shape = tuple(info['shape'])
+            start = data_start + info['offset']
+            end = start + dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+            if end > len(buffer):
+                raise ValueError(f"Snapshot {path} is truncated.")
+            arrays[name] = buffer[start:end].view(dtype).reshape(shape)
+
+        return header['meta'], arrays
+
+    # Round an offset up to the next alignment boundary
+    @staticmethod
+    def _align(offset: int) -> int:
+        return -(-offset // Snapshot.alignment) * Snapshot.alignment
@@ -1,9 +1,24 @@
+import requests
 import secrets
 import spotipy
+from cache import LRUCache
 from exceptions import AuthenticationException, ApplicationException
 from flask import session
+from http.cookiejar import DefaultCookiePolicy
+from rate_limit import RateLimiter
+from requests.adapters import HTTPAdapter
 from spotipy import Spotify, SpotifyException
 from spotipy.oauth2 import SpotifyOAuth
+from typing import Any, Callable
+from urllib3.util.retry import Retry
+
+
+# HTTP session shared by the Spotify clients of all users.
+# Spotify clients close their session when they are garbage collected, which would drop the connections kept alive
+# for every other client, so closing it does nothing; it lasts as long as the service.
+class SharedHTTPSession(requests.Session):
+    def close(self) -> None:
+        pass
 
 
 # Spotify service class
@@ -19,6 +34,20 @@ class SpotifyService:
             show_dialog=True
         )
 
+        # Optional store of album image URLs, checked before fetching them from Spotify
+        self.artwork_store = None
+
+        # Optional budget for calls to Spotify, shared with other workers
+        self.rate_limiter = None
+
+        # Spotify clients by access token, reused for all calls made with the token.
+        # Access tokens last an hour, and the client for a token is removed when the token is refreshed.
+        self.clients = LRUCache(max_entries=1024, ttl=3600)
+
+        # HTTP session shared by all clients, keeping connections to Spotify alive between calls
+        self.http_pool_size = 10
+        self._http_session = self._create_http_session(self.http_pool_size)
+
     # Get Spotify authorisation URL
     def get_auth_url(self) -> str:
         # Generate a secure random state value for CSRF protection
@@ -51,13 +80,40 @@ class SpotifyService:
         if not token_info:
             raise AuthenticationException("You are not logged in. Please log in to continue.")
 
-        # Refresh the token if needed
+        # Refresh the token if needed, dropping the client for the old one
         if self.oauth.is_token_expired(token_info):
+            self.clients.remove(token_info['access_token'])
             token_info = self.oauth.refresh_access_token(token_info['refresh_token'])
             session['token_info'] = token_info
 
-        # Create Spotify client
-        return Spotify(auth=token_info['access_token'])
+        # Reuse the Spotify client for the token, or create one
+        access_token = token_info['access_token']
+        spotify = self.clients.get(access_token)
+        if spotify is None:
+            spotify = Spotify(auth=access_token, requests_session=self._http_session)
+            self.clients.put(access_token, spotify)
+        return spotify
+
+    # Create an HTTP session for Spotify clients with a pool of connections kept alive.
+    # Retries failed requests like spotipy does for its own sessions, except Too Many Requests responses, which are
+    # left to the rate limiter (or raised, without one). The session is shared by all users, so it keeps no cookies.
+    @staticmethod
+    def _create_http_session(pool_size: int) -> SharedHTTPSession:
+        retry = Retry(
+            total=3,
+            connect=None,
+            read=False,
+            allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+            status=3,
+            backoff_factor=0.3,
+            status_forcelist=RateLimiter.retry_statuses
+        )
+        adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+        http_session = SharedHTTPSession()
+        http_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        http_session.mount('https://', adapter)
+        http_session.mount('http://', adapter)
+        return http_session
 
     # Get Spotify user ID
     def get_user_id(self) -> str:
@@ -66,7 +122,7 @@ class SpotifyService:
 
         # Get user ID
         try:
-            user = spotify.current_user()
+            user = self._call(RateLimiter.interactive, spotify.current_user)
             return user['id']
         except SpotifyException as e:
             # If user is logged in but not registered, return dummy user ID so that they can use the app in demo mode
@@ -81,12 +137,36 @@ class SpotifyService:
 
         # Get tracks
         try:
-            tracks = spotify.tracks(track_ids)
+            tracks = self._call(RateLimiter.background, spotify.tracks, track_ids)
             # Return tracks
             return tracks['tracks']
         except SpotifyException as e:
             raise ApplicationException("There was an error retrieving track information.", details=str(e))
 
+    # Get the album image URL of each track with the given IDs, using the medium-sized image where there is one.
+    # Tracks that are not found or have no album image are left out.
+    # With an artwork store, only tracks that are not in the store are fetched from Spotify, and then added to it.
+    def get_album_images(self, track_ids: list[str]) -> dict[str, str]:
+        images = self.artwork_store.get_many(track_ids) if self.artwork_store else {}
+        missing = [track_id for track_id in dict.fromkeys(track_ids) if track_id not in images]
+        if missing:
+            fetched = dict.fromkeys(missing)
+            for track in self.get_tracks(missing):
+                if track:
+                    fetched[track['id']] = self.album_image_url(track)
+            if self.artwork_store:
+                self.artwork_store.put_many(fetched)
+            images.update(fetched)
+        return {track_id: image_url for track_id, image_url in images.items() if image_url}
+
+    # Get the URL of a track's medium-sized album image, or its only one, or None if its album has no images
+    @staticmethod
+    def album_image_url(track: dict) -> str | None:
+        album_images = track['album']['images']
+        if not album_images:
+            return None
+        return album_images[min(1, len(album_images) - 1)]['url']
+
     # Get active device
     def get_active_device(self, spotify: Spotify | None = None) -> str:
         # Get Spotify client
@@ -95,7 +175,7 @@ class SpotifyService:
 
         # Get active devices
         try:
-            devices = spotify.devices()
+            devices = self._call(RateLimiter.interactive, spotify.devices)
             num_devices = len(devices['devices'])
             if num_devices == 0:
                 raise ApplicationException(
@@ -112,7 +192,7 @@ class SpotifyService:
         spotify = self.get_client()
         device_id = self.get_active_device(spotify)
         try:
-            spotify.start_playback(device_id, None, uris)
+            self._call(RateLimiter.interactive, spotify.start_playback, device_id, None, uris)
         except SpotifyException as e:
             raise ApplicationException("There was an error adding the tracks to the queue.", details=str(e))
         return True
@@ -122,7 +202,7 @@ class SpotifyService:
         spotify = self.get_client()
         device_id = self.get_active_device(spotify)
         try:
-            spotify.pause_playback(device_id=device_id)
+            self._call(RateLimiter.interactive, spotify.pause_playback, device_id=device_id)
         except SpotifyException as e:
             raise ApplicationException("There was an error pausing the track.", details=str(e))
         return True
@@ -132,7 +212,7 @@ class SpotifyService:
         spotify = self.get_client()
         device_id = self.get_active_device(spotify)
         try:
-            spotify.start_playback(device_id=device_id)
+            self._call(RateLimiter.interactive, spotify.start_playback, device_id=device_id)
         except SpotifyException as e:
             raise ApplicationException("There was an error resuming the track.", details=str(e))
         return True
@@ -142,7 +222,7 @@ class SpotifyService:
         spotify = self.get_client()
         device_id = self.get_active_device(spotify)
         try:
-            spotify.next_track(device_id=device_id)
+            self._call(RateLimiter.interactive, spotify.next_track, device_id=device_id)
         except SpotifyException as e:
             raise ApplicationException("There was an error skipping to the next track.", details=str(e))
         return True
@@ -152,7 +232,7 @@ class SpotifyService:
         spotify = self.get_client()
         device_id = self.get_active_device(spotify)
         try:
-            spotify.previous_track(device_id=device_id)
+            self._call(RateLimiter.interactive, spotify.previous_track, device_id=device_id)
         except SpotifyException as e:
             raise ApplicationException("There was an error skipping to the previous track.", details=str(e))
         return True
@@ -161,8 +241,15 @@ class SpotifyService:
     def get_top_artists(self) -> list[str]:
         spotify = self.get_client()
         try:
-            top_artists = spotify.current_user_top_artists(limit=10)
+            top_artists = self._call(RateLimiter.interactive, spotify.current_user_top_artists, limit=10)
             artist_names = [artist['name'] for artist in top_artists['items']]
             return artist_names
         except SpotifyException as e:
             raise ApplicationException("There was an error retrieving your top artists.", details=str(e))
+
+    # Call a Spotify client method, within the rate limiter's budget if there is one.
+    # Playback commands and other calls made for the user are interactive; calls that only add details are background.
+    def _call(self, priority: int, method: Callable, *args, **kwargs) -> Any:
+        if self.rate_limiter:
+            return self.rate_limiter.call(priority, method, *args, **kwargs)
+        return method(*args, **kwargs)
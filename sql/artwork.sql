@@ -0,0 +1,15 @@
+/*
+  Table: artwork
+  Caches the album image URL of Spotify tracks, so they are only fetched from the Spotify API once.
+  Created on startup if it doesn't exist, so that existing databases get it too.
+
+  Fields:
+    track_id   - Spotify track ID
+    image_url  - URL of the track's album image, or NULL if Spotify has no image for the track
+    fetched_at - Unix time when the image URL was fetched from Spotify
+*/
+CREATE TABLE IF NOT EXISTS `artwork` (
+    `track_id` TEXT PRIMARY KEY,
+    `image_url` TEXT,
+    `fetched_at` REAL NOT NULL
+);
@@ -0,0 +1,17 @@
+/*
+  Table: rate_limit
+  Holds the token bucket that budgets calls to an API, shared by all app workers and jobs.
+  Created on startup if it doesn't exist, so that existing databases get it too.
+
+  Fields:
+    name          - Name of the API
+    tokens        - Calls that can be made now, without waiting
+    updated_at    - Unix time when the tokens were last counted
+    blocked_until - Unix time until which no calls are made, after the API asked callers to retry later
+*/
+CREATE TABLE IF NOT EXISTS `rate_limit` (
+    `name` TEXT PRIMARY KEY,
+    `tokens` REAL NOT NULL,
+    `updated_at` REAL NOT NULL,
+    `blocked_until` REAL NOT NULL
+);
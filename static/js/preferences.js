@@ -26,75 +26,58 @@ document.addEventListener("DOMContentLoaded", () => {
     return;
   }
 
-  // Constants for localStorage cache key and max age
-  const CACHE_KEY = "artistList";
-  const CACHE_MAX_AGE = 24 * 60 * 60 * 1000; // 1 day in milliseconds
+  // Number of artists to fetch per page of search results
+  const PAGE_SIZE = 50;
 
-  // Try to use cached data
-  const cached = localStorage.getItem(CACHE_KEY);
-
-  if (cached) {
-    // Parse the cached JSON object
-    const parsed = JSON.parse(cached);
-    const age = Date.now() - parsed.timestamp;
-
-    // If cached data is still fresh, use it
-    if (age < CACHE_MAX_AGE) {
-      initArtistSelect(parsed.data);
-      return;
-    } else {
-      // Otherwise, remove stale cache
-      localStorage.removeItem(CACHE_KEY);
-    }
+  // Build the URL for a page of artist search results
+  function searchUrl(query, page) {
+    const params = new URLSearchParams({ q: query, page: page, limit: PAGE_SIZE });
+    return `/api/artists/search?${params}`;
   }
 
-  // Fetch artists from API
-  fetch("/api/artists", { headers: { "X-CSRFToken": csrfToken } })
-    .then((response) => response.json())
-    .then((artists) => {
-      // Store fetched data in localStorage with a timestamp
-      localStorage.setItem(
-        CACHE_KEY,
-        JSON.stringify({
-          data: artists,
-          timestamp: Date.now(),
-        })
-      );
-
-      // Initialize the dropdown with fetched data
-      initArtistSelect(artists);
-    })
-    .catch((error) => console.error("Error loading artists:", error));
-
-  // Function to initialize artist dropdown
-  function initArtistSelect(artists) {
-    // Map artist names into Tom Select format
-    const options = artists.map((artist) => ({
-      value: artist,
-      text: artist,
-    }));
+  // Get preferred artists from Alpine.js state
+  let selected_items = [];
+  const preferred_artists = getAlpineDataProperty("artists");
+  if (Array.isArray(preferred_artists)) {
+    selected_items = preferred_artists;
+  }
 
-    // Get preferred artists from Alpine.js state
-    let selected_items = [];
-    const preferred_artists = getAlpineDataProperty("artists");
-    if (Array.isArray(preferred_artists)) {
-      selected_items = preferred_artists;
-    }
+  // Initialize Tom Select.
+  // Artists are searched on the server as the user types, one page at a time.
+  // Preferred artists are added as options up front, so they can be shown as selected.
+  new TomSelect(artistSelect, {
+    options: selected_items.map((artist) => ({ value: artist, text: artist })),
+    items: selected_items,
+    maxOptions: null,
+    searchField: "text",
+    placeholder: "Search for an artist...",
+    persist: false,
+    create: false,
+    clearAfterSelect: true,
+    closeAfterSelect: true,
+    plugins: ["remove_button", "virtual_scroll"],
+    loadThrottle: 250,
+    shouldLoad: (query) => query.trim().length > 0,
+    firstUrl: (query) => searchUrl(query, 1),
+    load: function (query, callback) {
+      const url = this.getUrl(query);
+      fetch(url, { headers: { "X-CSRFToken": csrfToken } })
+        .then((response) => response.json())
+        .then((results) => {
+          // Register the URL of the next page, if there is one
+          if (results.has_more) {
+            this.setNextUrl(query, searchUrl(query, results.page + 1));
+          }
 
-    // Initialize Tom Select
-    new TomSelect(artistSelect, {
-      options: options,
-      items: selected_items,
-      maxOptions: 1000,
-      searchField: "text",
-      placeholder: "Search for an artist...",
-      persist: false,
-      create: false,
-      clearAfterSelect: true,
-      closeAfterSelect: true,
-      plugins: ["remove_button"],
-    });
-  }
+          // Map artist names into Tom Select format
+          callback(results.artists.map((artist) => ({ value: artist, text: artist })));
+        })
+        .catch((error) => {
+          console.error("Error searching artists:", error);
+          callback();
+        });
+    },
+  });
 
   // Function to get a property from Alpine.js state
   function getAlpineDataProperty(propName) {
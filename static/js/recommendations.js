@@ -65,6 +65,30 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  // Replace the placeholder album images once the page has rendered.
+  // Images that cannot be loaded keep their placeholder.
+  const albumImages = document.querySelectorAll("img.album-image[data-track-id]");
+  if (albumImages.length > 0) {
+    const trackIds = [...new Set([...albumImages].map((img) => img.dataset.trackId))];
+    (async () => {
+      try {
+        const response = await fetch(`/api/artwork?ids=${encodeURIComponent(trackIds.join(","))}`);
+        if (!response.ok) {
+          return;
+        }
+        const result = await response.json();
+        albumImages.forEach((img) => {
+          const url = result.images[img.dataset.trackId];
+          if (url) {
+            img.src = url;
+          }
+        });
+      } catch (error) {
+        // Keep the placeholders
+      }
+    })();
+  }
+
   // Navigation handlers for "new songs" and "new mood" buttons
   if (newSongsBtn) {
     newSongsBtn.addEventListener("click", () => {
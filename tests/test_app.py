@@ -1,5 +1,6 @@
 import pytest
 import json
+import numpy as np
 from unittest.mock import MagicMock, patch
 
 
@@ -242,8 +243,9 @@ class TestApp:
         assert response.status_code == 302
         assert response.location == '/'
 
+    @patch('app.app.track_data')
     @patch('app.app.recommender')
-    def test_recommendations_page_authenticated(self, mock_recommender, client):
+    def test_recommendations_page_authenticated(self, mock_recommender, mock_track_data, client):
         """Test the recommendations page when user is logged in with all required session data."""
         mock_recommender.get_recommendations.return_value = [
             {
@@ -251,14 +253,16 @@ class TestApp:
                 "track_name": "Test Track 1",
                 "artist": "Test Artist 1",
                 "valence": 0.5,
-                "energy": 0.5
+                "energy": 0.5,
+                "position": 7
             },
             {
                 "track_id": "spotify:track:2",
                 "track_name": "Test Track 2",
                 "artist": "Test Artist 2",
                 "valence": 0.7,
-                "energy": 0.7
+                "energy": 0.7,
+                "position": 2
             }
         ]
         
@@ -273,7 +277,9 @@ class TestApp:
                 'popularity': 80,
                 'instrumentalness': 0.2
             }
-            sess['recommended_ids'] = []
+            sess['recommended_positions'] = [5, 9]
+            sess['recommended_version'] = 'checksum'
+        mock_track_data.checksum = 'checksum'
         
         response = client.get('/recommendations')
         assert response.status_code == 200
@@ -287,12 +293,47 @@ class TestApp:
                 'popularity': 80,
                 'instrumentalness': 0.2
             },
-            []
+            recommended_positions=[5, 9]
         )
+
+        # The row positions returned with the tracks are stored, without looking them up again
+        mock_track_data.get_track_positions.assert_not_called()
         
         # Check that session values are updated correctly
         with client.session_transaction() as sess:
-            assert sess['recommended_ids'] == ['spotify:track:1', 'spotify:track:2']
+            assert sess['recommended_positions'] == [2, 5, 7, 9]
+            assert sess['recommended_version'] == 'checksum'
+
+    @patch('app.app.track_data')
+    @patch('app.app.recommender')
+    def test_recommendations_page_resets_stale_positions(self, mock_recommender, mock_track_data, client):
+        """Test that recommended positions recorded against another dataset are not used."""
+        mock_recommender.get_recommendations.return_value = [{
+            "track_id": "spotify:track:1",
+            "track_name": "Test Track 1",
+            "artist": "Test Artist 1",
+            "valence": 0.5,
+            "energy": 0.5,
+            "position": 4
+        }]
+        mock_track_data.checksum = 'new'
+
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+            sess['valence'] = 0.6
+            sess['energy'] = 0.4
+            sess['goal'] = 'lift_me_up'
+            sess['preferences'] = {'artists': [], 'genres': [], 'popularity': 50, 'instrumentalness': 0.5}
+            sess['recommended_positions'] = [5, 9]
+            sess['recommended_version'] = 'old'
+
+        response = client.get('/recommendations')
+        assert response.status_code == 200
+        assert mock_recommender.get_recommendations.call_args.kwargs['recommended_positions'] == []
+
+        with client.session_transaction() as sess:
+            assert sess['recommended_positions'] == [4]
+            assert sess['recommended_version'] == 'new'
 
     def test_recommendations_page_missing_data(self, client):
         """Test the recommendations page when required session data is missing."""
@@ -383,20 +424,153 @@ class TestApp:
             assert 'logged_in' not in sess
             assert 'user_id' not in sess
 
-    @patch('app.app.track_data')
-    def test_artists_api(self, mock_track_data, client):
+    def test_artists_api(self, client):
         """Test the artists API endpoint."""
-        mock_track_data.get_all_artists.return_value = ["Artist 1", "Artist 2", "Artist 3"]
-        
+        from app import app
+
         response = client.get('/api/artists')
         assert response.status_code == 200
-        
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        assert response.headers.get('Content-Encoding') is None
+
         # Check response data
         data = json.loads(response.data)
-        assert data == ["Artist 1", "Artist 2", "Artist 3"]
-        
-        # Verify track data service was called
-        mock_track_data.get_all_artists.assert_called_once()
+        assert data == app.track_data.get_all_artists()
+
+        # A repeat request with the ETag gets a 304 without a body
+        etag = response.headers['ETag']
+        response = client.get('/api/artists', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+    def test_artists_api_gzip(self, client):
+        """Test the artists API endpoint with a client that accepts gzip."""
+        import gzip
+        from app import app
+
+        response = client.get('/api/artists', headers={'Accept-Encoding': 'gzip, deflate'})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert json.loads(gzip.decompress(response.data)) == app.track_data.get_all_artists()
+
+        # The gzip representation has its own ETag
+        plain = client.get('/api/artists')
+        assert response.headers['ETag'] != plain.headers['ETag']
+
+    @patch('app.app.track_data')
+    def test_artists_api_encoded_once(self, mock_track_data, client):
+        """Test that the artists API serves the pre-encoded payload from the track data."""
+        mock_track_data.get_artists_json.return_value = {
+            "version": "v1", "body": b'["Artist 1","Artist 2","Artist 3"]', "gzip": b'', "etag": "abc"
+        }
+
+        response = client.get('/api/artists')
+        assert json.loads(response.data) == ["Artist 1", "Artist 2", "Artist 3"]
+        assert response.headers['ETag'] == '"abc"'
+        mock_track_data.get_artists_json.assert_called_once()
+        mock_track_data.get_all_artists.assert_not_called()
+
+    @patch('app.app.track_data')
+    def test_artist_search_api(self, mock_track_data, client):
+        """Test the artist search API endpoint."""
+        mock_track_data.search_artists.return_value = (["Artist 3", "Artist 4"], 5)
+
+        response = client.get('/api/artists/search?q=art&page=2&limit=2')
+        assert response.status_code == 200
+
+        # Check response data
+        data = json.loads(response.data)
+        assert data == {"artists": ["Artist 3", "Artist 4"], "page": 2, "total": 5, "has_more": True}
+
+        # Verify the requested page was searched
+        mock_track_data.search_artists.assert_called_once_with("art", offset=2, limit=2)
+
+    @patch('app.app.track_data')
+    def test_artist_search_api_limits(self, mock_track_data, client):
+        """Test that the artist search API clamps invalid page and limit values."""
+        mock_track_data.search_artists.return_value = ([], 0)
+
+        response = client.get('/api/artists/search?q=art&page=0&limit=1000')
+        assert response.status_code == 200
+        assert json.loads(response.data)["has_more"] is False
+        mock_track_data.search_artists.assert_called_once_with("art", offset=0, limit=100)
+
+    def test_artwork_api_unauthenticated(self, client):
+        """Test that the artwork API requires the user to be logged in."""
+        response = client.get('/api/artwork?ids=1,2')
+        assert response.status_code == 401
+
+    @patch('app.app.spotify_service')
+    def test_artwork_api(self, mock_spotify_service, client):
+        """Test getting the album images of recommended tracks."""
+        mock_spotify_service.get_album_images.return_value = {"1": "image1.jpg", "2": "image2.jpg"}
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+
+        response = client.get('/api/artwork?ids=1,2,1,')
+        assert response.status_code == 200
+        assert json.loads(response.data) == {"images": {"1": "image1.jpg", "2": "image2.jpg"}}
+        assert response.headers['Cache-Control'] == 'private, max-age=3600'
+
+        # Duplicate and empty IDs are dropped
+        mock_spotify_service.get_album_images.assert_called_once_with(["1", "2"])
+
+    @patch('app.app.spotify_service')
+    def test_artwork_api_invalid_ids(self, mock_spotify_service, client):
+        """Test the artwork API with no track IDs or more than fit in one Spotify batch."""
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+
+        response = client.get('/api/artwork')
+        assert response.status_code == 400
+
+        response = client.get('/api/artwork?ids=' + ','.join(str(i) for i in range(51)))
+        assert response.status_code == 400
+        mock_spotify_service.get_album_images.assert_not_called()
+
+    @patch('app.app.spotify_service')
+    def test_artwork_api_error(self, mock_spotify_service, client):
+        """Test the artwork API when the Spotify API fails."""
+        mock_spotify_service.get_album_images.side_effect = Exception("Spotify API error")
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+
+        response = client.get('/api/artwork?ids=1')
+        assert response.status_code == 502
+        assert "error" in json.loads(response.data)
+
+    @patch('app.app.spotify_service')
+    def test_artwork_stats_api(self, mock_spotify_service, client):
+        """Test getting the album image cache statistics, which requires the user to be logged in."""
+        stats = {"stored": 3, "process": {"entries": 1, "memory_hits": 2, "store_hits": 1, "misses": 1,
+                                          "hit_ratio": 0.75}}
+        mock_spotify_service.artwork_store.stats.return_value = stats
+
+        response = client.get('/api/artwork/stats')
+        assert response.status_code == 401
+
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+        response = client.get('/api/artwork/stats')
+        assert response.status_code == 200
+        assert json.loads(response.data) == stats
+
+    @patch('app.app.spotify_service')
+    def test_spotify_stats_api(self, mock_spotify_service, client):
+        """Test getting the Spotify call budget and counters, which requires the user to be logged in."""
+        stats = {"bucket": {"tokens": 12.5, "blocked_for": 0.0},
+                 "process": {"calls": 5, "waits": 1, "throttled": 1, "retried": 1, "rejected": 0}}
+        mock_spotify_service.rate_limiter.stats.return_value = stats
+
+        response = client.get('/api/spotify/stats')
+        assert response.status_code == 401
+
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+        response = client.get('/api/spotify/stats')
+        assert response.status_code == 200
+        assert json.loads(response.data) == stats
 
     @patch('app.app.spotify_service')
     def test_queue_api_success(self, mock_spotify_service, client):
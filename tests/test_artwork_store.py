@@ -0,0 +1,61 @@
+import pytest
+from unittest.mock import patch
+from artwork_store import ArtworkStore
+
+
+class TestArtworkStore:
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        """Path of a new database for the store."""
+        return str(tmp_path / "moodtunes.db")
+
+    def test_get_and_put(self, db_path):
+        """Test that stored image URLs are returned, including tracks stored without an image."""
+        store = ArtworkStore(db_path)
+        store.put_many({"track1": "image1.jpg", "track2": None})
+
+        assert store.get_many(["track1", "track2", "track3", "track1"]) == {"track1": "image1.jpg", "track2": None}
+        assert store.stats() == {
+            "stored": 2,
+            "process": {"entries": 2, "memory_hits": 2, "store_hits": 0, "misses": 1, "hit_ratio": 2 / 3}
+        }
+
+    def test_persistent(self, db_path):
+        """Test that image URLs are kept in the database for other stores, and then held in memory."""
+        ArtworkStore(db_path).put_many({"track1": "image1.jpg"})
+
+        store = ArtworkStore(db_path)
+        assert store.get_many(["track1"]) == {"track1": "image1.jpg"}
+        assert store.get_many(["track1"]) == {"track1": "image1.jpg"}
+        assert store.stats()["process"]["store_hits"] == 1
+        assert store.stats()["process"]["memory_hits"] == 1
+
+    def test_replace(self, db_path):
+        """Test that adding a stored track replaces its image URL."""
+        store = ArtworkStore(db_path)
+        store.put_many({"track1": "old.jpg"})
+        store.put_many({"track1": "new.jpg"})
+
+        assert store.get_many(["track1"]) == {"track1": "new.jpg"}
+        assert ArtworkStore(db_path).get_many(["track1"]) == {"track1": "new.jpg"}
+
+    def test_expired_entries(self, db_path):
+        """Test that image URLs older than the time to live are treated as missing, in memory and the database."""
+        store = ArtworkStore(db_path, ttl=10)
+        with patch("artwork_store.time.time", return_value=1000):
+            store.put_many({"track1": "image1.jpg"})
+
+        with patch("artwork_store.time.time", return_value=1005):
+            assert store.get_many(["track1"]) == {"track1": "image1.jpg"}
+            assert ArtworkStore(db_path, ttl=10).get_many(["track1"]) == {"track1": "image1.jpg"}
+        with patch("artwork_store.time.time", return_value=1011):
+            assert store.get_many(["track1"]) == {}
+            assert ArtworkStore(db_path, ttl=10).get_many(["track1"]) == {}
+
+    def test_many_tracks(self, db_path):
+        """Test looking up more tracks than fit in one query."""
+        store = ArtworkStore(db_path)
+        store.put_many({f"track{i}": f"image{i}.jpg" for i in range(1200)})
+
+        images = ArtworkStore(db_path).get_many([f"track{i}" for i in range(1300)])
+        assert images == {f"track{i}": f"image{i}.jpg" for i in range(1200)}
@@ -0,0 +1,104 @@
+import pytest
+from unittest.mock import patch
+from cache import LRUCache
+
+
+class TestLRUCache:
+    def test_get_and_put(self):
+        """Test that values are returned for cached keys and the default for missing keys."""
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("b", 0) == 0
+        assert cache.stats() == {"entries": 1, "bytes": 0, "hits": 1, "misses": 2, "evictions": 0, "expirations": 0}
+
+    def test_evicts_least_recently_used(self):
+        """Test that a full cache evicts the entry used least recently."""
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert len(cache) == 2
+        assert cache.evictions == 1
+
+    def test_replace_value(self):
+        """Test that putting an existing key replaces its value without evicting anything."""
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.put("a", 3)
+
+        assert cache.get("a") == 3
+        assert cache.get("b") == 2
+        assert cache.evictions == 0
+
+    def test_expired_entries(self):
+        """Test that entries older than the time to live are treated as missing."""
+        cache = LRUCache(max_entries=2, ttl=10)
+        with patch("cache.time.monotonic", return_value=100.0):
+            cache.put("a", 1)
+        with patch("cache.time.monotonic", return_value=110.0):
+            assert cache.get("a") == 1
+        with patch("cache.time.monotonic", return_value=110.5):
+            assert cache.get("a") is None
+
+        assert len(cache) == 0
+        assert cache.stats() == {"entries": 0, "bytes": 0, "hits": 1, "misses": 1, "evictions": 0, "expirations": 1}
+
+    def test_remove(self):
+        """Test that removing a key removes only its entry, and removing a missing key does nothing."""
+        cache = LRUCache(max_bytes=10)
+        cache.put("a", 1, size=4)
+        cache.put("b", 2, size=3)
+        cache.remove("a")
+        cache.remove("c")
+
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        assert cache.size == 3
+
+    def test_clear(self):
+        """Test that clearing the cache removes all entries but keeps the counters."""
+        cache = LRUCache()
+        cache.put("a", 1)
+        cache.get("a")
+        cache.clear()
+
+        assert cache.get("a") is None
+        assert cache.stats()["hits"] == 1
+
+    @pytest.mark.parametrize("max_entries", [0, 1])
+    def test_small_caches(self, max_entries):
+        """Test that a cache never holds more than its maximum number of entries."""
+        cache = LRUCache(max_entries=max_entries)
+        cache.put("a", 1)
+        cache.put("b", 2)
+
+        assert len(cache) == max_entries
+        assert cache.get("b") == (2 if max_entries else None)
+
+    def test_max_bytes(self):
+        """Test that the least recently used entries are evicted to keep the total size within the limit."""
+        cache = LRUCache(max_entries=10, max_bytes=100)
+        cache.put("a", 1, size=40)
+        cache.put("b", 2, size=40)
+        cache.get("a")
+        cache.put("c", 3, size=40)
+
+        assert cache.get("b") is None
+        assert cache.stats()["bytes"] == 80
+        assert cache.evictions == 1
+
+        # Replacing an entry replaces its size, and values larger than the cache are not added
+        cache.put("a", 4, size=10)
+        assert cache.stats()["bytes"] == 50
+        cache.put("d", 5, size=101)
+        assert cache.get("d") is None
+        assert cache.stats()["bytes"] == 50
@@ -0,0 +1,42 @@
+import threading
+import pytest
+from connections import ThreadConnections
+
+
+class TestThreadConnections:
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        """Path of a new database."""
+        return str(tmp_path / "moodtunes.db")
+
+    def test_one_connection_per_thread(self, db_path):
+        """Test that each thread gets its own connection, reused on every call."""
+        connections = ThreadConnections(db_path)
+        conn = connections.get()
+        assert connections.get() is conn
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(connections.get()))
+        thread.start()
+        thread.join()
+        assert other[0] is not conn
+
+    def test_write_ahead_logging(self, db_path):
+        """Test that connections use write-ahead logging and the given isolation level."""
+        conn = ThreadConnections(db_path, isolation_level=None).get()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.isolation_level is None
+        assert ThreadConnections(db_path).get().isolation_level == ''
+
+    def test_reads_during_write(self, db_path):
+        """Test that reads in another connection see the last commit while a write is in progress."""
+        writer = ThreadConnections(db_path, isolation_level=None).get()
+        writer.execute("CREATE TABLE items (value INTEGER)")
+        writer.execute("INSERT INTO items VALUES (1)")
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("INSERT INTO items VALUES (2)")
+
+        reader = ThreadConnections(db_path, timeout=0).get()
+        assert reader.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 1
+        writer.execute("COMMIT")
+        assert reader.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 2
@@ -0,0 +1,142 @@
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from spotipy import Spotify
+from artwork_store import ArtworkStore
+from rate_limit import RateLimiter
+from prewarm_artwork import load_checkpoint, prewarm, save_checkpoint
+
+
+# Stand-in for the Spotify tracks endpoint, serving tracks with one album image each, except tracks ending in 0,
+# which have none, and tracks starting with "missing", which are not found.
+# Records the track IDs of each request, fails requests with IDs in fail_ids, and responds to the next throttled
+# requests with Too Many Requests.
+class SpotifyHandler(BaseHTTPRequestHandler):
+    requests = []
+    fail_ids = set()
+    throttled = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        track_ids = parse_qs(url.query)['ids'][0].split(',')
+        self.requests.append(track_ids)
+        if SpotifyHandler.throttled:
+            SpotifyHandler.throttled -= 1
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if url.path != '/v1/tracks/' or self.fail_ids.intersection(track_ids):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        tracks = [None if track_id.startswith('missing') else {
+            "id": track_id,
+            "album": {"images": [] if track_id.endswith('0') else [{"url": f"{track_id}.jpg"}]}
+        } for track_id in track_ids]
+        body = json.dumps({"tracks": tracks}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPrewarmArtwork:
+    @pytest.fixture
+    def server(self):
+        """Run the stand-in Spotify server on a free port."""
+        SpotifyHandler.requests = []
+        SpotifyHandler.fail_ids = set()
+        SpotifyHandler.throttled = 0
+        server = ThreadingHTTPServer(('127.0.0.1', 0), SpotifyHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    @pytest.fixture
+    def make_client(self, server):
+        """Create Spotify clients that call the stand-in server."""
+        def make_client():
+            spotify = Spotify(auth="test_token", retries=0, status_retries=0,
+                              status_forcelist=RateLimiter.retry_statuses)
+            spotify.prefix = f"http://127.0.0.1:{server.server_port}/v1/"
+            return spotify
+        return make_client
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        """Create an artwork store in a new database."""
+        return ArtworkStore(str(tmp_path / "moodtunes.db"))
+
+    def test_prewarm(self, make_client, store, tmp_path):
+        """Test that every track is fetched once, in batches of 50, skipping tracks already stored."""
+        track_ids = [f"track{i}" for i in range(120)] + ["missing1"]
+        store.put_many({"track5": "stored.jpg"})
+        checkpoint_path = str(tmp_path / "checkpoint.json")
+        progress = []
+
+        fetched = prewarm(track_ids, store, make_client, checkpoint_path, workers=2, progress=progress.append)
+
+        assert fetched == 120
+        assert sorted(len(ids) for ids in SpotifyHandler.requests) == [21, 49, 50]
+        assert progress == [50, 100, 121]
+        images = store.get_many(track_ids)
+        assert images["track5"] == "stored.jpg"
+        assert images["track1"] == "track1.jpg"
+        assert images["track10"] is None
+        assert images["missing1"] is None
+        assert len(images) == 121
+
+        # The checkpoint is removed once done
+        assert not (tmp_path / "checkpoint.json").exists()
+
+    def test_resume(self, make_client, store, tmp_path, server):
+        """Test that a failed run keeps its checkpoint, and the next run continues from it."""
+        track_ids = [f"track{i}" for i in range(200)]
+        checkpoint_path = str(tmp_path / "checkpoint.json")
+        SpotifyHandler.fail_ids = {"track120"}
+
+        with pytest.raises(Exception):
+            prewarm(track_ids, store, make_client, checkpoint_path, checksum="abc", workers=1)
+        assert load_checkpoint(checkpoint_path, "abc") == 100
+
+        SpotifyHandler.fail_ids = set()
+        SpotifyHandler.requests = []
+        fetched = prewarm(track_ids, ArtworkStore(store.db_path), make_client, checkpoint_path, checksum="abc")
+
+        assert fetched == 100
+        assert sorted(ids[0] for ids in SpotifyHandler.requests) == ["track100", "track150"]
+        assert len(store.get_many(track_ids)) == 200
+
+    def test_rate_limited(self, make_client, store, tmp_path):
+        """Test that batches throttled by Spotify are retried within the shared budget."""
+        track_ids = [f"track{i}" for i in range(100)]
+        rate_limiter = RateLimiter(store.db_path)
+        SpotifyHandler.throttled = 2
+
+        fetched = prewarm(track_ids, store, make_client, str(tmp_path / "checkpoint.json"), workers=1,
+                          rate_limiter=rate_limiter)
+
+        assert fetched == 100
+        assert len(SpotifyHandler.requests) == 4
+        assert rate_limiter.stats()["process"]["throttled"] == 2
+        assert rate_limiter.stats()["process"]["retried"] == 2
+
+    def test_checkpoint_for_other_catalog(self, tmp_path):
+        """Test that a checkpoint written for other track data, or no checkpoint, starts from the beginning."""
+        checkpoint_path = str(tmp_path / "checkpoint.json")
+        assert load_checkpoint(checkpoint_path, "abc") == 0
+
+        save_checkpoint(checkpoint_path, "abc", 150)
+        assert load_checkpoint(checkpoint_path, "abc") == 150
+        assert load_checkpoint(checkpoint_path, "def") == 0
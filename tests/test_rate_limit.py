@@ -0,0 +1,93 @@
+import time
+import pytest
+from unittest.mock import MagicMock
+from spotipy import SpotifyException
+from rate_limit import RateLimiter
+
+
+class TestRateLimiter:
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        """Path of a new database for the rate limiter."""
+        return str(tmp_path / "moodtunes.db")
+
+    @staticmethod
+    def too_many_requests(retry_after: str | None = "0") -> SpotifyException:
+        """Create the exception raised when Spotify responds with Too Many Requests."""
+        headers = {"Retry-After": retry_after} if retry_after is not None else {}
+        return SpotifyException(429, -1, "Too many requests", headers=headers)
+
+    def test_acquire(self, db_path):
+        """Test that calls beyond the capacity wait for the bucket to refill."""
+        limiter = RateLimiter(db_path, rate=20, capacity=2, reserve=0)
+        assert limiter.acquire(timeout=0)
+        assert limiter.acquire(timeout=0)
+        assert not limiter.acquire(timeout=0)
+
+        start = time.monotonic()
+        assert limiter.acquire(timeout=1)
+        assert time.monotonic() - start >= 0.03
+        assert limiter.stats()["process"]["calls"] == 3
+        assert limiter.stats()["process"]["waits"] == 1
+
+    def test_shared_budget(self, db_path):
+        """Test that rate limiters using the same database share one bucket."""
+        RateLimiter(db_path, rate=0.01, capacity=2, reserve=0).acquire()
+
+        limiter = RateLimiter(db_path, rate=0.01, capacity=2, reserve=0)
+        assert limiter.acquire(timeout=0)
+        assert not limiter.acquire(timeout=0)
+
+        # The bucket is shared, while the counters are kept per process
+        assert limiter.stats()["bucket"]["tokens"] == pytest.approx(0, abs=0.01)
+        assert limiter.stats()["process"]["calls"] == 1
+
+    def test_background_reserve(self, db_path):
+        """Test that background calls leave the reserve for interactive calls."""
+        limiter = RateLimiter(db_path, rate=0.01, capacity=3, reserve=2)
+        assert limiter.acquire(RateLimiter.background, timeout=0)
+        assert not limiter.acquire(RateLimiter.background, timeout=0)
+        assert limiter.acquire(RateLimiter.interactive, timeout=0)
+        assert limiter.acquire(RateLimiter.interactive, timeout=0)
+        assert not limiter.acquire(RateLimiter.interactive, timeout=0)
+
+    def test_call_retries_after_too_many_requests(self, db_path):
+        """Test that a throttled call is retried once the Retry-After time has passed."""
+        limiter = RateLimiter(db_path)
+        method = MagicMock(side_effect=[self.too_many_requests("0.05"), "result"])
+
+        start = time.monotonic()
+        assert limiter.call(RateLimiter.interactive, method, "a", b=1) == "result"
+        assert time.monotonic() - start >= 0.05
+        assert method.call_count == 2
+        method.assert_called_with("a", b=1)
+        assert limiter.stats()["process"] == {"calls": 2, "waits": 1, "throttled": 1, "retried": 1, "rejected": 0}
+
+    def test_call_gives_up_after_retries(self, db_path):
+        """Test that a call still throttled after the most retries raises the exception, and other errors are not
+        retried."""
+        limiter = RateLimiter(db_path)
+        limiter.default_retry_after = 0
+        method = MagicMock(side_effect=self.too_many_requests(None))
+        with pytest.raises(SpotifyException):
+            limiter.call(RateLimiter.interactive, method)
+        assert method.call_count == limiter.max_retries + 1
+        assert limiter.throttled == limiter.max_retries + 1
+        assert limiter.retried == limiter.max_retries
+
+        method = MagicMock(side_effect=SpotifyException(404, -1, "Not found"))
+        with pytest.raises(SpotifyException):
+            limiter.call(RateLimiter.interactive, method)
+        assert method.call_count == 1
+
+    def test_call_rejected_while_paused(self, db_path):
+        """Test that calls are not made while Spotify has asked all workers to wait longer than the timeout."""
+        RateLimiter(db_path).pause(60)
+
+        limiter = RateLimiter(db_path)
+        method = MagicMock()
+        with pytest.raises(SpotifyException) as e:
+            limiter.call(RateLimiter.background, method)
+        assert e.value.http_status == 429
+        method.assert_not_called()
+        assert limiter.rejected == 1
@@ -6,6 +6,7 @@ import os
 import numpy as np
 import pandas as pd
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, patch
 from sklearn.preprocessing import StandardScaler
 
@@ -14,9 +15,9 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 
 @pytest.fixture
-def mock_track_data():
-    """Create a mock TrackData object with test data."""
-    track_data = MagicMock(spec=TrackData)
+def track_data():
+    """Create a TrackData object with test data."""
+    track_data = TrackData()
 
     # Create a sample dataframe with the required columns
     df = pd.DataFrame([
@@ -69,14 +70,36 @@ def mock_track_data():
     feature_df = pd.DataFrame(df[taste_features], columns=taste_features)
     scaler.fit(feature_df)
 
-    # Set up the mock TrackData attributes
+    # Set up the TrackData attributes and build its indexes
     track_data.df = df
     track_data.scaler = scaler
     track_data.taste_features = taste_features
+    track_data.build_indexes()
 
     return track_data
 
 
+@pytest.fixture
+def large_track_data():
+    """Create a TrackData object with 5000 random tracks, with rounded values so that ties are common."""
+    rng = np.random.default_rng(0)
+    num_tracks = 5000
+    track_data = TrackData()
+    track_data.df = pd.DataFrame({
+        "track_id": [str(i) for i in range(num_tracks)],
+        "track_name": [f"Song {i}" for i in range(num_tracks)],
+        "artist": [f"Artist{i}" for i in rng.integers(0, 300, num_tracks)],
+        "genre": rng.choice(["Pop", "Rock", "Jazz"], num_tracks),
+        "valence": rng.uniform(0, 1, num_tracks).round(2).astype(np.float32),
+        "energy": rng.uniform(0, 1, num_tracks).round(2).astype(np.float32),
+        "popularity": rng.normal(0, 1, num_tracks).round(1).astype(np.float32),
+        "instrumentalness": rng.normal(0, 1, num_tracks).round(1).astype(np.float32),
+    })
+    track_data.scaler = StandardScaler().fit(rng.normal(0, 1, (10, 2)))
+    track_data.build_indexes()
+    return track_data
+
+
 @pytest.fixture
 def mock_spotify_service():
     """Create a mock SpotifyService."""
@@ -106,19 +129,20 @@ def mock_spotify_service():
 
 
 @pytest.fixture
-def engine(mock_track_data, mock_spotify_service):
-    """Create a RecommendationEngine with mock dependencies."""
-    return RecommendationEngine(mock_track_data, mock_spotify_service)
+def engine(track_data, mock_spotify_service):
+    """Create a RecommendationEngine with test track data and a mock Spotify service."""
+    return RecommendationEngine(track_data, mock_spotify_service)
 
 
 class TestRecommendationEngine:
 
-    def test_init(self, engine, mock_track_data, mock_spotify_service):
+    def test_init(self, engine, track_data, mock_spotify_service):
         """Test that the engine initializes correctly with the provided dependencies."""
-        assert engine.df is mock_track_data.df
+        assert engine.track_data is track_data
+        assert engine.df is track_data.df
         assert engine.spotify_service is mock_spotify_service
-        assert engine.scaler is mock_track_data.scaler
-        assert engine.taste_features is mock_track_data.taste_features
+        assert engine.scaler is track_data.scaler
+        assert engine.taste_features is track_data.taste_features
         assert engine.artist_boost_factor == 1.2
         assert engine.weights == {"mood": 0.5, "non_mood": 0.5}
 
@@ -140,9 +164,24 @@ class TestRecommendationEngine:
         assert 0.0 <= mood["target_valence"] <= 1.0
         assert 0.0 <= mood["target_energy"] <= 1.0
 
+    def test_taste_similarity(self, engine, track_data):
+        """Test that the taste similarity matches the cosine similarity of the scaled vectors."""
+        from sklearn.metrics.pairwise import cosine_similarity
+
+        user_vector_scaled = np.array([0.7, -1.2])
+        track_vectors = track_data.df[track_data.taste_features].to_numpy(dtype=np.float64)
+        expected = cosine_similarity(track_vectors, [user_vector_scaled]).ravel()
+
+        np.testing.assert_allclose(engine._taste_similarity(None, user_vector_scaled), expected, rtol=1e-5)
+        np.testing.assert_allclose(engine._taste_similarity(np.array([1, 3]), user_vector_scaled),
+                                   expected[[1, 3]], rtol=1e-5)
+
+    def test_taste_similarity_zero_vector(self, engine):
+        """Test that a zero user vector is equally similar to every track."""
+        np.testing.assert_array_equal(engine._taste_similarity(None, np.zeros(2)), np.zeros(4))
+
     def test_apply_artist_boost_with_preferred_artists(self, engine):
         """Test the _apply_artist_boost method with preferred artists."""
-        df = engine.df
         # Use original values that will show a clear difference when boosted
         similarity_scores = np.array([0.5, 0.6, 0.7, 0.8])
         preferred_artists = ["Artist1"]
@@ -153,7 +192,7 @@ class TestRecommendationEngine:
         # Mock the random function to return a predictable boost value
         with patch('numpy.random.uniform', return_value=np.array([1.2, 1.2])):
             # Apply the artist boost
-            boosted_scores = engine._apply_artist_boost(df, similarity_scores, preferred_artists)
+            boosted_scores = engine._apply_artist_boost(None, similarity_scores, preferred_artists)
 
             # Check that scores for Artist1 (index 0 and 3) are boosted
             # Artist1 appears at indices 0 and 3 in our test data
@@ -164,44 +203,54 @@ class TestRecommendationEngine:
             assert boosted_scores[1] == original_scores[1], "Score for non-preferred artist should be unchanged"
             assert boosted_scores[2] == original_scores[2], "Score for non-preferred artist should be unchanged"
 
+    def test_apply_artist_boost_with_positions(self, engine):
+        """Test that the artist boost only applies to matching tracks among the candidates."""
+        # Candidates are rows 1, 2 and 3; Artist1 only appears at row 3 among them
+        positions = np.array([1, 2, 3], dtype=np.int32)
+        similarity_scores = np.array([0.6, 0.7, 0.8])
+
+        with patch('numpy.random.uniform', return_value=np.array([1.2])) as mock_uniform:
+            boosted_scores = engine._apply_artist_boost(positions, similarity_scores, ["Artist1", "Unknown"])
+
+            # Only one random boost is drawn, for the single matching track
+            assert mock_uniform.call_args[0][2] == 1
+            np.testing.assert_allclose(boosted_scores, [0.6, 0.7, 0.96])
+
     def test_apply_artist_boost_with_no_preferred_artists(self, engine):
         """Test the _apply_artist_boost method with no preferred artists."""
-        df = engine.df
         similarity_scores = np.array([0.5, 0.6, 0.7, 0.8])
         preferred_artists = []
 
-        boosted_scores = engine._apply_artist_boost(df, similarity_scores, preferred_artists)
+        boosted_scores = engine._apply_artist_boost(None, similarity_scores, preferred_artists)
 
         # Check that all scores are unchanged
         np.testing.assert_array_equal(boosted_scores, similarity_scores)
 
     def test_recommend_songs_basic(self, engine):
         """Test the basic functionality of the _recommend_songs method."""
-        df = engine.df.copy()
         similarity_scores = np.array([0.5, 0.6, 0.7, 0.8])
         start_valence = 0.3
         start_energy = 0.3
         target_mood = {"target_valence": 0.8, "target_energy": 0.7}
         top_n = 2
 
-        # Get recommendations
+        # Get recommendations (positions of None means all tracks)
         recommendations = engine._recommend_songs(
-            df, similarity_scores, start_valence, start_energy, target_mood, None, top_n
+            None, similarity_scores, start_valence, start_energy, target_mood, None, top_n
         )
 
         # Check that we got the expected number of recommendations
         assert len(recommendations) == top_n
 
-        # Check that the recommendations have the expected columns
-        assert "track_name" in recommendations.columns
-        assert "artist" in recommendations.columns
-        assert "track_id" in recommendations.columns
-        assert "valence" in recommendations.columns
-        assert "energy" in recommendations.columns
+        # Check that the recommendations have the expected fields
+        assert "track_name" in recommendations[0]
+        assert "artist" in recommendations[0]
+        assert "track_id" in recommendations[0]
+        assert "valence" in recommendations[0]
+        assert "energy" in recommendations[0]
 
     def test_recommend_songs_with_excluded_ids(self, engine):
         """Test the _recommend_songs method with excluded track IDs."""
-        df = engine.df
         similarity_scores = np.array([0.5, 0.6, 0.7, 0.8])
         start_valence = 0.3
         start_energy = 0.3
@@ -211,14 +260,14 @@ class TestRecommendationEngine:
 
         # Get recommendations
         recommendations = engine._recommend_songs(
-            df, similarity_scores, start_valence, start_energy, target_mood, recommended_ids, top_n
+            None, similarity_scores, start_valence, start_energy, target_mood, recommended_ids, top_n
         )
 
         # Check that we got recommendations
         assert len(recommendations) > 0
 
         # Check that the excluded tracks are not in the recommendations
-        assert all(track_id not in recommended_ids for track_id in recommendations["track_id"])
+        assert all(track_id not in recommended_ids for track_id in [track["track_id"] for track in recommendations])
 
     def test_get_recommendations(self, engine, mock_spotify_service):
         """Test the main get_recommendations method."""
@@ -248,8 +297,9 @@ class TestRecommendationEngine:
         assert "uri" in recommendations[0]
         assert "album_image_url" in recommendations[0]
 
-        # Verify that the Spotify service was called
-        mock_spotify_service.get_tracks.assert_called_once()
+        # Album images are loaded after the page renders, so the Spotify service is not called
+        assert recommendations[0]["album_image_url"] == engine.placeholder_image_url
+        mock_spotify_service.get_tracks.assert_not_called()
 
     def test_get_recommendations_with_genre_filter(self, engine):
         """Test get_recommendations with a genre filter that matches tracks."""
@@ -265,11 +315,10 @@ class TestRecommendationEngine:
 
         # Patch the _recommend_songs method to avoid the type error
         with patch.object(engine, '_recommend_songs') as mock_recommend_songs:
-            # Set up the mock to return a DataFrame with expected columns
-            mock_df = pd.DataFrame([
+            # Set up the mock to return a recommendation with the expected fields
+            mock_recommend_songs.return_value = [
                 {"track_name": "Test Pop Song", "artist": "Artist1", "track_id": "1", "valence": 0.5, "energy": 0.6}
-            ])
-            mock_recommend_songs.return_value = mock_df
+            ]
 
             # Get recommendations
             recommendations = engine.get_recommendations(valence, energy, goal, preferences)
@@ -278,11 +327,12 @@ class TestRecommendationEngine:
             assert isinstance(recommendations, list)
             assert len(recommendations) > 0
 
-            # Verify that filtered_df contains only Pop genre
+            # Verify that the candidate tracks are only Pop genre
             # We can check this by examining the arguments passed to _recommend_songs
             args, _ = mock_recommend_songs.call_args
-            filtered_df = args[0]  # First argument to _recommend_songs
-            assert all(genre == "Pop" for genre in filtered_df["genre"])
+            positions = args[0]  # First argument to _recommend_songs
+            assert positions.tolist() == [0, 3]
+            assert all(genre == "Pop" for genre in engine.df["genre"].iloc[positions])
 
     def test_get_recommendations_with_no_matching_genre(self, engine):
         """Test get_recommendations with a genre filter that doesn't match any tracks."""
@@ -323,8 +373,8 @@ class TestRecommendationEngine:
 
     def test_recommend_songs_default_parameters(self, engine):
         """Test the _recommend_songs method with default parameters."""
-        # Create a test dataframe
-        df = engine.df.copy()
+        # Use all tracks as candidates
+        positions = None
 
         # Create similarity scores
         similarity_scores = np.array([0.3, 0.8, 0.5, 0.7])
@@ -333,22 +383,22 @@ class TestRecommendationEngine:
         start_valence = 0.3
         start_energy = 0.3
         target_mood = {"target_valence": 0.8, "target_energy": 0.7}
-        result = engine._recommend_songs(df, similarity_scores, start_valence,
+        result = engine._recommend_songs(positions, similarity_scores, start_valence,
                                          start_energy, target_mood, recommended_ids=None)
 
         # Check the result
-        assert isinstance(result, pd.DataFrame)
+        assert isinstance(result, list)
         assert len(result) <= 10  # Should return at most 10 recommendations
-        assert "track_name" in result.columns
-        assert "artist" in result.columns
-        assert "track_id" in result.columns
-        assert "valence" in result.columns
-        assert "energy" in result.columns
+        assert "track_name" in result[0]
+        assert "artist" in result[0]
+        assert "track_id" in result[0]
+        assert "valence" in result[0]
+        assert "energy" in result[0]
 
     def test_recommend_songs_limited_tracks(self, engine):
         """Test _recommend_songs when it runs out of valid tracks."""
-        # Create a very small test dataframe
-        small_df = engine.df.iloc[0:2].copy()  # Only 2 tracks
+        # Use a very small set of candidate tracks
+        positions = np.array([0, 1])  # Only 2 tracks
 
         # Create similarity scores
         similarity_scores = np.array([0.3, 0.8])
@@ -359,17 +409,17 @@ class TestRecommendationEngine:
         target_mood = {"target_valence": 0.8, "target_energy": 0.7}
         top_n = 5  # Request 5 tracks when only 2 are available
 
-        result = engine._recommend_songs(small_df, similarity_scores, start_valence,
+        result = engine._recommend_songs(positions, similarity_scores, start_valence,
                                          start_energy, target_mood, recommended_ids=None, top_n=top_n)
 
         # Check the result
-        assert isinstance(result, pd.DataFrame)
+        assert isinstance(result, list)
         assert len(result) == 2  # Should only return the 2 available tracks
 
     def test_recommend_songs_weight_configuration(self, engine):
         """Test that the weights in _recommend_songs affect the recommendations."""
-        # Create a test dataframe
-        df = engine.df.copy()
+        # Use all tracks as candidates
+        positions = None
 
         # Create biased similarity scores
         similarity_scores = np.array([0.9, 0.1, 0.2, 0.3])  # Track 1 has highest similarity
@@ -386,11 +436,11 @@ class TestRecommendationEngine:
             # Test with high weight on non-mood features (similarity)
             engine.weights = {"mood": 0.1, "non_mood": 0.9}
             result_similarity = engine._recommend_songs(
-                df, similarity_scores, start_valence, start_energy, target_mood, recommended_ids=None, top_n=1)
+                positions, similarity_scores, start_valence, start_energy, target_mood, recommended_ids=None, top_n=1)
 
             # Test with high weight on mood features
             engine.weights = {"mood": 0.9, "non_mood": 0.1}
-            result_mood = engine._recommend_songs(df, similarity_scores, start_valence,
+            result_mood = engine._recommend_songs(positions, similarity_scores, start_valence,
                                                   start_energy, target_mood, recommended_ids=None, top_n=1)
 
             # The recommendations should be different when weights are drastically changed
@@ -405,8 +455,8 @@ class TestRecommendationEngine:
 
     def test_recommend_songs_custom_top_n(self, engine):
         """Test the _recommend_songs method with a custom top_n value."""
-        # Create a test dataframe
-        df = engine.df.copy()
+        # Use all tracks as candidates
+        positions = None
 
         # Create similarity scores
         similarity_scores = np.array([0.3, 0.8, 0.5, 0.7])
@@ -416,17 +466,17 @@ class TestRecommendationEngine:
         start_energy = 0.3
         target_mood = {"target_valence": 0.8, "target_energy": 0.7}
         top_n = 2  # Only request 2 recommendations
-        result = engine._recommend_songs(df, similarity_scores, start_valence,
+        result = engine._recommend_songs(positions, similarity_scores, start_valence,
                                          start_energy, target_mood, recommended_ids=None, top_n=top_n)
 
         # Check the result
-        assert isinstance(result, pd.DataFrame)
+        assert isinstance(result, list)
         assert len(result) <= top_n  # Should return at most top_n recommendations
 
     def test_recommend_songs_mood_progression(self, engine):
         """Test that _recommend_songs correctly implements mood progression."""
-        # Create a test dataframe
-        df = engine.df.copy()
+        # Use all tracks as candidates
+        positions = None
 
         # Create similarity scores (all equal to isolate mood effects)
         similarity_scores = np.array([0.5, 0.5, 0.5, 0.5])
@@ -437,7 +487,7 @@ class TestRecommendationEngine:
         target_mood = {"target_valence": 0.8, "target_energy": 0.8}
         top_n = 4  # Request all tracks
 
-        result = engine._recommend_songs(df, similarity_scores, start_valence,
+        result = engine._recommend_songs(positions, similarity_scores, start_valence,
                                          start_energy, target_mood, recommended_ids=None, top_n=top_n)
 
         # Check the result has expected number of tracks
@@ -449,9 +499,435 @@ class TestRecommendationEngine:
         # But the actual selection depends on available tracks and combined scores
 
         # At minimum, the last track should be closer to the target mood than the first track
-        first_track_distance = np.sqrt((result.iloc[0]['valence'] - target_mood['target_valence'])**2 +
-                                       (result.iloc[0]['energy'] - target_mood['target_energy'])**2)
-        last_track_distance = np.sqrt((result.iloc[-1]['valence'] - target_mood['target_valence'])**2 +
-                                      (result.iloc[-1]['energy'] - target_mood['target_energy'])**2)
+        first_track_distance = np.sqrt((result[0]['valence'] - target_mood['target_valence'])**2 +
+                                       (result[0]['energy'] - target_mood['target_energy'])**2)
+        last_track_distance = np.sqrt((result[-1]['valence'] - target_mood['target_valence'])**2 +
+                                      (result[-1]['energy'] - target_mood['target_energy'])**2)
 
         assert last_track_distance <= first_track_distance
+
+    def test_rank_step_pools_matches_full_ranking(self, engine):
+        """Test that the blocked top-k ranking matches a full sort of each step's combined scores."""
+        rng = np.random.default_rng(0)
+        valence = rng.uniform(0, 1, 200).round(1).astype(np.float32)
+        energy = rng.uniform(0, 1, 200).round(1).astype(np.float32)
+        similarity_scores = rng.uniform(-1, 1, 200).round(1)  # Rounded so that ties are common
+        step_targets = np.array([[0.2, 0.3], [0.5, 0.5], [0.9, 0.1]])
+
+        # Use small blocks, so that the pools are merged across many blocks
+        engine.selection_block_size = 7
+        pools, _ = engine._rank_step_pools(valence, energy, similarity_scores, step_targets, depth=5)
+
+        for pool, (step_valence, step_energy) in zip(pools, step_targets):
+            distances = np.linalg.norm(np.column_stack([valence, energy]) - [step_valence, step_energy], axis=1)
+            scores = np.clip(1 - distances / np.sqrt(2), 0, 1) * 0.5 + similarity_scores * 0.5
+            expected = np.lexsort((np.arange(len(scores)), -scores))[:5]
+            np.testing.assert_array_equal(pool, expected)
+
+    @pytest.mark.parametrize("workers", [2, 3])
+    def test_sharded_scoring_matches_single_thread(self, large_track_data, mock_spotify_service, workers):
+        """Test that scoring in shards on several threads gives the same scores and rankings."""
+        engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        engine.mood_search_min_tracks = np.inf
+        engine.selection_block_size = 500
+        sharded_engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        sharded_engine.mood_search_min_tracks = np.inf
+        sharded_engine.scoring_workers = workers
+        sharded_engine.scoring_shard_min_tracks = 0
+        sharded_engine.selection_block_size = 500
+        preferences = {"genres": [], "artists": [], "popularity": 0.7, "instrumentalness": 0.1}
+        user_vector = engine._scale_taste_vector(preferences)
+
+        for positions in (None, large_track_data.get_genre_positions(["Pop", "Jazz"])):
+            similarity_scores = engine._taste_similarity(positions, user_vector)
+            np.testing.assert_array_equal(sharded_engine._taste_similarity(positions, user_vector), similarity_scores)
+
+            target_mood = engine._get_target_mood("fire_me_up", 0.3, 0.4)
+            expected = engine._recommend_songs(positions, similarity_scores, 0.3, 0.4, target_mood, top_n=10)
+            result = sharded_engine._recommend_songs(positions, similarity_scores, 0.3, 0.4, target_mood, top_n=10)
+            assert result == expected
+
+        assert sharded_engine._scoring_pool_workers == workers
+
+    @pytest.mark.parametrize("workers", [2, 3])
+    def test_sharded_mood_index_search_matches_single_thread(self, large_track_data, mock_spotify_service, workers):
+        """Test that searching the mood index with its passes over all candidates in shards gives the same rankings."""
+        rng = np.random.default_rng(5)
+        engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        engine.mood_search_min_tracks = 0
+        engine.mood_search_seed_size = 50
+        sharded_engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        sharded_engine.mood_search_min_tracks = 0
+        sharded_engine.mood_search_seed_size = 50
+        sharded_engine.scoring_workers = workers
+        sharded_engine.scoring_shard_min_tracks = 0
+        sharded_engine.selection_block_size = 500
+
+        map_shards = sharded_engine._map_shards
+        shard_counts = {}
+
+        def count_shards(function, count):
+            results = map_shards(function, count)
+            shard_counts[function.__name__] = len(results)
+            return results
+
+        with patch.object(sharded_engine, "_map_shards", side_effect=count_shards):
+            for positions in (None, large_track_data.get_genre_positions(["Pop", "Jazz"])):
+                # Few distinct similarity scores, so that many tracks tie with the seed threshold
+                num_tracks = 5000 if positions is None else len(positions)
+                similarity_scores = rng.choice([-0.5, 0.2, 0.9, 1.0], num_tracks).astype(np.float32)
+                target_mood = engine._get_target_mood("fire_me_up", 0.3, 0.4)
+                expected = engine._recommend_songs(positions, similarity_scores, 0.3, 0.4, target_mood, top_n=10)
+                result = sharded_engine._recommend_songs(positions, similarity_scores, 0.3, 0.4, target_mood,
+                                                         top_n=10)
+                assert result == expected
+
+        # Weighting, the seed threshold and the cold tier bound are each found in shards
+        assert [shard_counts[name] for name in ("weigh_shard", "threshold_shard", "cold_shard")] == [workers] * 3
+
+    def test_scratch_buffers_are_reused_per_thread(self, engine):
+        """Test that scratch arrays reuse one buffer per name and type on each thread."""
+        first = engine._scratch('scores', (3, 100), np.float64)
+        second = engine._scratch('scores', (2, 50), np.float64)
+        assert second.shape == (2, 50)
+        assert np.shares_memory(first, second)
+        assert not np.shares_memory(first, engine._scratch('scores', 300, np.float32))
+        assert not np.shares_memory(first, engine._scratch('other', 300, np.float64))
+
+        # Growing a buffer replaces it
+        assert not np.shares_memory(first, engine._scratch('scores', 301, np.float64))
+
+        # Other threads get their own buffers
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            other = pool.submit(engine._scratch, 'scores', 301, np.float64).result()
+        assert not np.shares_memory(other, engine._scratch('scores', 301, np.float64))
+
+        engine.scratch_buffers = False
+        first = engine._scratch('scores', 10, np.float64)
+        assert not np.shares_memory(first, engine._scratch('scores', 10, np.float64))
+
+    @pytest.mark.parametrize("min_tracks", [0, np.inf])
+    def test_scratch_buffers_match_allocated_arrays(self, large_track_data, mock_spotify_service, min_tracks):
+        """Test that scoring with reused scratch arrays gives the same recommendations as fresh arrays."""
+        engines = [RecommendationEngine(large_track_data, mock_spotify_service) for _ in range(2)]
+        for engine in engines:
+            engine.mood_search_min_tracks = min_tracks
+            engine.mood_search_seed_size = 50
+            engine.result_cache.max_entries = 0
+        engines[1].scratch_buffers = False
+
+        requests = [
+            (0.2, 0.9, "chill_me_out", {"genres": ["Pop"], "artists": ["Artist1", "Artist7"], "popularity": 0.3,
+                                        "instrumentalness": 0.4}, ["10", "20"]),
+            (0.7, 0.3, "lift_me_up", {"genres": [], "artists": [], "popularity": 0.9, "instrumentalness": 0.1}, None),
+            (0.5, 0.5, "keep_me_here", {"genres": ["Rock", "Jazz"], "artists": ["Artist2"], "popularity": 0.5,
+                                        "instrumentalness": 0.5}, None),
+        ]
+        for request in requests * 2:
+            results = []
+            for engine in engines:
+                np.random.seed(0)
+                results.append(engine.get_recommendations(*request))
+            assert results[0] == results[1]
+
+    def test_tiered_scoring_matches_full_scoring(self, large_track_data, mock_spotify_service):
+        """Test that scoring the hot tier first selects the same tracks as scoring every candidate."""
+        engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        engine.mood_search_min_tracks = np.inf
+        engine.tiered_scoring = False
+        tiered_engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        tiered_engine.mood_search_min_tracks = np.inf
+
+        with patch.object(tiered_engine, "_rank_step_pools", wraps=tiered_engine._rank_step_pools) as rank:
+            for popularity, instrumentalness in [(0.9, 0.1), (0.5, -0.5), (-0.8, 0.3), (0.0, 0.0)]:
+                preferences = {"genres": [], "artists": [], "popularity": popularity,
+                               "instrumentalness": instrumentalness}
+                user_vector = engine._scale_taste_vector(preferences)
+                for genres in (None, ["Pop", "Jazz"]):
+                    positions = None if genres is None else large_track_data.get_genre_positions(genres)
+                    similarity_scores = engine._taste_similarity(positions, user_vector)
+                    for recommended_ids in (None, [str(i) for i in range(0, 5000, 7)]):
+                        expected = engine._recommend_songs(positions, similarity_scores, 0.4, 0.6,
+                                                           {"target_valence": 0.8, "target_energy": 0.65},
+                                                           recommended_ids, genres=genres)
+                        result = tiered_engine._recommend_songs(positions, similarity_scores, 0.4, 0.6,
+                                                                {"target_valence": 0.8, "target_energy": 0.65},
+                                                                recommended_ids, genres=genres)
+                        assert result == expected
+
+        # The cold tier was skipped for some of the 16 requests, and scored for others
+        assert 16 < rank.call_count < 32
+
+    def test_recommend_songs_breaks_ties_by_position(self, engine):
+        """Test that tracks with equal scores are selected in row order."""
+        engine.df["valence"] = 0.5
+        engine.df["energy"] = 0.5
+        similarity_scores = np.array([0.5, 0.5, 0.5, 0.5])
+
+        result = engine._recommend_songs(None, similarity_scores, 0.5, 0.5,
+                                         {"target_valence": 0.5, "target_energy": 0.5}, top_n=4)
+
+        assert [track["track_id"] for track in result] == ["1", "2", "3", "4"]
+
+    def test_recommend_songs_with_mood_index(self, large_track_data, mock_spotify_service):
+        """Test that ranking through the mood index selects the same tracks as scoring every candidate."""
+        rng = np.random.default_rng(1)
+        engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        indexed_engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        indexed_engine.mood_search_min_tracks = 0
+        indexed_engine.mood_search_seed_size = 50
+
+        for genres in (None, ["Pop"], ["Rock", "Jazz"]):
+            positions = None if genres is None else large_track_data.get_genre_positions(genres)
+            num_tracks = 5000 if positions is None else len(positions)
+            for goal in ("lift_me_up", "chill_me_out", "keep_me_here"):
+                # Few distinct similarity scores, so that many tracks tie
+                similarity_scores = rng.choice([-0.5, 0.2, 0.9, 1.0], num_tracks).astype(np.float32)
+                valence, energy = rng.uniform(0, 1, 2).round(2)
+                target_mood = engine._get_target_mood(goal, valence, energy)
+                recommended_ids = [str(i) for i in range(0, 5000, 3)]
+                for ids in (None, recommended_ids):
+                    expected = engine._recommend_songs(positions, similarity_scores.copy(), valence, energy,
+                                                       target_mood, ids, top_n=10)
+                    result = indexed_engine._recommend_songs(positions, similarity_scores.copy(), valence, energy,
+                                                             target_mood, ids, top_n=10, genres=genres)
+                    assert result == expected
+                    assert len(result) == 10
+
+    def test_mood_index_tiered_scoring(self, large_track_data, mock_spotify_service):
+        """Test that the mood index search skips cold tracks it can rule out and selects the same tracks."""
+        engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        engine.mood_search_min_tracks = 0
+        engine.mood_search_seed_size = 50
+        engine.tiered_scoring = False
+        tiered_engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        tiered_engine.mood_search_min_tracks = 0
+        tiered_engine.mood_search_seed_size = 50
+
+        scored = {}
+        for name, current in (("full", engine), ("tiered", tiered_engine)):
+            with patch.object(current, "_score_rows", wraps=current._score_rows) as score_rows:
+                results = []
+                for popularity, instrumentalness in [(0.9, 0.1), (0.5, -0.5), (-0.8, 0.3)]:
+                    preferences = {"genres": [], "artists": [], "popularity": popularity,
+                                   "instrumentalness": instrumentalness}
+                    similarity_scores = current._taste_similarity(None, current._scale_taste_vector(preferences))
+                    for recommended_ids in (None, [str(i) for i in range(0, 5000, 7)]):
+                        results.append(current._recommend_songs(None, similarity_scores, 0.4, 0.6,
+                                                                {"target_valence": 0.8, "target_energy": 0.65},
+                                                                recommended_ids))
+            scored[name] = sum(len(call.args[1]) for call in score_rows.call_args_list)
+            if name == "full":
+                expected = results
+
+        assert results == expected
+        assert scored["tiered"] < scored["full"]
+
+    def test_recommend_songs_with_goal_shortlists(self, large_track_data, mock_spotify_service):
+        """Test that goal shortlists close the steps near a goal mood and select the same tracks."""
+        rng = np.random.default_rng(3)
+        engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        engine.mood_search_min_tracks = np.inf
+        engine.tiered_scoring = False
+        indexed_engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        indexed_engine.mood_search_min_tracks = 0
+        indexed_engine.mood_search_seed_size = 50
+        assert large_track_data.goal_moods.tolist() == [[0.8, 0.65], [0.7, 0.3], [0.8, 0.8], [0.8, 0.6]]
+
+        with patch.object(large_track_data, "get_mood_cells", wraps=large_track_data.get_mood_cells) as get_mood_cells:
+            for goal in engine.fixed_mood_goals:
+                for genres in (None, ["Pop"], ["Rock", "Jazz"]):
+                    positions = None if genres is None else large_track_data.get_genre_positions(genres)
+                    num_tracks = 5000 if positions is None else len(positions)
+                    similarity_scores = rng.choice([-0.5, 0.2, 0.9, 1.0], num_tracks).astype(np.float32)
+
+                    # Users already close to the goal mood
+                    target_mood = engine._get_target_mood(goal, 0, 0)
+                    valence = round(target_mood["target_valence"] + 0.02, 2)
+                    energy = round(target_mood["target_energy"] - 0.01, 2)
+                    expected = engine._recommend_songs(positions, similarity_scores, valence, energy, target_mood)
+                    result = indexed_engine._recommend_songs(positions, similarity_scores, valence, energy,
+                                                             target_mood, genres=genres)
+                    assert result == expected
+
+        # The shortlists ruled out every other track for at least some of the requests
+        assert get_mood_cells.call_count < 12
+
+    @pytest.mark.parametrize("depth", [8, 400])
+    def test_recommend_songs_with_mood_tables(self, large_track_data, mock_spotify_service, tmp_path, depth):
+        """Test that looking up tracks in the mood tables selects the same tracks as scoring every candidate."""
+        rng = np.random.default_rng(3)
+        engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        tabled_engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        tabled_engine.mood_search_min_tracks = 0
+        tabled_engine.mood_search_seed_size = 20
+
+        # Shallow tables rarely rule out the other tracks, so the mood index is searched as well
+        large_track_data.load_mood_tables(str(tmp_path / "mood_tables"), depth=depth)
+        for genres in (None, ["Pop"], ["Rock", "Jazz"]):
+            positions = None if genres is None else large_track_data.get_genre_positions(genres)
+            num_tracks = 5000 if positions is None else len(positions)
+            for goal in ("fire_me_up", "keep_me_here"):
+                # Similarity scores close to each other, as for users with similar tastes
+                similarity_scores = rng.choice([0.97, 0.98, 0.99, 1.0], num_tracks).astype(np.float32)
+                valence, energy = rng.integers(0, 101, 2) / 100
+                target_mood = engine._get_target_mood(goal, valence, energy)
+                expected = engine._recommend_songs(positions, similarity_scores.copy(), valence, energy,
+                                                   target_mood, ["7", "8"], top_n=10)
+                result = tabled_engine._recommend_songs(positions, similarity_scores.copy(), valence, energy,
+                                                        target_mood, ["7", "8"], top_n=10, genres=genres)
+                assert result == expected
+
+    def test_get_recommendations_uses_result_cache(self, engine):
+        """Test that identical requests reuse the cached ranking instead of scoring the tracks again."""
+        preferences = {"genres": ["Pop", "Rock"], "artists": [], "popularity": 0.6, "instrumentalness": 0.2}
+        first = engine.get_recommendations(0.3, 0.3, "lift_me_up", preferences)
+
+        # Genre order doesn't matter
+        with patch.object(engine, '_taste_similarity') as mock_similarity:
+            second = engine.get_recommendations(0.3, 0.3, "lift_me_up", dict(preferences, genres=["Rock", "Pop"]))
+            mock_similarity.assert_not_called()
+
+        assert second == first
+        assert engine.result_cache.stats()["hits"] == 1
+
+        # A different mood, or a new version of the dataset, is a different request
+        engine.get_recommendations(0.4, 0.3, "lift_me_up", preferences)
+        engine.track_data.checksum = "new"
+        engine.get_recommendations(0.3, 0.3, "lift_me_up", preferences)
+        stats = engine.result_cache.stats()
+        assert (stats["entries"], stats["hits"], stats["misses"], stats["evictions"]) == (3, 1, 3, 0)
+
+    def test_get_recommendations_uses_similarity_cache(self, engine):
+        """Test that users with the same taste share cached similarity scores, which boosts don't change."""
+        preferences = {"genres": ["Pop", "Rock"], "artists": ["Artist1"], "popularity": 0.6, "instrumentalness": 0.2}
+        engine.get_recommendations(0.3, 0.3, "lift_me_up", preferences)
+        (cached,) = [value for value, _, _ in engine.similarity_cache._entries.values()]
+        expected = cached.copy()
+
+        with patch.object(engine, '_taste_similarity') as mock_similarity:
+            # A different mood with the same taste and genres
+            engine.get_recommendations(0.5, 0.3, "lift_me_up", dict(preferences, genres=["Rock", "Pop"]))
+            mock_similarity.assert_not_called()
+
+        assert not cached.flags.writeable
+        np.testing.assert_array_equal(cached, expected)
+        assert engine.similarity_cache.stats()["hits"] == 1
+        assert engine.similarity_cache.stats()["bytes"] == cached.nbytes
+
+        # Other genres are different candidates
+        engine.get_recommendations(0.3, 0.3, "lift_me_up", dict(preferences, genres=["Pop"]))
+        assert engine.similarity_cache.stats()["entries"] == 2
+
+    @pytest.mark.parametrize("margin, hits", [(100, 2), (0, 0)])
+    def test_result_cache_excludes_recommended_tracks(self, large_track_data, mock_spotify_service, margin, hits):
+        """Test that cached rankings skip already recommended tracks, as filtering them out first does."""
+        engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        engine.result_cache_margin = margin
+        preferences = {"genres": ["Pop"], "artists": [], "popularity": 0.5, "instrumentalness": -0.5}
+        positions = large_track_data.get_genre_positions(["Pop"])
+        similarity_scores = engine._taste_similarity(positions, engine._scale_taste_vector(preferences))
+        target_mood = engine._get_target_mood("chill_me_out", 0.9, 0.8)
+
+        recommended_ids = []
+        for _ in range(3):
+            expected = engine._recommend_songs(positions, similarity_scores.copy(), 0.9, 0.8, target_mood,
+                                               recommended_ids, top_n=10)
+            result = engine.get_recommendations(0.9, 0.8, "chill_me_out", preferences, recommended_ids)
+            assert [track["track_id"] for track in result] == [track["track_id"] for track in expected]
+            recommended_ids = recommended_ids + [track["track_id"] for track in result]
+
+        # Later requests find the cached ranking. Without a margin, later requests have seen more tracks than the
+        # margin, so they mask those tracks out instead, without looking up or replacing the cached ranking.
+        assert engine.result_cache.stats()["hits"] == hits
+        assert engine.result_cache.stats()["entries"] == 1
+
+    @pytest.mark.parametrize("min_tracks", [0, np.inf])
+    def test_recommend_songs_with_excluded_positions(self, large_track_data, mock_spotify_service, min_tracks):
+        """Test that masking out recommended positions selects the same tracks as filtering out the candidates."""
+        engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        engine.mood_search_min_tracks = min_tracks
+        engine.mood_search_seed_size = 50
+        rng = np.random.default_rng(2)
+        positions = large_track_data.get_genre_positions(["Pop", "Rock"])
+        similarity_scores = rng.choice([-0.5, 0.2, 0.9, 1.0], len(positions)).astype(np.float32)
+        target_mood = engine._get_target_mood("lift_me_up", 0.2, 0.3)
+
+        recommended_positions = np.zeros(0, dtype=np.int64)
+        for _ in range(20):
+            mask = ~np.isin(positions, recommended_positions)
+            expected = engine._recommend_songs(positions[mask], similarity_scores[mask], 0.2, 0.3, target_mood,
+                                               top_n=10)
+            result = engine._recommend_songs(positions, similarity_scores, 0.2, 0.3, target_mood, top_n=10,
+                                             genres=["Pop", "Rock"], recommended_positions=recommended_positions)
+            assert result == expected
+            assert len(result) == 10
+            new_positions = large_track_data.get_track_positions([track["track_id"] for track in result])
+            recommended_positions = np.union1d(recommended_positions, new_positions)
+
+        # Recommended IDs and positions are combined
+        ids = [track["track_id"] for track in result]
+        rows = engine._excluded_rows(ids, recommended_positions[:5])
+        assert rows.tolist() == sorted(set(new_positions.tolist()) | set(recommended_positions[:5].tolist()))
+
+    def test_get_recommendations_with_recommended_positions(self, engine, track_data):
+        """Test that recommended tracks can be given by row position instead of ID."""
+        preferences = {"genres": [], "artists": [], "popularity": 0.5, "instrumentalness": 0.5}
+        by_ids = engine.get_recommendations(0.5, 0.5, "keep_me_here", preferences, ["1", "3"])
+        engine.result_cache.clear()
+        by_positions = engine.get_recommendations(0.5, 0.5, "keep_me_here", preferences,
+                                                  recommended_positions=track_data.get_track_positions(["1", "3"]))
+        assert by_positions == by_ids
+        assert {"1", "3"}.isdisjoint(track["track_id"] for track in by_positions)
+
+    def test_gather_tracks(self, engine):
+        """Test that output columns are gathered into one dictionary of plain values per track."""
+        tracks = engine._gather_tracks(np.array([3, 0]))
+
+        assert tracks == [
+            {"track_name": "Energetic Beat", "artist": "Artist1", "track_id": "4", "valence": 0.7, "energy": 0.9,
+             "position": 3},
+            {"track_name": "Sad Song", "artist": "Artist1", "track_id": "1", "valence": 0.2, "energy": 0.3,
+             "position": 0},
+        ]
+        assert all(type(value) in (str, float, int) for track in tracks for value in track.values())
+
+    def test_get_recommendations_batch(self, engine):
+        """Test that batch recommendations match separate get_recommendations calls."""
+        requests = [
+            (0.3, 0.3, "lift_me_up", {"genres": ["Pop", "Rock"], "artists": ["Artist1"],
+                                      "popularity": 0.6, "instrumentalness": 0.2}),
+            (0.8, 0.7, "chill_me_out", {"genres": [], "artists": [], "popularity": 0.8, "instrumentalness": 0.1}),
+            (0.5, 0.5, "fire_me_up", {"genres": ["Classical"], "artists": [], "popularity": 0.5,
+                                      "instrumentalness": 0.3}),
+            (0.2, 0.6, "keep_me_here", {"genres": ["Rock", "Pop"], "artists": ["Artist2"],
+                                        "popularity": 0.7, "instrumentalness": 0.4}, ["2"]),
+        ]
+
+        np.random.seed(1)
+        expected = [engine.get_recommendations(*request) for request in requests]
+        np.random.seed(1)
+        results = engine.get_recommendations_batch(requests)
+
+        assert results == expected
+        assert results[2] == []
+        assert "2" not in [track["track_id"] for track in results[3]]
+
+    def test_get_recommendations_batch_large_catalog(self, large_track_data, mock_spotify_service):
+        """Test batch recommendations against separate calls on a catalog spanning many blocks."""
+        rng = np.random.default_rng(0)
+        engine = RecommendationEngine(large_track_data, mock_spotify_service)
+        engine.selection_block_size = 512
+
+        requests = []
+        for i in range(30):
+            preferences = {"genres": [["Pop"], [], ["Rock", "Jazz"]][i % 3],
+                           "artists": [f"Artist{j}" for j in rng.integers(0, 300, i % 4)],
+                           "popularity": float(rng.uniform(-2, 2)), "instrumentalness": float(rng.uniform(-2, 2))}
+            request = (float(rng.uniform(0, 1)), float(rng.uniform(0, 1)), "lift_me_up", preferences)
+            requests.append(request + ([str(j) for j in range(0, 5000, 7)],) if i % 5 == 0 else request)
+
+        np.random.seed(2)
+        expected = [engine.get_recommendations(*request) for request in requests]
+        np.random.seed(2)
+        assert engine.get_recommendations_batch(requests) == expected
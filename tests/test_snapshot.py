@@ -0,0 +1,52 @@
+import pytest
+import numpy as np
+from snapshot import Snapshot
+
+
+class TestSnapshot:
+    def test_write_and_read(self, tmp_path):
+        path = str(tmp_path / "data.snapshot")
+        arrays = {
+            "floats": np.array([1.5, 2.5, 3.5]),
+            "ints": np.arange(12, dtype=np.int32).reshape(3, 4),
+            "bytes": np.frombuffer(b"hello", dtype=np.uint8),
+            "empty": np.zeros(0, dtype=np.int64),
+        }
+        Snapshot.write(path, arrays, {"version": 1, "name": "test"})
+
+        meta, loaded = Snapshot.read(path)
+        assert meta == {"version": 1, "name": "test"}
+        assert list(loaded) == list(arrays)
+        for name, array in arrays.items():
+            assert loaded[name].dtype == array.dtype
+            np.testing.assert_array_equal(loaded[name], array)
+
+    def test_arrays_are_aligned(self, tmp_path):
+        path = str(tmp_path / "data.snapshot")
+        Snapshot.write(path, {"a": np.ones(3, dtype=np.uint8), "b": np.ones(5, dtype=np.float64)}, {})
+
+        _, loaded = Snapshot.read(path)
+        # Both arrays start on an alignment boundary within the file, so their distance is a multiple of it
+        offset = loaded["b"].__array_interface__["data"][0] - loaded["a"].__array_interface__["data"][0]
+        assert offset > 0
+        assert offset % Snapshot.alignment == 0
+
+    def test_object_arrays_rejected(self, tmp_path):
+        path = tmp_path / "data.snapshot"
+        with pytest.raises(ValueError):
+            Snapshot.write(str(path), {"names": np.array(["a", None], dtype=object)}, {})
+        assert not path.exists()
+        assert list(tmp_path.iterdir()) == []
+
+    def test_read_invalid_file(self, tmp_path):
+        path = tmp_path / "data.snapshot"
+        path.write_bytes(b"garbage")
+        with pytest.raises(ValueError):
+            Snapshot.read(str(path))
+
+    def test_read_truncated_file(self, tmp_path):
+        path = tmp_path / "data.snapshot"
+        Snapshot.write(str(path), {"a": np.arange(100, dtype=np.int64)}, {})
+        path.write_bytes(path.read_bytes()[:-8])
+        with pytest.raises(ValueError):
+            Snapshot.read(str(path))
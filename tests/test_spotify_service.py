@@ -1,6 +1,9 @@
+import gc
 import pytest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 from spotipy import SpotifyException
+from artwork_store import ArtworkStore
+from rate_limit import RateLimiter
 from spotify_service import SpotifyService
 from exceptions import AuthenticationException, ApplicationException
 
@@ -182,8 +185,45 @@ class TestSpotifyService:
         with patch('spotify_service.Spotify') as mock_spotify:
             spotify_service.get_client()
 
-            # Verify Spotify was initialized with the correct token
-            mock_spotify.assert_called_with(auth="mock_access_token")
+            # Verify Spotify was initialized with the correct token and the shared HTTP session
+            mock_spotify.assert_called_with(auth="mock_access_token",
+                                            requests_session=spotify_service._http_session)
+
+    def test_get_client_reused(self, spotify_service, authenticated_session):
+        """Test that the client for an access token is reused, until the token is refreshed."""
+        with patch('spotify_service.Spotify', side_effect=lambda **kwargs: MagicMock()) as mock_spotify:
+            client = spotify_service.get_client()
+            assert spotify_service.get_client() is client
+            assert mock_spotify.call_count == 1
+
+            spotify_service.oauth.is_token_expired.return_value = True
+            spotify_service.oauth.refresh_access_token.return_value = {
+                "access_token": "new_access_token",
+                "refresh_token": "new_refresh_token",
+                "expires_at": 1720000000
+            }
+            new_client = spotify_service.get_client()
+            assert new_client is not client
+            assert spotify_service.clients.get("mock_access_token") is None
+            assert spotify_service.clients.get("new_access_token") is new_client
+
+            # Clients for all tokens share one HTTP session, which keeps no cookies from one user's calls for another
+            sessions = {call.kwargs["requests_session"] for call in mock_spotify.call_args_list}
+            assert len(sessions) == 1
+            assert sessions.pop().cookies.get_policy().allowed_domains() == ()
+
+    def test_evicted_client_keeps_shared_connections(self, spotify_service, authenticated_session):
+        """Test that a client leaving the cache does not close the connections shared with other clients."""
+        client = spotify_service.get_client()
+        pool_manager = spotify_service._http_session.get_adapter("https://api.spotify.com").poolmanager
+        pool_manager.connection_from_url("https://api.spotify.com")
+        assert len(pool_manager.pools) == 1
+
+        # Drop the only reference to the client, as when its token is refreshed or it is evicted
+        spotify_service.clients.remove("mock_access_token")
+        del client
+        gc.collect()
+        assert len(pool_manager.pools) == 1
 
     def test_get_user_id(self, spotify_service, authenticated_session, mock_spotify_client):
         """Test getting the user ID."""
@@ -206,6 +246,51 @@ class TestSpotifyService:
             assert tracks[1]["id"] == "track2"
             mock_spotify_client.tracks.assert_called_with(track_ids)
 
+    def test_get_album_images(self, spotify_service, authenticated_session, mock_spotify_client):
+        """Test getting the album images of tracks, skipping tracks that are not found or have no images."""
+        mock_spotify_client.tracks.return_value["tracks"] += [
+            None,
+            {"id": "track3", "name": "Track 3", "album": {"images": [{"url": "image3.jpg"}]}},
+            {"id": "track4", "name": "Track 4", "album": {"images": []}}
+        ]
+        with patch('spotify_service.Spotify', return_value=mock_spotify_client):
+            images = spotify_service.get_album_images(["track1", "track2", "missing", "track3", "track4"])
+
+            assert images == {"track1": "image1.jpg", "track2": "image2.jpg", "track3": "image3.jpg"}
+
+    def test_get_album_images_stored(self, spotify_service, authenticated_session, mock_spotify_client, tmp_path):
+        """Test that album images are fetched from Spotify only for tracks that are not in the artwork store."""
+        spotify_service.artwork_store = ArtworkStore(str(tmp_path / "moodtunes.db"))
+        spotify_service.artwork_store.put_many({"track1": "stored1.jpg", "track5": None})
+        tracks = mock_spotify_client.tracks.return_value["tracks"]
+        mock_spotify_client.tracks.return_value["tracks"] = tracks[1:] + [None]
+        with patch('spotify_service.Spotify', return_value=mock_spotify_client):
+            images = spotify_service.get_album_images(["track1", "track2", "track5", "missing"])
+
+            assert images == {"track1": "stored1.jpg", "track2": "image2.jpg"}
+            mock_spotify_client.tracks.assert_called_once_with(["track2", "missing"])
+
+            # Tracks without an image are stored too, so nothing is fetched the second time
+            assert spotify_service.get_album_images(["track2", "missing"]) == {"track2": "image2.jpg"}
+            mock_spotify_client.tracks.assert_called_once()
+
+    def test_rate_limiter(self, spotify_service, authenticated_session, mock_spotify_client, tmp_path):
+        """Test that calls go through the rate limiter, which retries them when Spotify responds with Too Many
+        Requests."""
+        spotify_service.rate_limiter = RateLimiter(str(tmp_path / "moodtunes.db"))
+        tracks = mock_spotify_client.tracks.return_value
+        mock_spotify_client.tracks.side_effect = [
+            SpotifyException(429, -1, "Too many requests", headers={"Retry-After": "0"}), tracks
+        ]
+        with patch('spotify_service.Spotify', return_value=mock_spotify_client):
+            assert len(spotify_service.get_tracks(["track1", "track2"])) == 2
+
+            # The HTTP session leaves Too Many Requests responses to the rate limiter
+            retry = spotify_service._http_session.get_adapter("https://api.spotify.com").max_retries
+            assert 429 not in retry.status_forcelist
+            assert mock_spotify_client.tracks.call_count == 2
+            assert spotify_service.rate_limiter.stats()["process"]["retried"] == 1
+
     def test_get_active_device_no_devices(self, spotify_service, authenticated_session, mock_spotify_client):
         """Test getting the active device when no devices are available."""
         # Modify the mock to return no devices
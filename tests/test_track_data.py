@@ -1,5 +1,7 @@
 import pytest
+import numpy as np
 import pandas as pd
+from unittest.mock import patch
 from track_data import TrackData
 from sklearn.preprocessing import StandardScaler
 
@@ -73,3 +75,470 @@ class TestTrackData:
         artists = td.get_all_artists()
         # Should return unique, sorted, non-null artists
         assert artists == ["Artist X", "Artist Y"]
+
+    def test_load_csv_writes_snapshot(self, tmp_path):
+        csv_content = (
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,Artist Y,Rock,0.8,0.7,65,0.3\n"
+            "a3,Chanson Été,,Jazz,0.6,0.4,70,0.3\n"  # Null artist, non-ASCII name
+        )
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(csv_content, encoding="utf-8")
+        snapshot_path = tmp_path / "tracks.snapshot"
+
+        td = TrackData()
+        td.load_csv(str(csv_path), snapshot_path=str(snapshot_path))
+        assert snapshot_path.exists()
+
+        # A second load should come from the snapshot, without reading the CSV
+        td2 = TrackData()
+        with patch("track_data.pd.read_csv") as mock_read_csv:
+            td2.load_csv(str(csv_path), snapshot_path=str(snapshot_path))
+            mock_read_csv.assert_not_called()
+
+        pd.testing.assert_frame_equal(td2.df, td.df)
+        assert td2.checksum == td.checksum
+        np.testing.assert_array_equal(td2.scaler.mean_, td.scaler.mean_)
+        np.testing.assert_array_equal(td2.scaler.scale_, td.scaler.scale_)
+        np.testing.assert_array_equal(td2.scaler.transform([[70, 0.2]]), td.scaler.transform([[70, 0.2]]))
+
+    def test_snapshot_invalidated_when_csv_changes(self, tmp_path):
+        header = "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(header + "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n")
+        snapshot_path = tmp_path / "tracks.snapshot"
+
+        td = TrackData()
+        td.load_csv(str(csv_path), snapshot_path=str(snapshot_path))
+
+        # Change the CSV file; the snapshot must be rebuilt
+        csv_path.write_text(header + "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+                                     "a2,Song B,Artist Y,Rock,0.8,0.7,65,0.3\n")
+        td2 = TrackData()
+        td2.load_csv(str(csv_path), snapshot_path=str(snapshot_path))
+        assert len(td2.df) == 2
+        assert td2.checksum != td.checksum
+
+        # The rebuilt snapshot is used by the next load
+        td3 = TrackData()
+        with patch("track_data.pd.read_csv") as mock_read_csv:
+            td3.load_csv(str(csv_path), snapshot_path=str(snapshot_path))
+            mock_read_csv.assert_not_called()
+        assert len(td3.df) == 2
+
+    def test_snapshot_ignored_when_version_changes(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+        )
+        snapshot_path = tmp_path / "tracks.snapshot"
+        TrackData().load_csv(str(csv_path), snapshot_path=str(snapshot_path))
+
+        td = TrackData()
+        td.snapshot_version = TrackData.snapshot_version + 1
+        with patch("track_data.pd.read_csv", wraps=pd.read_csv) as mock_read_csv:
+            td.load_csv(str(csv_path), snapshot_path=str(snapshot_path))
+            mock_read_csv.assert_called_once()
+        assert td.df.loc[0, "track_name"] == "Song A"
+
+    def test_corrupt_snapshot_is_rebuilt(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+        )
+        snapshot_path = tmp_path / "tracks.snapshot"
+        snapshot_path.write_bytes(b"not a snapshot")
+
+        td = TrackData()
+        td.load_csv(str(csv_path), snapshot_path=str(snapshot_path))
+        assert td.df.loc[0, "artist"] == "Artist X"
+        assert snapshot_path.read_bytes().startswith(b"MTSNAP")
+
+    def test_genre_and_artist_codes(self, tmp_path):
+        csv_content = (
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,Artist Y,Rock,0.8,0.7,65,0.3\n"
+            "a3,Song C,Artist X,Pop,0.4,0.5,90,0.2\n"
+            "a4,Song D,,Jazz,0.6,0.4,70,0.3\n"  # Null artist
+        )
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(csv_content)
+
+        for snapshot_path in (None, str(tmp_path / "tracks.snapshot")):
+            td = TrackData()
+            td.load_csv(str(csv_path), snapshot_path=snapshot_path)
+            assert td.genres == ["Jazz", "Pop", "Rock"]
+            assert td.genre_codes.tolist() == [1, 2, 1, 0]
+            assert td.artists == ["Artist X", "Artist Y"]
+            assert td.artist_codes.tolist() == [0, 1, 0, -1]
+
+    def test_snapshot_numeric_data_is_memory_mapped(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,Artist Y,Rock,0.8,0.7,65,0.3\n"
+        )
+        snapshot_path = tmp_path / "tracks.snapshot"
+
+        # Both the first load (which writes the snapshot) and later loads use the mapped file
+        for _ in range(2):
+            td = TrackData()
+            td.load_csv(str(csv_path), snapshot_path=str(snapshot_path))
+            for column in ["valence", "energy", "popularity", "instrumentalness"]:
+                values = td.df[column].to_numpy()
+                assert not values.flags.owndata
+                assert not values.flags.writeable
+            assert not td.genre_codes.flags.writeable
+            assert not td.artist_codes.flags.writeable
+
+    def test_compact_column_types(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,,Rock,0.8,0.7,65,0.3\n"
+        )
+
+        for snapshot_path in (None, str(tmp_path / "tracks.snapshot")):
+            td = TrackData()
+            td.load_csv(str(csv_path), snapshot_path=snapshot_path)
+            df = td.df
+
+            # Features are 32-bit floats
+            for column in ["valence", "energy", "popularity", "instrumentalness"]:
+                assert df[column].dtype == np.float32
+
+            # Genres and artists are categorical, sharing the TrackData codes
+            assert isinstance(df["genre"].dtype, pd.CategoricalDtype)
+            assert isinstance(df["artist"].dtype, pd.CategoricalDtype)
+            assert np.shares_memory(df["genre"].array.codes, td.genre_codes)
+            assert np.shares_memory(df["artist"].array.codes, td.artist_codes)
+            assert pd.isna(df.loc[1, "artist"])
+
+            # Track IDs and names are Arrow strings
+            assert df["track_id"].dtype == TrackData.string_dtype
+            assert df["track_name"].dtype == TrackData.string_dtype
+            assert df["track_id"].tolist() == ["a1", "a2"]
+            assert df.loc[1, "track_name"] == "Song B"
+
+    def test_memory_report(self, tmp_path):
+        td = TrackData()
+        assert td.memory_report() == {"total": 0}
+
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,Artist Y,Rock,0.8,0.7,65,0.3\n"
+        )
+        td.load_csv(str(csv_path))
+
+        report = td.memory_report()
+        assert set(report) == set(td.df.columns) | {"genre_index", "artist_index", "artist_search_index", "mood_index",
+                                                   "track_id_index", "taste_vectors", "hot_tier", "total"}
+        assert report["valence"] == 2 * 4
+        assert report["total"] == sum(value for key, value in report.items() if key != "total")
+
+    def test_genre_index(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,Artist Y,Rock,0.8,0.7,65,0.3\n"
+            "a3,Song C,Artist X,,0.4,0.5,90,0.2\n"  # Null genre
+            "a4,Song D,Artist Z,Pop,0.6,0.4,70,0.3\n"
+            "a5,Song E,Artist Z,Jazz,0.6,0.4,70,0.3\n"
+        )
+
+        for snapshot_path in (None, str(tmp_path / "tracks.snapshot")):
+            td = TrackData()
+            td.load_csv(str(csv_path), snapshot_path=snapshot_path)
+            assert {genre: positions.tolist() for genre, positions in td.genre_index.items()} == {
+                "Jazz": [4], "Pop": [0, 3], "Rock": [1]
+            }
+
+            assert td.get_genre_positions(["Pop"]).tolist() == [0, 3]
+            assert td.get_genre_positions(["Rock", "Pop"]).tolist() == [0, 1, 3]
+            assert td.get_genre_positions(["Pop", "Pop", "Classical"]).tolist() == [0, 3]
+            assert td.get_genre_positions(["Classical"]).tolist() == []
+
+    def test_artist_index(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Émile,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,artist y,Rock,0.8,0.7,65,0.3\n"
+            "a3,Song C,,Pop,0.4,0.5,90,0.2\n"  # Null artist
+            "a4,Song D,Artist Z,Pop,0.6,0.4,70,0.3\n"
+            "a5,Song E,Émile,Jazz,0.6,0.4,70,0.3\n"
+        )
+
+        for snapshot_path in (None, str(tmp_path / "tracks.snapshot")):
+            td = TrackData()
+            td.load_csv(str(csv_path), snapshot_path=snapshot_path)
+
+            # Artist IDs are the artist codes
+            for artist in ("Émile", "artist y", "Artist Z"):
+                artist_id = td.get_artist_id(artist)
+                assert td.artists[artist_id] == artist
+                assert set(np.flatnonzero(td.artist_codes == artist_id)) == set(td.get_artist_positions([artist]))
+            assert td.get_artist_id("Artist Y") == -1
+            assert td.get_artist_id(None) == -1
+
+            assert td.get_artist_positions(["Émile"]).tolist() == [0, 4]
+            assert td.get_artist_positions(["Artist Z", "Émile", "Émile"]).tolist() == [0, 3, 4]
+            assert td.get_artist_positions(["Unknown"]).tolist() == []
+
+            assert td.filter_artists(["Unknown", "Artist Z", "Émile", "Artist Z"]) == ["Artist Z", "Émile"]
+
+    def test_track_positions(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "c3,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+            "a1,Song B,Artist Y,Rock,0.8,0.7,65,0.3\n"
+            ",Song C,Artist Z,Pop,0.4,0.5,90,0.2\n"  # Null track ID
+            "b2,Song D,Artist Z,Pop,0.6,0.4,70,0.3\n"
+        )
+
+        for snapshot_path in (None, str(tmp_path / "tracks.snapshot")):
+            td = TrackData()
+            td.load_csv(str(csv_path), snapshot_path=snapshot_path)
+
+            assert td.get_track_positions(["b2", "c3", "a1"]).tolist() == [0, 1, 3]
+            assert td.get_track_positions(["b2", "unknown", "b2", None, ""]).tolist() == [3]
+            assert td.get_track_positions([]).tolist() == []
+
+    def test_search_artists(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Émile Dubois,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,emily,Rock,0.8,0.7,65,0.3\n"
+            "a3,Song C,EMINEM,Pop,0.4,0.5,90,0.2\n"
+            "a4,Song D,Björk,Pop,0.6,0.4,70,0.3\n"
+            "a5,Song E,Emil,Jazz,0.6,0.4,70,0.3\n"
+        )
+
+        td = TrackData()
+        assert td.search_artists("em") == ([], 0)
+
+        for snapshot_path in (None, str(tmp_path / "tracks.snapshot")):
+            td = TrackData()
+            td.load_csv(str(csv_path), snapshot_path=snapshot_path)
+
+            # Matching ignores case and accents, and results are ordered by search key
+            assert td.search_artists("em") == (["Emil", "Émile Dubois", "emily", "EMINEM"], 4)
+            assert td.search_artists("ÉMIL") == (["Emil", "Émile Dubois", "emily"], 3)
+            assert td.search_artists("bjo") == (["Björk"], 1)
+            assert td.search_artists("emile  d") == (["Émile Dubois"], 1)
+            assert td.search_artists("x") == ([], 0)
+
+            # Results are paginated
+            assert td.search_artists("em", offset=1, limit=2) == (["Émile Dubois", "emily"], 4)
+            assert td.search_artists("em", offset=4, limit=2) == ([], 4)
+
+            # An empty query matches every artist
+            assert td.search_artists("", limit=2) == (["Björk", "Emil"], 5)
+
+    def test_get_artists_json(self, tmp_path):
+        import gzip
+        import json
+
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,artist y,Rock,0.8,0.7,65,0.3\n"
+        )
+        td = TrackData()
+        td.load_csv(str(csv_path))
+
+        payload = td.get_artists_json()
+        assert json.loads(payload["body"]) == ["Artist X", "artist y"]
+        assert gzip.decompress(payload["gzip"]) == payload["body"]
+
+        # The payload is encoded once and reused for the same dataset version
+        with patch.object(td, "get_all_artists") as mock_get_all_artists:
+            assert td.get_artists_json() is payload
+            mock_get_all_artists.assert_not_called()
+
+        # A new dataset version gets a new payload and ETag
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist Z,Pop,0.5,0.6,80,0.1\n"
+        )
+        td.load_csv(str(csv_path))
+        assert json.loads(td.get_artists_json()["body"]) == ["Artist Z"]
+        assert td.get_artists_json()["etag"] != payload["etag"]
+
+    def test_taste_vectors(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.5\n"
+            "a2,Song B,Artist Y,Rock,0.8,0.7,60,0.0\n"
+            "a3,Song C,Artist Z,Pop,0.4,0.5,70,0.25\n"  # Mean values, so the scaled vector is zero
+        )
+
+        for snapshot_path in (None, str(tmp_path / "tracks.snapshot")):
+            td = TrackData()
+            td.load_csv(str(csv_path), snapshot_path=snapshot_path)
+
+            scaled = td.df[td.taste_features].to_numpy(dtype=np.float64)
+            norms = np.linalg.norm(scaled, axis=1)
+            assert td.taste_vectors.shape == (3, len(td.taste_features))
+            np.testing.assert_allclose(td.taste_norms, norms, rtol=1e-6)
+            np.testing.assert_allclose(td.taste_vectors[:2], scaled[:2] / norms[:2, None], rtol=1e-6)
+            np.testing.assert_allclose(np.linalg.norm(td.taste_vectors[:2], axis=1), 1, rtol=1e-6)
+
+            # The zero vector stays zero
+            assert norms[2] == 0
+            np.testing.assert_allclose(td.taste_vectors[2], 0, atol=1e-6)
+
+    def test_mood_index(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,Artist Y,Rock,0.8,0.7,60,0.3\n"
+            "a3,Song C,Artist Z,Pop,0.51,0.61,70,0.2\n"  # Same cell as Song A
+            "a4,Song D,Artist Z,,1.0,0.0,70,0.2\n"  # No genre, on the edge of the grid
+            "a5,Song E,Artist X,Pop,0.1,0.9,75,0.4\n"
+        )
+
+        for snapshot_path in (None, str(tmp_path / "tracks.snapshot")):
+            td = TrackData()
+            td.load_csv(str(csv_path), snapshot_path=snapshot_path)
+
+            # Each cell holds the positions of its tracks, and its box bounds their moods
+            cells, boxes = td.get_mood_cells(["Pop", "Unknown"])
+            assert len(cells) == 2
+            assert sorted(td.get_mood_cell_positions(cells).tolist()) == [0, 2, 4]
+            for cell, box in zip(cells, boxes):
+                positions = td.get_mood_cell_positions(cells[cells == cell])
+                valence = td.df["valence"][positions]
+                energy = td.df["energy"][positions]
+                np.testing.assert_array_equal(box, [valence.min(), valence.max(), energy.min(), energy.max()])
+            assert [len(td.get_mood_cell_positions(np.array([cell]))) for cell in cells] == [1, 2]
+
+            # All tracks, including tracks without a genre
+            cells, _ = td.get_mood_cells(None)
+            assert sorted(td.get_mood_cell_positions(cells).tolist()) == [0, 1, 2, 3, 4]
+            assert td.get_mood_cells([])[0].tolist() == []
+
+    def test_mood_tables(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        rng = np.random.default_rng(0)
+        lines = ["track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness"]
+        for i in range(60):
+            genre = ["Pop", "Rock", ""][i % 3]
+            lines.append(f"t{i},Song {i},Artist {i},{genre},{rng.uniform(0, 1):.3f},{rng.uniform(0, 1):.3f},50,0.5")
+        csv_path.write_text("\n".join(lines) + "\n")
+        tables_path = str(tmp_path / "tracks.tables")
+
+        td = TrackData()
+        td.load_csv(str(csv_path))
+        td.load_mood_tables(tables_path, depth=5)
+        moods = td.df[["valence", "energy"]].to_numpy(dtype=np.float64)
+
+        # The listed tracks are the nearest tracks of the genres, and all other tracks are at least the radius away
+        for genres in (["Pop"], ["Rock", "Pop"], None):
+            rows, radius, point = td.get_mood_table(genres, 0.304, 0.696)
+            assert point == (0.3, 0.7)
+            members = np.flatnonzero(td.df["genre"].isin(genres)) if genres else np.arange(60)
+            distances = np.linalg.norm(moods - point, axis=1)
+            assert len(rows) == 5 * (3 if genres is None else len(genres))
+            assert set(rows) <= set(members)
+            others = np.setdiff1d(members, rows)
+            assert distances[others].min() >= radius
+            assert radius == min(distances[rows[i:i + 5]].max() for i in range(0, len(rows), 5))
+
+        # Tables listing every track of a genre have an infinite radius
+        td.load_mood_tables(str(tmp_path / "deep.tables"), depth=30)
+        rows, radius, _ = td.get_mood_table(["Rock"], 0.5, 0.5)
+        assert sorted(rows) == list(range(1, 60, 3))
+        assert radius == np.inf
+        assert td.memory_report()["mood_tables"] > 0
+
+        # The tables are loaded from the file while the dataset is unchanged, and rebuilt when it changes
+        with patch.object(TrackData, "_build_mood_tables", wraps=td._build_mood_tables) as build:
+            td.load_mood_tables(tables_path, depth=5)
+            build.assert_not_called()
+            td.checksum = "changed"
+            td.load_mood_tables(tables_path, depth=5)
+            build.assert_called_once_with(5)
+
+    def test_goal_shortlists(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        rng = np.random.default_rng(0)
+        lines = ["track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness"]
+        for i in range(60):
+            genre = ["Pop", "Rock", ""][i % 3]
+            lines.append(f"t{i},Song {i},Artist {i},{genre},{rng.uniform(0, 1):.3f},{rng.uniform(0, 1):.3f},50,0.5")
+        csv_path.write_text("\n".join(lines) + "\n")
+
+        td = TrackData()
+        assert td.get_goal_shortlist(None, 0.5, 0.5) is None
+        td.set_goal_moods([(0.8, 0.6), (0.2, 0.3)], fraction=0.9, depth=4, anchor_steps=2)
+        td.load_csv(str(csv_path), snapshot_path=str(tmp_path / "tracks.snapshot"))
+        moods = td.df[["valence", "energy"]].to_numpy(dtype=np.float64)
+
+        # The anchors of a goal are spread over the last steps towards it, from 90% of the way from (0, 0) to
+        # 90% of the way from (1, 1). The shortlist of the nearest anchor lists the nearest tracks of the genres,
+        # and all other tracks are at least the radius away.
+        for genres in (["Pop"], ["Rock", "Pop"], None):
+            rows, radius, anchor = td.get_goal_shortlist(genres, 0.23, 0.33)
+            assert anchor == pytest.approx((0.23, 0.32))
+            members = np.flatnonzero(td.df["genre"].isin(genres)) if genres else np.arange(60)
+            distances = np.linalg.norm(moods - anchor, axis=1)
+            assert len(rows) == 4 * (3 if genres is None else len(genres))
+            assert set(rows) <= set(members)
+            assert distances[np.setdiff1d(members, rows)].min() >= radius
+            assert radius == pytest.approx(min(distances[rows[i:i + 4]].max() for i in range(0, len(rows), 4)))
+        assert td.get_goal_shortlist(None, 0.9, 0.1)[2] == pytest.approx((0.82, 0.54))
+        assert td.memory_report()["goal_shortlists"] > 0
+
+        # Shortlists holding every track of a genre have an infinite radius
+        td.set_goal_moods([(0.8, 0.6)], depth=30)
+        rows, radius, _ = td.get_goal_shortlist(["Rock"], 0.5, 0.5)
+        assert sorted(rows) == list(range(1, 60, 3))
+        assert radius == np.inf
+
+        # The shortlists are built once whenever the dataset is loaded, from the CSV file or the snapshot
+        td.set_goal_moods([(0.8, 0.6)], depth=4)
+        (tmp_path / "tracks.snapshot").unlink()
+        for _ in range(2):
+            td.goal_shortlist_rows = None
+            with patch.object(td, "_build_goal_shortlists", wraps=td._build_goal_shortlists) as build:
+                td.load_csv(str(csv_path), snapshot_path=str(tmp_path / "tracks.snapshot"))
+            build.assert_called_once()
+            assert td.get_goal_shortlist(None, 0.5, 0.5)[0].shape == (12,)
+
+    def test_tiers(self, tmp_path):
+        csv_path = tmp_path / "tracks.csv"
+        csv_path.write_text(
+            "track_id,track_name,artist_name,new_genre,valence,energy,popularity,instrumentalness\n"
+            "a1,Song A,Artist X,Pop,0.5,0.6,80,0.1\n"
+            "a2,Song B,Artist Y,Rock,0.8,0.7,20,0.3\n"
+            "a3,Song C,Artist Y,Pop,0.2,0.1,60,0.5\n"
+            "a4,Song D,Artist Z,Pop,0.3,0.4,30,0.9\n"
+        )
+
+        # Tracks more popular than average are in the hot tier, also after loading the snapshot
+        td = TrackData()
+        for _ in range(2):
+            td.load_csv(str(csv_path), snapshot_path=str(tmp_path / "tracks.snapshot"))
+            assert td.hot_tier.tolist() == [True, False, True, False]
+
+        hot, cold = td.split_tiers(None)
+        assert hot.tolist() == [0, 2]
+        assert cold.tolist() == [1, 3]
+        hot, cold = td.split_tiers(td.get_genre_positions(["Pop"]))
+        assert hot.tolist() == [0, 1]
+        assert cold.tolist() == [2]
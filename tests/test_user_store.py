@@ -13,6 +13,8 @@ class TestUserStore:
         app = MagicMock()
         db_conn = MagicMock()
         app.get_db.return_value = db_conn
+        # Treat every artist as known to the track data
+        app.track_data.filter_artists.side_effect = lambda artists: list(artists)
         return app
 
     @pytest.fixture
@@ -154,6 +156,18 @@ class TestUserStore:
             assert mock_session['preferences'] == expected_prefs
             assert mock_session['preferences_loaded'] is False
 
+    def test_load_preferences_default_filters_unknown_artists(self, user_store, mock_app, mock_session):
+        """Test that top artists missing from the track data are left out of the default preferences."""
+        with patch.object(user_store, 'user_exists', return_value=True):
+            mock_app.get_db().execute().fetchone.return_value = {"preferences_json": None}
+            mock_app.spotify_service.get_top_artists.return_value = ["top_artist", "unknown_artist"]
+            mock_app.track_data.filter_artists.side_effect = lambda artists: [a for a in artists if a == "top_artist"]
+
+            user_store.load_preferences("test_user")
+
+            mock_app.track_data.filter_artists.assert_called_once_with(["top_artist", "unknown_artist"])
+            assert mock_session['preferences']["artists"] == ["top_artist"]
+
     def test_load_preferences_db_error(self, user_store, mock_app, mock_session):
         """Test handling DB errors when loading preferences."""
         # Setup mocks
@@ -191,6 +205,17 @@ class TestUserStore:
                 # Verify preferences were saved to session
                 assert mock_session['preferences'] == preferences
 
+    def test_save_preferences_filters_unknown_artists(self, user_store, mock_app, mock_session):
+        """Test that artists missing from the track data are not saved."""
+        with patch.object(user_store, 'user_exists', return_value=True):
+            mock_app.track_data.filter_artists.side_effect = lambda artists: [a for a in artists if a != "unknown"]
+
+            user_store.save_preferences("test_user", {"artists": ["test_artist", "unknown"], "genres": []})
+
+            args = mock_app.get_db().execute.call_args[0]
+            assert json.loads(args[1][0])["artists"] == ["test_artist"]
+            assert mock_session['preferences']["artists"] == ["test_artist"]
+
     def test_save_preferences_user_not_found(self, user_store):
         """Test save_preferences when user doesn't exist."""
         with patch.object(user_store, 'user_exists', return_value=False):
@@ -1,16 +1,124 @@
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import unicodedata
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from sklearn.neighbors import KDTree
 from sklearn.preprocessing import StandardScaler
+from snapshot import Snapshot
 
 
 # Track data class
 class TrackData:
+    # Version of the snapshot layout.
+    # Increase this whenever the arrays written to the snapshot change, so old snapshots are rebuilt.
+    snapshot_version = 9
+
+    # Number of grid cells along each axis of the mood index (valence and energy both span [0, 1])
+    mood_grid_size = 32
+
+    # Version of the mood tables layout, and the number of steps of the mood sliders:
+    # slider positions are multiples of 1 / mood_slider_steps on both axes
+    mood_tables_version = 1
+    mood_slider_steps = 100
+
+    # Track IDs and names are stored as Arrow strings: one UTF-8 buffer plus offsets,
+    # rather than a Python object per value
+    string_dtype = pd.StringDtype('pyarrow')
+
     def __init__(self):
         self.df = None
         self.scaler = StandardScaler()
         self.taste_features = ["popularity", "instrumentalness"]
 
-    # Load and prepare the track data from CSV file
-    def load_csv(self, filepath: str) -> None:
+        # Scaled taste features of each track normalized to unit length (one row per track), and their original norms.
+        # Tracks with a zero taste vector keep a zero row, so their cosine similarity is 0.
+        self.taste_vectors = None
+        self.taste_norms = None
+
+        # Integer codes for the genre and artist of each track.
+        # Codes index into the sorted lists of genre and artist names; -1 means no value.
+        self.genres = []
+        self.genre_codes = None
+        self.artists = []
+        self.artist_codes = None
+
+        # Genre index: row positions of the tracks in each genre, in ascending order.
+        # The positions for all genres are stored in one array, split into views per genre.
+        self.genre_index = {}
+        self._genre_order = None
+        self._genre_bounds = None
+
+        # Artist index: row positions of each artist's tracks, in the same layout as the genre index.
+        # Artists are looked up by integer ID (the code of the artist), so no per-artist objects are kept.
+        self._artist_order = None
+        self._artist_bounds = None
+
+        # Track ID index: row positions of the tracks ordered by track ID, without tracks that have no ID
+        self._track_id_order = None
+
+        # Artist search index: artist IDs ordered by their search key, and the search keys in the same order.
+        # Search keys are case-folded and accent-folded artist names, so prefixes can be found by binary search.
+        self._artist_search_order = None
+        self._artist_search_keys = None
+
+        # Mood index: a grid over the valence/energy plane, per genre, for nearest-mood queries.
+        # Each cell is keyed by (genre group, valence cell, energy cell), where group 0 holds the tracks without
+        # a genre and group i + 1 holds genre i. The row positions of each cell's tracks are stored like the genre
+        # index, and each cell's bounding box (lowest and highest valence and energy of its tracks) is kept,
+        # so the closest possible mood of any track in a cell is known without looking at its tracks.
+        self._mood_order = None
+        self._mood_bounds = None
+        self._mood_boxes = None
+
+        # Optional mood tables: for each genre group (as in the mood index) and each slider position, the row
+        # positions of the tracks nearest to that mood, padded with -1, and the distance of the farthest of them.
+        # All other tracks of the group are at least that far away; the distance is infinite if the table lists
+        # every track of the group.
+        self.mood_table_rows = None
+        self.mood_table_radii = None
+
+        # Goal shortlists: for each fixed goal mood set with set_goal_moods, a grid of anchor moods over the targets
+        # of the last trajectory step towards it, which lie `fraction` of the way from any slider position to the goal
+        # mood. For each genre group and anchor, the row positions of the `depth` tracks nearest to the anchor, padded
+        # with -1, and the distance of the farthest of them (infinite if the shortlist holds every track of the
+        # group). Rebuilt whenever the dataset is loaded.
+        self.goal_moods = None
+        self.goal_shortlist_fraction = 0.9
+        self.goal_shortlist_anchor_steps = 10
+        self.goal_shortlist_depth = 256
+        self.goal_shortlist_rows = None
+        self.goal_shortlist_radii = None
+
+        # Popularity tiers: a mask of the tracks in the hot tier, those more popular than hot_tier_popularity
+        # (in scaled units, so 0 is the average popularity). The other tracks form the cold tier.
+        # Rebuilt whenever the dataset is loaded.
+        self.hot_tier_popularity = 0.0
+        self.hot_tier = None
+
+        # SHA-256 checksum of the CSV file the data was loaded from
+        self.checksum = None
+
+        # Encoded list of all artists, built on first use for the current dataset version
+        self._artists_json = None
+
+    # Load and prepare the track data from CSV file.
+    # If a snapshot path is given, a binary snapshot of the prepared data is loaded from (or written to)
+    # that path, so later loads of the same CSV file skip parsing and scaling.
+    def load_csv(self, filepath: str, snapshot_path: str | None = None) -> None:
+        # Get the size and modification time of the CSV file.
+        # Raises FileNotFoundError if the file does not exist.
+        stat = os.stat(filepath)
+
+        # Use the snapshot if it was built from the same CSV file
+        if snapshot_path and self._load_snapshot(snapshot_path, filepath, stat):
+            return
+
         # Select columns to load:
         # - track_id: Spotify track ID
         # - track_name: Track name
@@ -24,24 +132,587 @@ class TrackData:
                    "valence", "energy", "popularity", "instrumentalness"]
 
         # Load track data
-        df = pd.read_csv(filepath, usecols=usecols, dtype={'popularity': 'float64'})
+        df = pd.read_csv(filepath, usecols=usecols, dtype={
+            'track_id': self.string_dtype,
+            'track_name': self.string_dtype,
+            'popularity': 'float64'
+        })
 
         # Rename columns
         df.rename(columns={'artist_name': 'artist', 'new_genre': 'genre'}, inplace=True)
 
         # Normalize taste features for similarity comparison (mean = 0, std = 1).
         # Ensures all features are on the same scale and contribute equally.
-        df[self.taste_features] = self.scaler.fit_transform(df[self.taste_features])
+        # The scaler is fitted in double precision, but all features are stored as 32-bit floats.
+        scaled = self.scaler.fit_transform(df[self.taste_features])
+        for i, feature in enumerate(self.taste_features):
+            df[feature] = scaled[:, i].astype(np.float32)
+        df['valence'] = df['valence'].astype(np.float32)
+        df['energy'] = df['energy'].astype(np.float32)
+
         self.df = df
+        self.checksum = self._file_checksum(filepath)
+
+        # Encode genres and artists and build the indexes
+        self.build_indexes()
+
+        # Save a snapshot for the next load.
+        # Then switch to the memory-mapped snapshot, so the numeric data is shared with other worker processes.
+        if snapshot_path:
+            self._write_snapshot(snapshot_path, stat)
+            self._load_snapshot(snapshot_path, filepath, stat, build_derived=False)
+
+    # Build the genre and artist codes, the genre and artist indexes and the unit taste vectors from the DataFrame.
+    # Genre and artist columns are converted to categorical columns sharing the codes.
+    def build_indexes(self) -> None:
+        codes, self.genres = self._encode(self.df['genre'])
+        self.df['genre'] = pd.Categorical.from_codes(codes, categories=self.genres)
+        codes, self.artists = self._encode(self.df['artist'])
+        self.df['artist'] = pd.Categorical.from_codes(codes, categories=self.artists)
+        self.genre_codes = self.df['genre'].array.codes
+        self.artist_codes = self.df['artist'].array.codes
+
+        self._genre_order, self._genre_bounds = self._build_index(self.genre_codes, len(self.genres))
+        self.genre_index = self._split_index(self.genres, self._genre_order, self._genre_bounds)
+        self._artist_order, self._artist_bounds = self._build_index(self.artist_codes, len(self.artists))
+        self._build_artist_search_index()
+        self._build_track_id_index()
+        self._build_mood_index()
+        self._build_taste_vectors()
+        self._build_tiers()
+        self._build_goal_shortlists()
+
+    # Build the unit taste vectors and their norms from the scaled taste features
+    def _build_taste_vectors(self) -> None:
+        vectors = np.column_stack([self.df[feature].to_numpy(dtype=np.float64) for feature in self.taste_features])
+        norms = np.linalg.norm(vectors, axis=1)
+        np.divide(vectors, norms[:, None], out=vectors, where=norms[:, None] > 0)
+        self.taste_vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.taste_norms = norms.astype(np.float32)
+
+    # Build the track ID index from the track ID column
+    def _build_track_id_index(self) -> None:
+        track_ids = pa.array(self.df['track_id'], from_pandas=True) if len(self.df) else pa.array([], pa.string())
+        order = pc.sort_indices(track_ids).to_numpy()
+        self._track_id_order = order[:len(order) - track_ids.null_count].astype(np.int32)
+
+    # Build the popularity tiers from the scaled popularity column
+    def _build_tiers(self) -> None:
+        self.hot_tier = self.df['popularity'].to_numpy() > self.hot_tier_popularity
+
+    # Split the tracks at the given row positions (None means all tracks) into the hot and cold tiers.
+    # Returns the indices among the positions of the hot tracks and of the cold tracks, in ascending order.
+    def split_tiers(self, positions: np.ndarray | None) -> tuple[np.ndarray, np.ndarray]:
+        hot = self.hot_tier if positions is None else self.hot_tier[positions]
+        return np.flatnonzero(hot), np.flatnonzero(~hot)
+
+    # Build the mood index from the genre codes and the valence and energy columns
+    def _build_mood_index(self) -> None:
+        size = self.mood_grid_size
+        valence = self.df['valence'].to_numpy(dtype=np.float64)
+        energy = self.df['energy'].to_numpy(dtype=np.float64)
+
+        # Assign each track to a cell; values outside [0, 1] go to the edge cells
+        valence_cells = np.clip(valence * size, 0, size - 1).astype(np.int32)
+        energy_cells = np.clip(energy * size, 0, size - 1).astype(np.int32)
+        cells = ((self.genre_codes.astype(np.int32) + 1) * size + valence_cells) * size + energy_cells
+        num_cells = (len(self.genres) + 1) * size * size
+        self._mood_order, self._mood_bounds = self._build_index(cells, num_cells)
+
+        # Bounding box of each non-empty cell; empty cells have NaN boxes.
+        # Boxes are kept in double precision, so they hold the exact values of the tracks.
+        boxes = np.full((num_cells, 4), np.nan)
+        starts = self._mood_bounds[:-1]
+        filled = np.flatnonzero(self._mood_bounds[1:] > starts)
+        if len(filled):
+            for column, values in enumerate((valence, energy)):
+                ordered = values[self._mood_order]
+                boxes[filled, 2 * column] = np.minimum.reduceat(ordered, starts[filled])
+                boxes[filled, 2 * column + 1] = np.maximum.reduceat(ordered, starts[filled])
+        self._mood_boxes = boxes
+
+    # Build the artist search index from the list of artist names
+    def _build_artist_search_index(self) -> None:
+        keys = [self.search_key(artist) for artist in self.artists]
+        self._artist_search_order = np.array(sorted(range(len(keys)), key=keys.__getitem__), dtype=np.int32)
+        self._artist_search_keys = pa.array([keys[i] for i in self._artist_search_order], type=pa.large_string())
+
+    # Get the row positions of all tracks in the given genres, in ascending order.
+    # Unknown genres are ignored.
+    def get_genre_positions(self, genres: list[str]) -> np.ndarray:
+        parts = [self.genre_index[genre] for genre in dict.fromkeys(genres) if genre in self.genre_index]
+        if not parts:
+            return np.zeros(0, dtype=np.int32)
+        if len(parts) == 1:
+            return parts[0]
+
+        # Genres don't overlap, so the union is just the sorted concatenation
+        return np.sort(np.concatenate(parts))
+
+    # Get the non-empty mood index cells of the given genres, and their bounding boxes.
+    # None means all tracks, including tracks without a genre. Unknown genres are ignored.
+    # Each box row holds the lowest and highest valence, then the lowest and highest energy, of the cell's tracks.
+    def get_mood_cells(self, genres: list[str] | None) -> tuple[np.ndarray, np.ndarray]:
+        cells_per_group = self.mood_grid_size * self.mood_grid_size
+        if genres is None:
+            groups = np.arange(len(self.genres) + 1)
+        else:
+            groups = np.array([self.genres.index(genre) + 1 for genre in dict.fromkeys(genres)
+                               if genre in self.genre_index], dtype=np.int64)
+        cells = (groups[:, None] * cells_per_group + np.arange(cells_per_group)).ravel()
+        cells = cells[self._mood_bounds[cells + 1] > self._mood_bounds[cells]]
+        return cells, self._mood_boxes[cells]
+
+    # Get the row positions of the tracks in the given mood index cells.
+    # Positions are grouped by cell, in the order of the cells, and in ascending order within each cell.
+    def get_mood_cell_positions(self, cells: np.ndarray) -> np.ndarray:
+        starts = self._mood_bounds[cells]
+        counts = self._mood_bounds[cells + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return self._mood_order[offsets + np.arange(len(offsets))]
+
+    # Get the mood table entries of the given genres (None means all tracks) for the slider position nearest to
+    # the given mood. Returns the listed row positions, the lowest radius of the genres' tables at that position,
+    # and the mood of the slider position.
+    def get_mood_table(self, genres: list[str] | None, valence: float, energy: float) -> tuple[np.ndarray, float,
+                                                                                             tuple[float, float]]:
+        steps = self.mood_slider_steps
+        valence_step = int(np.clip(np.rint(valence * steps), 0, steps))
+        energy_step = int(np.clip(np.rint(energy * steps), 0, steps))
+        point = valence_step * (steps + 1) + energy_step
+        groups = self._genre_groups(genres)
+        rows = self.mood_table_rows[groups, point].ravel()
+        radius = float(self.mood_table_radii[groups, point].min()) if groups else np.inf
+        return rows[rows >= 0], radius, (valence_step / steps, energy_step / steps)
+
+    # Get the genre groups of the given genres, as in the mood index (None means all groups)
+    def _genre_groups(self, genres: list[str] | None) -> list[int]:
+        if genres is None:
+            return list(range(len(self.genres) + 1))
+        return [self.genres.index(genre) + 1 for genre in dict.fromkeys(genres) if genre in self.genre_index]
+
+    # Set the fixed target moods of the recommendation goals, as (valence, energy) pairs, and build the shortlists of
+    # the nearest tracks of each genre to the targets of the last trajectory step towards them, which lie `fraction`
+    # of the way from the user's mood to the goal mood. The anchors of each goal are spaced 1 / anchor_steps of the
+    # remaining way apart. The shortlists are rebuilt for every dataset loaded afterwards.
+    def set_goal_moods(self, moods: list[tuple[float, float]], fraction: float = 0.9, depth: int = 256,
+                       anchor_steps: int = 10) -> None:
+        self.goal_moods = np.array(moods, dtype=np.float64).reshape(-1, 2)
+        self.goal_shortlist_fraction = fraction
+        self.goal_shortlist_depth = depth
+        self.goal_shortlist_anchor_steps = anchor_steps
+        if self.df is not None:
+            self._build_goal_shortlists()
+
+    # Get the goal shortlist entries of the given genres (None means all tracks) for the goal anchor nearest to the
+    # given mood. Returns the listed row positions, the lowest radius of the genres' shortlists and the anchor mood,
+    # or None if no goal moods are set.
+    def get_goal_shortlist(self, genres: list[str] | None, valence: float,
+                           energy: float) -> tuple[np.ndarray, float, tuple[float, float]] | None:
+        if self.goal_shortlist_rows is None:
+            return None
+
+        # The anchors of each goal form a grid, so the nearest anchor of each goal is found by rounding
+        steps = self.goal_shortlist_anchor_steps
+        origins = self.goal_moods * self.goal_shortlist_fraction
+        spacing = (1 - self.goal_shortlist_fraction) / steps
+        anchor_steps = np.clip(np.rint((np.array([valence, energy]) - origins) / spacing), 0, steps)
+        anchors = origins + anchor_steps * spacing
+        goal = int(np.argmin(np.hypot(anchors[:, 0] - valence, anchors[:, 1] - energy)))
+        anchor = int(anchor_steps[goal, 0]) * (steps + 1) + int(anchor_steps[goal, 1])
+
+        groups = self._genre_groups(genres)
+        rows = self.goal_shortlist_rows[groups, goal, anchor].ravel()
+        radius = float(self.goal_shortlist_radii[groups, goal, anchor].min()) if groups else np.inf
+        return rows[rows >= 0], radius, (float(anchors[goal, 0]), float(anchors[goal, 1]))
+
+    # Build the goal shortlists for all genre groups and goal anchors
+    def _build_goal_shortlists(self) -> None:
+        if self.goal_moods is None:
+            return
+
+        steps = self.goal_shortlist_anchor_steps
+        grid = np.stack(np.meshgrid(np.arange(steps + 1), np.arange(steps + 1), indexing='ij'), axis=-1)
+        grid = grid.reshape(-1, 2) * ((1 - self.goal_shortlist_fraction) / steps)
+        anchors = (self.goal_moods[:, None, :] * self.goal_shortlist_fraction + grid).reshape(-1, 2)
+        rows, radii = self._nearest_tracks(anchors, self.goal_shortlist_depth)
+        self.goal_shortlist_rows = rows.reshape(len(rows), len(self.goal_moods), len(grid), -1)
+        self.goal_shortlist_radii = radii.reshape(len(radii), len(self.goal_moods), len(grid))
+
+    # Load the mood tables from the given path, building and saving them first if they are missing or were built
+    # for another version of the dataset. Each table lists the `depth` nearest tracks of each slider position.
+    # Building the tables takes one nearest-neighbour query per slider position and genre; loading them is a
+    # memory mapping of the file.
+    def load_mood_tables(self, path: str, depth: int = 128) -> None:
+        try:
+            meta, arrays = Snapshot.read(path)
+        except (OSError, ValueError):
+            meta, arrays = {}, {}
+
+        expected = {"version": self.mood_tables_version, "checksum": self.checksum, "depth": depth,
+                    "slider_steps": self.mood_slider_steps}
+        if meta != expected:
+            arrays = self._build_mood_tables(depth)
+            try:
+                Snapshot.write(path, arrays, expected)
+            except OSError as e:
+                print(f"Failed to write mood tables {path}: {e}")
+
+        self.mood_table_rows = arrays['rows']
+        self.mood_table_radii = arrays['radii']
+
+    # Build the mood tables for all genre groups and slider positions
+    def _build_mood_tables(self, depth: int) -> dict[str, np.ndarray]:
+        steps = self.mood_slider_steps
+        grid = np.stack(np.meshgrid(np.arange(steps + 1), np.arange(steps + 1), indexing='ij'), axis=-1)
+        grid = grid.reshape(-1, 2) / steps
+        rows, radii = self._nearest_tracks(grid, depth)
+        return {"rows": rows, "radii": radii}
+
+    # Find the `depth` nearest tracks of each genre group to each of the given moods.
+    # Returns their row positions, padded with -1, and the distance of the farthest of them, which is infinite if
+    # they are all the tracks of the group. Takes one nearest-neighbour query per genre group.
+    def _nearest_tracks(self, points: np.ndarray, depth: int) -> tuple[np.ndarray, np.ndarray]:
+        moods = np.column_stack([self.df['valence'].to_numpy(dtype=np.float64),
+                                 self.df['energy'].to_numpy(dtype=np.float64)])
+        num_groups = len(self.genres) + 1
+        rows = np.full((num_groups, len(points), depth), -1, dtype=np.int32)
+        radii = np.full((num_groups, len(points)), np.inf)
+        for group in range(num_groups):
+            members = np.flatnonzero(self.genre_codes == group - 1)
+            if len(members) == 0:
+                continue
+            k = min(depth, len(members))
+            distances, nearest = KDTree(moods[members]).query(points, k=k)
+            rows[group, :, :k] = members[nearest].reshape(len(points), k)
+            if len(members) > depth:
+                radii[group] = distances.reshape(len(points), k)[:, -1]
+        return rows, radii
+
+    # Get the row positions of the tracks with the given track IDs, in ascending order.
+    # Each ID is found by binary search in the track ID index, so the cost does not depend on the number of tracks.
+    # Unknown IDs are ignored.
+    def get_track_positions(self, track_ids: list[str]) -> np.ndarray:
+        values = self.df['track_id'].array
+        order = self._track_id_order
+        positions = []
+        for track_id in dict.fromkeys(track_ids):
+            if not isinstance(track_id, str):
+                continue
+            i = bisect.bisect_left(order, track_id, key=lambda row: values[row])
+            if i < len(order) and values[order[i]] == track_id:
+                positions.append(int(order[i]))
+        return np.array(sorted(positions), dtype=np.int64)
+
+    # Get the integer ID of an artist, or -1 if the artist is not in the dataset.
+    # Artist names are sorted, so the ID is found by binary search.
+    def get_artist_id(self, artist: str) -> int:
+        if not isinstance(artist, str):
+            return -1
+        artist_id = bisect.bisect_left(self.artists, artist)
+        if artist_id < len(self.artists) and self.artists[artist_id] == artist:
+            return artist_id
+        return -1
+
+    # Get the row positions of all tracks by the given artists, in ascending order.
+    # Unknown artists are ignored.
+    def get_artist_positions(self, artists: list[str]) -> np.ndarray:
+        artist_ids = [self.get_artist_id(artist) for artist in dict.fromkeys(artists)]
+        parts = [self._artist_order[self._artist_bounds[i]:self._artist_bounds[i + 1]]
+                 for i in artist_ids if i >= 0]
+        if not parts:
+            return np.zeros(0, dtype=np.int32)
+        if len(parts) == 1:
+            return parts[0]
+
+        # Artists don't overlap, so the union is just the sorted concatenation
+        return np.sort(np.concatenate(parts))
+
+    # Keep only the artists that are in the dataset, in their original order and without duplicates
+    def filter_artists(self, artists: list[str]) -> list[str]:
+        return [artist for artist in dict.fromkeys(artists) if self.get_artist_id(artist) >= 0]
+
+    # Search for artists whose name starts with the given text, ignoring case and accents.
+    # Returns one page of matching artist names, ordered by search key, and the total number of matches.
+    def search_artists(self, query: str, offset: int = 0, limit: int = 20) -> tuple[list[str], int]:
+        if self.df is None:
+            return [], 0
+
+        # Find the range of search keys starting with the folded query
+        prefix = self.search_key(query)
+        start = self._bisect_keys(prefix)
+        end = self._bisect_keys(prefix + '\U0010ffff') if prefix else len(self._artist_search_keys)
+
+        # Return the requested page of matches
+        page = self._artist_search_order[start + offset:end][:limit] if offset >= 0 and limit > 0 else []
+        return [self.artists[i] for i in page], end - start
+
+    # Get the search key of a name: case-folded, with accents removed and whitespace collapsed
+    @staticmethod
+    def search_key(name: str) -> str:
+        decomposed = unicodedata.normalize('NFKD', name)
+        stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+        return ' '.join(stripped.casefold().split())
 
     # Get list of all artists in the dataset
     def get_all_artists(self) -> list[str]:
         if self.df is None:
             return []
 
-        # Get unique artists from the dataset.
-        # Remove any null values.
-        artists = self.df['artist'].dropna().unique().tolist()
+        # Sort artists alphabetically.
+        # The artist names are the categories of the artist column, so they are already unique and non-null.
+        return sorted(self.artists, key=str.lower)
+
+    # Find the first position in the artist search keys that is not less than the given key
+    def _bisect_keys(self, key: str) -> int:
+        low, high = 0, len(self._artist_search_keys)
+        while low < high:
+            middle = (low + high) // 2
+            if self._artist_search_keys[middle].as_py() < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Get the list of all artists encoded as JSON, both plain and gzip-compressed, with an ETag for the content.
+    # The encoding is done once per dataset version and reused, so serving the list does no work.
+    def get_artists_json(self) -> dict:
+        if self._artists_json is None or self._artists_json['version'] != self.checksum:
+            body = json.dumps(self.get_all_artists(), separators=(',', ':')).encode('utf-8')
+            self._artists_json = {
+                "version": self.checksum,
+                "body": body,
+                "gzip": gzip.compress(body, mtime=0),
+                "etag": hashlib.sha256(body).hexdigest()[:32]
+            }
+        return self._artists_json
+
+    # Get the memory used by the track data in bytes, for each column and in total
+    def memory_report(self) -> dict[str, int]:
+        if self.df is None:
+            return {"total": 0}
+
+        report = {column: int(nbytes) for column, nbytes in self.df.memory_usage(deep=True, index=False).items()}
+        report["genre_index"] = self._genre_order.nbytes + self._genre_bounds.nbytes
+        report["artist_index"] = self._artist_order.nbytes + self._artist_bounds.nbytes
+        report["taste_vectors"] = self.taste_vectors.nbytes + self.taste_norms.nbytes
+        report["artist_search_index"] = self._artist_search_order.nbytes + self._artist_search_keys.nbytes
+        report["track_id_index"] = self._track_id_order.nbytes
+        report["mood_index"] = self._mood_order.nbytes + self._mood_bounds.nbytes + self._mood_boxes.nbytes
+        if self.mood_table_rows is not None:
+            report["mood_tables"] = self.mood_table_rows.nbytes + self.mood_table_radii.nbytes
+        report["hot_tier"] = self.hot_tier.nbytes
+        if self.goal_shortlist_rows is not None:
+            report["goal_shortlists"] = self.goal_shortlist_rows.nbytes + self.goal_shortlist_radii.nbytes
+        report["total"] = sum(report.values())
+        return report
+
+    # Load the prepared track data from a snapshot.
+    # Returns False if the snapshot is missing, unreadable, from an older layout,
+    # or was built from a different version of the CSV file.
+    # The popularity tiers and goal shortlists are not stored, so they are built after loading, unless they were
+    # already built from the same data.
+    def _load_snapshot(self, snapshot_path: str, filepath: str, stat: os.stat_result,
+                       build_derived: bool = True) -> bool:
+        if not os.path.exists(snapshot_path):
+            return False
+
+        try:
+            meta, arrays = Snapshot.read(snapshot_path)
+        except (OSError, ValueError):
+            return False
+
+        if meta.get('version') != self.snapshot_version:
+            return False
+
+        # Check the snapshot was built from the same CSV file.
+        # Only compute the checksum if the file size or modification time has changed.
+        source = meta['source']
+        if source['size'] != stat.st_size:
+            return False
+        if source['mtime_ns'] != stat.st_mtime_ns and source['checksum'] != self._file_checksum(filepath):
+            return False
+
+        # Genre and artist codes are used without copying, so they stay backed by the memory-mapped snapshot
+        self.genre_codes = arrays['genre.codes']
+        self.genres = self._unpack_strings(arrays['genre.names.offsets'], arrays['genre.names.data'],
+                                           arrays['genre.names.validity']).to_pylist()
+        self.artist_codes = arrays['artist.codes']
+        self.artists = self._unpack_strings(arrays['artist.names.offsets'], arrays['artist.names.data'],
+                                            arrays['artist.names.validity']).to_pylist()
+
+        # The genre and artist indexes are also memory-mapped
+        self._genre_order = arrays['genre.order']
+        self._genre_bounds = arrays['genre.bounds']
+        self.genre_index = self._split_index(self.genres, self._genre_order, self._genre_bounds)
+        self._artist_order = arrays['artist.order']
+        self._artist_bounds = arrays['artist.bounds']
+        self._artist_search_order = arrays['artist.search.order']
+        self._artist_search_keys = self._unpack_strings(arrays['artist.search.keys.offsets'],
+                                                        arrays['artist.search.keys.data'],
+                                                        arrays['artist.search.keys.validity'])
+        self._track_id_order = arrays['track_id.order']
+        self._mood_order = arrays['mood.order']
+        self._mood_bounds = arrays['mood.bounds']
+        self._mood_boxes = arrays['mood.boxes']
+
+        # The unit taste vectors are also memory-mapped
+        self.taste_vectors = arrays['taste.vectors']
+        self.taste_norms = arrays['taste.norms']
+
+        # Rebuild the DataFrame, column by column.
+        # Numeric columns, categorical codes and string buffers are all used without copying.
+        columns = {}
+        for column in meta['columns']:
+            if column == 'genre':
+                columns[column] = pd.Categorical.from_codes(self.genre_codes, categories=self.genres)
+            elif column == 'artist':
+                columns[column] = pd.Categorical.from_codes(self.artist_codes, categories=self.artists)
+            elif column in meta['string_columns']:
+                strings = self._unpack_strings(arrays[f'{column}.offsets'], arrays[f'{column}.data'],
+                                               arrays[f'{column}.validity'])
+                columns[column] = pd.array(strings, dtype=self.string_dtype)
+            else:
+                columns[column] = arrays[column]
+        self.df = pd.DataFrame(columns, copy=False)
+
+        # Restore the fitted scaler
+        scaler = StandardScaler()
+        scaler.mean_ = arrays['scaler.mean'].copy()
+        scaler.var_ = arrays['scaler.var'].copy()
+        scaler.scale_ = arrays['scaler.scale'].copy()
+        scaler.n_samples_seen_ = np.int64(meta['scaler_samples_seen'])
+        scaler.n_features_in_ = len(self.taste_features)
+        scaler.feature_names_in_ = np.array(self.taste_features, dtype=object)
+        self.scaler = scaler
+
+        self.checksum = source['checksum']
+        if build_derived:
+            self._build_tiers()
+            self._build_goal_shortlists()
+        return True
+
+    # Write the prepared track data to a snapshot.
+    # Failing to write the snapshot is not fatal; the data is simply parsed again next time.
+    def _write_snapshot(self, snapshot_path: str, stat: os.stat_result) -> None:
+        arrays = {}
+        string_columns = []
+        for column in self.df.columns:
+            if column in ('genre', 'artist'):
+                # Stored as codes below
+                continue
+            elif pd.api.types.is_numeric_dtype(self.df[column]):
+                arrays[column] = self.df[column].to_numpy()
+            else:
+                string_columns.append(column)
+                offsets, data, validity = self._pack_strings(self.df[column])
+                arrays[f'{column}.offsets'] = offsets
+                arrays[f'{column}.data'] = data
+                arrays[f'{column}.validity'] = validity
+
+        for name, codes, names in (('genre', self.genre_codes, self.genres),
+                                   ('artist', self.artist_codes, self.artists)):
+            offsets, data, validity = self._pack_strings(names)
+            arrays[f'{name}.codes'] = codes
+            arrays[f'{name}.names.offsets'] = offsets
+            arrays[f'{name}.names.data'] = data
+            arrays[f'{name}.names.validity'] = validity
+
+        arrays['genre.order'] = self._genre_order
+        arrays['genre.bounds'] = self._genre_bounds
+        arrays['artist.order'] = self._artist_order
+        arrays['artist.bounds'] = self._artist_bounds
+        offsets, data, validity = self._pack_strings(self._artist_search_keys)
+        arrays['artist.search.order'] = self._artist_search_order
+        arrays['artist.search.keys.offsets'] = offsets
+        arrays['artist.search.keys.data'] = data
+        arrays['artist.search.keys.validity'] = validity
+        arrays['track_id.order'] = self._track_id_order
+        arrays['mood.order'] = self._mood_order
+        arrays['mood.bounds'] = self._mood_bounds
+        arrays['mood.boxes'] = self._mood_boxes
+
+        arrays['taste.vectors'] = self.taste_vectors
+        arrays['taste.norms'] = self.taste_norms
+
+        arrays['scaler.mean'] = self.scaler.mean_
+        arrays['scaler.var'] = self.scaler.var_
+        arrays['scaler.scale'] = self.scaler.scale_
+
+        meta = {
+            "version": self.snapshot_version,
+            "source": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "checksum": self.checksum},
+            "columns": list(self.df.columns),
+            "string_columns": string_columns,
+            "scaler_samples_seen": int(self.scaler.n_samples_seen_)
+        }
+
+        try:
+            Snapshot.write(snapshot_path, arrays, meta)
+        except OSError as e:
+            print(f"Failed to write track data snapshot {snapshot_path}: {e}")
+
+    # Encode a column of strings as integer codes into the sorted list of its unique values.
+    # Uses the smallest integer type that fits, matching the codes of a pandas Categorical.
+    @staticmethod
+    def _encode(values: pd.Series) -> tuple[np.ndarray, list[str]]:
+        codes, uniques = pd.factorize(values, sort=True)
+        if len(uniques) < np.iinfo(np.int8).max:
+            dtype = np.int8
+        elif len(uniques) < np.iinfo(np.int16).max:
+            dtype = np.int16
+        else:
+            dtype = np.int32
+        return codes.astype(dtype), [str(value) for value in uniques]
+
+    # Build an index from integer codes to row positions.
+    # Returns the row positions ordered by code (and by position within each code),
+    # and the bounds of each code's positions: code i owns order[bounds[i]:bounds[i + 1]].
+    # Rows without a value (code -1) come before bounds[0] and are not part of the index.
+    @staticmethod
+    def _build_index(codes: np.ndarray, count: int) -> tuple[np.ndarray, np.ndarray]:
+        order = np.argsort(codes, kind='stable').astype(np.int32)
+        bounds = np.searchsorted(codes[order], np.arange(count + 1), side='left').astype(np.int64)
+        return order, bounds
+
+    # Split an index built by _build_index into a dictionary of row positions per name.
+    # The arrays are views into the index, so nothing is copied.
+    @staticmethod
+    def _split_index(names: list[str], order: np.ndarray, bounds: np.ndarray) -> dict[str, np.ndarray]:
+        return {name: order[bounds[i]:bounds[i + 1]] for i, name in enumerate(names)}
+
+    # Pack a column of strings into Arrow's layout: UTF-8 data, start/end offsets and a validity bitmap
+    @staticmethod
+    def _pack_strings(values: pd.Series | list[str] | pa.Array) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        array = pa.array(values, from_pandas=True)
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks()
+        array = array.cast(pa.large_string())
+
+        _, offsets_buffer, data_buffer = array.buffers()
+        offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[array.offset:array.offset + len(array) + 1]
+        if data_buffer is None:
+            data = np.zeros(0, dtype=np.uint8)
+        else:
+            data = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0]:offsets[-1]]
+
+        valid = array.is_valid().to_numpy(zero_copy_only=False)
+        return offsets - offsets[0], data, np.packbits(valid, bitorder='little')
+
+    # Unpack a column of strings written by _pack_strings.
+    # The Arrow array points straight at the given buffers, so nothing is copied.
+    @staticmethod
+    def _unpack_strings(offsets: np.ndarray, data: np.ndarray, validity: np.ndarray) -> pa.LargeStringArray:
+        count = len(offsets) - 1
+        null_count = count - int(np.unpackbits(validity, count=count, bitorder='little').sum())
+        return pa.LargeStringArray.from_buffers(count, pa.py_buffer(offsets), pa.py_buffer(data),
+                                                pa.py_buffer(validity), null_count)
 
-        # Sort artists alphabetically
-        return sorted(artists, key=str.lower)
+    # Get the SHA-256 checksum of a file
+    @staticmethod
+    def _file_checksum(filepath: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
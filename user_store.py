@@ -74,14 +74,14 @@ class UserStore:
             pass
 
         # If none are found, use default preferences.
-        # Include artists from the user's listening history.
+        # Include artists from the user's listening history that are in the track data.
         if prefs:
             prefs_loaded = True
         else:
             prefs_loaded = False
             prefs = self.default_preferences.copy()
             try:
-                prefs['artists'] = self.app.spotify_service.get_top_artists()
+                prefs['artists'] = self.app.track_data.filter_artists(self.app.spotify_service.get_top_artists())
             except Exception:
                 pass
 
@@ -102,6 +102,10 @@ class UserStore:
         if not isinstance(preferences, dict):
             raise ValueError("Invalid preferences format")
 
+        # Drop artists that are not in the track data
+        if isinstance(preferences.get('artists'), list):
+            preferences['artists'] = self.app.track_data.filter_artists(preferences['artists'])
+
         # Sanitise data
         preferences = Util.sanitise_data(preferences)
 